@@ -47,6 +47,7 @@ module "dms" {
   region                 = var.region
   dms_security_group_ids = [module.vpc.dms_security_group_id]
   server_name            = module.ec2.postgres_private_ip
+  enable_cdc             = var.enable_cdc
 }
 
 
@@ -84,6 +85,7 @@ module "mwaa" {
   emr_sg_master            = module.vpc.emr_managed_master_security_group
   emr_sg_core              = module.vpc.emr_core_sg_id
   emr_sg_service           = module.vpc.emr_service_access_sg_id
+  postgresql_secret_name   = var.postgresql_secret_name
 }
 
 
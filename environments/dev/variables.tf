@@ -24,6 +24,11 @@ variable "key_name" {}
 
 # DMS
 variable "postgresql_secret_name" {}
+variable "enable_cdc" {
+  description = "Run the DMS task as full-load-and-cdc, for the incremental write mode"
+  type        = bool
+  default     = false
+}
 # variable "s3_bucket_name" {}
 # variable "vpc_id" {}
 # variable "subnet_ids" {}
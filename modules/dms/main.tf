@@ -178,9 +178,13 @@ resource "aws_dms_s3_endpoint" "s3_target" {
   bucket_folder = var.bucket_folder # each.value.s3_prefix
   # add_column_name          = false  # for cdc 
   # cdc_path                 = "" // <== disables default schema/table suffix
-  # date_partition_enabled = true  # cdc
-  # date_partition_sequence  = "YYYYMMDD" # cdc optional, default is this format
-  # date_partition_delimiter = "SLASH"    # cdc default is "/"
+  # CDC files land under <table>/YYYY/MM/DD/ with the Op column and commit timestamp,
+  # which the incremental mode of bronze_to_silver.py merges into the silver tables
+  date_partition_enabled   = var.enable_cdc
+  date_partition_sequence  = var.enable_cdc ? "YYYYMMDD" : null
+  date_partition_delimiter = var.enable_cdc ? "SLASH" : null
+  timestamp_column_name    = var.enable_cdc ? "dms_commit_ts" : null
+
   data_format             = "parquet"
   parquet_version         = "parquet-1-0"
   compression_type        = "gzip" # Only "gzip" or "none" supported for DMS
@@ -193,7 +197,7 @@ resource "aws_dms_replication_task" "tables" {
   # for_each = local.dms_tasks
 
   replication_task_id      = "imba-tables" # "${each.key}-table"
-  migration_type           = "full-load"   # or full-load-and-cdc
+  migration_type           = var.enable_cdc ? "full-load-and-cdc" : "full-load"
   replication_instance_arn = aws_dms_replication_instance.dms_instance.replication_instance_arn
   source_endpoint_arn      = aws_dms_endpoint.postgres_source.endpoint_arn
   target_endpoint_arn      = aws_dms_s3_endpoint.s3_target.endpoint_arn # aws_dms_s3_endpoint.s3_target[each.key].endpoint_arn
@@ -216,4 +220,10 @@ resource "aws_dms_replication_task" "tables" {
   replication_task_settings = file("${path.module}/dms-task-settings.json")
   start_replication_task    = false # do not run after creating task
 
+  # With {"source_gate": "tables"} the DAG narrows the mappings to the changed tables
+  # (source_fingerprint.apply_table_mappings), and the next skip/off run restores them.
+  # Terraform owns the initial mappings only, so an apply does not revert a run's selection.
+  lifecycle {
+    ignore_changes = [table_mappings]
+  }
 }
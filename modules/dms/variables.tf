@@ -34,3 +34,9 @@ variable "server_name" {
   description = "Private IP of the PostgreSQL EC2 instance"
   type        = string
 }
+
+variable "enable_cdc" {
+  description = "Capture ongoing changes (full-load-and-cdc) for the incremental silver load"
+  type        = bool
+  default     = false
+}
@@ -125,6 +125,29 @@ resource "aws_s3_object" "pyspark_script" {
   etag   = filemd5("${path.module}/../../scripts/pyspark/bronze_to_silver.py")
 }
 
+# Iceberg maintenance job, submitted with bronze_to_silver.py as --py-files
+resource "aws_s3_object" "maintenance_script" {
+  bucket = var.script_bucket
+  key    = "scripts/pyspark/iceberg_maintenance.py"
+  source = "${path.module}/../../scripts/pyspark/iceberg_maintenance.py"
+  etag   = filemd5("${path.module}/../../scripts/pyspark/iceberg_maintenance.py")
+}
+
+# Feature store export job and its reader/writer module, submitted with bronze_to_silver.py
+resource "aws_s3_object" "feature_store_export_script" {
+  bucket = var.script_bucket
+  key    = "scripts/pyspark/feature_store_export.py"
+  source = "${path.module}/../../scripts/pyspark/feature_store_export.py"
+  etag   = filemd5("${path.module}/../../scripts/pyspark/feature_store_export.py")
+}
+
+resource "aws_s3_object" "feature_store_module" {
+  bucket = var.script_bucket
+  key    = "scripts/pyspark/feature_store.py"
+  source = "${path.module}/../../scripts/pyspark/feature_store.py"
+  etag   = filemd5("${path.module}/../../scripts/pyspark/feature_store.py")
+}
+
 # -------------------------------------------------------------------
 # EMR cluster : removed since DAG creates EMR cluster and step
 # -------------------------------------------------------------------
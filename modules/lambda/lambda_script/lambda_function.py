@@ -1,13 +1,38 @@
 import os
 import json
+import threading
 import boto3
 import pyarrow as pa
 import pyarrow.parquet as pq
 import snowflake.connector
-from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from datetime import datetime
 import socket
 
+# Rows per Parquet row group: Snowflake Arrow batches are buffered up to this size
+ROW_GROUP_ROWS = 1_000_000
+# Roll over to a new Parquet file once this many (compressed) bytes have been written
+MAX_FILE_BYTES = 512 * 1024 * 1024
+# S3 multipart part size (S3 minimum is 5 MiB, except for the last part)
+PART_SIZE = 16 * 1024 * 1024
+
+# Tables to export and the integer key their chunks are ranged on
+TABLE_KEYS = {
+    "products": "product_id",
+    "aisles": "aisle_id",
+    "departments": "department_id",
+    "orders": "order_id",
+    "order_products__prior": "order_id",
+    "order_products__train": "order_id",
+}
+OUTPUT_PREFIX = "snowflake-parquet"
+# Target rows per chunk; a table is split into equal-width key ranges of about this size
+CHUNK_ROWS = 5_000_000
+# Concurrent chunk exports (one Snowflake cursor each)
+MAX_WORKERS = int(os.environ.get("EXPORT_WORKERS", "4"))
+# Stop starting new chunks when less than this is left of the Lambda timeout
+TIME_MARGIN_MS = 3 * 60 * 1000
+
 def test_connectivity():
     try:
         socket.create_connection(("snowflakecomputing.com", 443), timeout=5)
@@ -21,15 +46,295 @@ def get_snowflake_credentials(secret_name):
     secret_value = client.get_secret_value(SecretId=secret_name)
     return json.loads(secret_value["SecretString"])
 
-def write_parquet_to_s3(table, bucket, key):
-    """Write an Arrow Table to S3 in Parquet format"""
-    buffer = BytesIO()
-    pq.write_table(table, buffer)
-    buffer.seek(0)
+class S3MultipartWriter:
+    """Write-only file object streaming to S3 with a multipart upload.
 
-    s3 = boto3.client("s3")
-    s3.upload_fileobj(buffer, bucket, key)
-    print(f"✅ Uploaded to s3://{bucket}/{key}")
+    At most one part is held in memory. Nothing is visible under the key until close()
+    completes the upload; abort() discards the uploaded parts.
+    """
+
+    def __init__(self, s3, bucket, key, part_size=PART_SIZE):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        self.upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+        self.parts = []
+        self.buffer = bytearray()
+        self.position = 0
+        self.closed = False
+
+    def writable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def tell(self):
+        return self.position
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        if len(self.buffer) >= self.part_size:
+            self._upload_part()
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def _upload_part(self):
+        part_number = len(self.parts) + 1
+        response = self.s3.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=bytes(self.buffer)
+        )
+        self.parts.append({"PartNumber": part_number, "ETag": response["ETag"]})
+        self.buffer = bytearray()
+
+    def close(self):
+        if self.closed:
+            return
+        if self.buffer or not self.parts:
+            self._upload_part()
+        self.s3.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={"Parts": self.parts}
+        )
+        self.closed = True
+        print(f"✅ Uploaded to s3://{self.bucket}/{self.key}")
+
+    def abort(self):
+        if not self.closed:
+            self.closed = True
+            self.s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+
+def normalize_schema(schema):
+    """Widen integer columns to int64.
+
+    The connector picks the narrowest integer type per batch for NUMBER columns, so the
+    same column can arrive as int8 in one batch and int32 in the next.
+    """
+    return pa.schema([
+        pa.field(field.name, pa.int64(), field.nullable) if pa.types.is_integer(field.type) else field
+        for field in schema
+    ])
+
+class ParquetS3Sink:
+    """Streams Arrow batches into size-capped Parquet files on S3 (<name_prefix>_00000.parquet, ...)"""
+
+    def __init__(self, s3, bucket, key_prefix, name_prefix="part", row_group_rows=ROW_GROUP_ROWS, max_file_bytes=MAX_FILE_BYTES):
+        self.s3 = s3
+        self.bucket = bucket
+        self.key_prefix = key_prefix
+        self.name_prefix = name_prefix
+        self.row_group_rows = row_group_rows
+        self.max_file_bytes = max_file_bytes
+        self.schema = None
+        self.pending = []
+        self.pending_rows = 0
+        self.file = None
+        self.writer = None
+        self.keys = []
+        self.rows = 0
+
+    def write(self, table):
+        if self.schema is None:
+            self.schema = normalize_schema(table.schema)
+        table = table.cast(self.schema)
+        self.pending.append(table)
+        self.pending_rows += table.num_rows
+        if self.pending_rows >= self.row_group_rows:
+            self._write_row_group()
+
+    def _write_row_group(self):
+        if not self.pending_rows:
+            return
+        if self.writer is None:
+            key = f"{self.key_prefix}/{self.name_prefix}_{len(self.keys):05d}.parquet"
+            self.file = S3MultipartWriter(self.s3, self.bucket, key)
+            self.writer = pq.ParquetWriter(self.file, self.schema, compression="snappy")
+            self.keys.append(key)
+
+        table = pa.concat_tables(self.pending)
+        self.writer.write_table(table, row_group_size=self.row_group_rows)
+        self.rows += table.num_rows
+        self.pending, self.pending_rows = [], 0
+
+        if self.file.tell() >= self.max_file_bytes:
+            self._close_file()
+
+    def _close_file(self):
+        self.writer.close()
+        self.file.close()
+        self.writer, self.file = None, None
+
+    def close(self):
+        self._write_row_group()
+        if self.writer is not None:
+            self._close_file()
+        return self.keys
+
+    def abort(self):
+        if self.file is not None:
+            self.file.abort()
+
+def export_query(cur, query, s3, bucket, key_prefix, name_prefix="part"):
+    """Run a query and stream its Arrow result batches to Parquet files under key_prefix"""
+    cur.execute(query)
+    sink = ParquetS3Sink(s3, bucket, key_prefix, name_prefix)
+    try:
+        for batch in cur.fetch_arrow_batches():
+            sink.write(batch)
+        keys = sink.close()
+    except Exception:
+        try:
+            sink.abort()
+        except Exception as abort_error:
+            # The bucket lifecycle rule removes the parts later; the query or write error is the one to report
+            print(f"⚠️ Could not abort the multipart upload: {abort_error}")
+        raise
+    return keys, sink.rows
+
+class ExportManifest:
+    """Checkpoint of a chunked export, kept as JSON in S3 next to the exported data.
+
+    The first invocation plans the chunks and saves them as pending; every finished chunk is
+    marked done (with its keys and row count) straight away, so a retried or follow-up
+    invocation only runs the chunks that are still pending.
+    """
+
+    def __init__(self, s3, bucket, date_prefix):
+        self.s3 = s3
+        self.bucket = bucket
+        self.date_prefix = date_prefix
+        self.key = f"{OUTPUT_PREFIX}/_manifests/{date_prefix}/manifest.json"
+        self.success_key = f"{OUTPUT_PREFIX}/_manifests/{date_prefix}/_SUCCESS"
+        self.lock = threading.Lock()
+        self.chunks = None
+
+    def load(self):
+        try:
+            body = self.s3.get_object(Bucket=self.bucket, Key=self.key)["Body"].read()
+        except self.s3.exceptions.NoSuchKey:
+            return False
+        self.chunks = json.loads(body)["chunks"]
+        return True
+
+    def save(self):
+        with self.lock:
+            body = json.dumps({"date_prefix": self.date_prefix, "chunks": self.chunks}, indent=2)
+            self.s3.put_object(Bucket=self.bucket, Key=self.key, Body=body.encode())
+
+    def pending(self):
+        return [chunk for chunk in self.chunks if chunk["status"] != "done"]
+
+    def mark_done(self, chunk, keys, rows):
+        with self.lock:
+            chunk.update(status="done", keys=keys, rows=rows)
+        self.save()
+
+    def commit(self):
+        """Write the marker telling readers every table of the date prefix is complete"""
+        summary = {chunk["table"]: 0 for chunk in self.chunks}
+        for chunk in self.chunks:
+            summary[chunk["table"]] += chunk["rows"]
+        self.s3.put_object(Bucket=self.bucket, Key=self.success_key, Body=json.dumps(summary).encode())
+        print(f"✅ Committed s3://{self.bucket}/{self.success_key}")
+
+def plan_chunks(cur, tables=TABLE_KEYS, chunk_rows=CHUNK_ROWS):
+    """Split every table into key ranges of about chunk_rows rows ([lower, upper) on its key)"""
+    chunks = []
+    for table, key in tables.items():
+        cur.execute(f"SELECT COUNT(*), MIN({key}), MAX({key}) FROM {table}")
+        rows, lowest, highest = cur.fetchone()
+        if not rows:
+            chunks.append({"id": f"{table}-0000", "table": table, "key": key, "lower": None, "upper": None})
+            continue
+
+        count = max(1, -(-rows // chunk_rows))
+        width = -(-(highest - lowest + 1) // count)
+        for index in range(count):
+            lower = lowest + index * width
+            upper = min(lower + width, highest + 1)
+            if lower > highest:
+                break
+            chunks.append({"id": f"{table}-{index:04d}", "table": table, "key": key, "lower": lower, "upper": upper})
+        print(f"📋 {table}: {rows} rows in {count} chunks")
+
+    for chunk in chunks:
+        chunk.update(status="pending", keys=[], rows=0)
+    return chunks
+
+def chunk_query(chunk):
+    if chunk["lower"] is None:
+        return f"SELECT * FROM {chunk['table']}"
+    return (f"SELECT * FROM {chunk['table']} "
+            f"WHERE {chunk['key']} >= {chunk['lower']} AND {chunk['key']} < {chunk['upper']}")
+
+def delete_prefix(s3, bucket, prefix):
+    """Remove files left behind by an earlier, interrupted attempt of a chunk"""
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        objects = [{"Key": obj["Key"]} for obj in page.get("Contents", [])]
+        if objects:
+            response = s3.delete_objects(Bucket=bucket, Delete={"Objects": objects})
+            # delete_objects reports per-key failures (e.g. AccessDenied) instead of raising
+            errors = response.get("Errors", [])
+            if errors:
+                failed = ", ".join(f"{e['Key']} ({e.get('Code')})" for e in errors[:5])
+                raise RuntimeError(f"Could not delete {len(errors)} stale files under s3://{bucket}/{prefix}: {failed}")
+
+def export_chunk(conn, s3, bucket, manifest, chunk):
+    """Export one chunk and checkpoint it as soon as its files are complete"""
+    key_prefix = f"{OUTPUT_PREFIX}/{chunk['table']}/{manifest.date_prefix}"
+    name_prefix = f"part_{chunk['id'].rsplit('-', 1)[1]}"
+    delete_prefix(s3, bucket, f"{key_prefix}/{name_prefix}_")
+    with conn.cursor() as cur:
+        keys, rows = export_query(cur, chunk_query(chunk), s3, bucket, key_prefix, name_prefix)
+    manifest.mark_done(chunk, keys, rows)
+    print(f"✅ Exported chunk {chunk['id']}: {rows} rows in {len(keys)} files")
+
+def run_export(conn, s3, bucket, date_prefix, remaining_ms=lambda: float("inf"), max_workers=MAX_WORKERS):
+    """Export the pending chunks of a date prefix concurrently, checkpointing each one.
+
+    conn only needs cursor() (DB-API with fetch_arrow_batches) and s3 the boto3 S3 client calls
+    used here, so the export can run locally against fake cursors and a moto S3 stand-in.
+    Returns the number of chunks still pending (0 once the date prefix is committed).
+    """
+    manifest = ExportManifest(s3, bucket, date_prefix)
+    if manifest.load():
+        print(f"🔁 Resuming {date_prefix}: {len(manifest.pending())} of {len(manifest.chunks)} chunks pending")
+    else:
+        with conn.cursor() as cur:
+            manifest.chunks = plan_chunks(cur)
+        manifest.save()
+
+    pending = manifest.pending()
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures, running = [], set()
+        for chunk in pending:
+            # Leave room for the running chunks to finish before the Lambda timeout
+            if remaining_ms() < TIME_MARGIN_MS:
+                print("⏱️ Close to the timeout, leaving the remaining chunks for the next invocation")
+                break
+            future = executor.submit(export_chunk, conn, s3, bucket, manifest, chunk)
+            futures.append(future)
+            running.add(future)
+            # Submit lazily so the time check sees chunks start, not a queue filled up front:
+            # block until a worker is free
+            if len(running) >= max_workers:
+                _, running = wait(running, return_when=FIRST_COMPLETED)
+
+    # Finished chunks are already checkpointed; surface the first failure for the retry
+    errors = [f.exception() for f in futures if f.exception() is not None]
+    if errors:
+        raise errors[0]
+
+    remaining = len(manifest.pending())
+    if remaining == 0:
+        manifest.commit()
+    return remaining
 
 def lambda_handler(event, context):
     # Optional connectivity check
@@ -38,19 +343,12 @@ def lambda_handler(event, context):
     secret_name = os.environ["SNOWFLAKE_SECRET_NAME"]
     s3_bucket = os.environ["S3_OUTPUT_BUCKET"]
 
+    # A follow-up invocation passes the date prefix of the export it resumes
     today = datetime.utcnow()
-    date_prefix = f"{today.year:04d}/{today.month:02d}/{today.day:02d}"
-
-    tables = [
-        "products",
-        "aisles",
-        "departments",
-        "orders",
-        "order_products__prior",
-        "order_products__train"
-    ]
+    date_prefix = (event or {}).get("date_prefix") or f"{today.year:04d}/{today.month:02d}/{today.day:02d}"
 
     creds = get_snowflake_credentials(secret_name)
+    s3 = boto3.client("s3")
 
     conn = snowflake.connector.connect(
         user=creds["USERNAME"],
@@ -63,39 +361,21 @@ def lambda_handler(event, context):
     )
 
     try:
-        with conn.cursor() as cur:
-            for table in tables:
-                batch_size = 300000
-                print(f"🔄 Fetching {table}...")
-
-                cur.execute(f"SELECT * FROM {table}")
-                column_names = [desc[0] for desc in cur.description]
-
-                counter = 0
-                while True:
-                    rows = cur.fetchmany(batch_size)
-                    if not rows:
-                        break
-
-                    # Transpose rows to columns
-                    columns = list(zip(*rows)) if rows else []
-                    arrays = [pa.array(col) for col in columns]
-                    batch = pa.record_batch(arrays, names=column_names)
-                    table_arrow = pa.Table.from_batches([batch])
-
-                    s3_key = f"snowflake-parquet/{table}/{date_prefix}/part_{counter:05d}.parquet"
-                    write_parquet_to_s3(table_arrow, s3_bucket, s3_key)
-                    print(f"✅ Uploaded batch {counter} for {table}")
-                    counter += 1
-
+        remaining = run_export(conn, s3, s3_bucket, date_prefix, context.get_remaining_time_in_millis)
+        if remaining:
+            return {
+                "statusCode": 202,
+                "body": json.dumps({"date_prefix": date_prefix, "pending_chunks": remaining})
+            }
         return {
             "statusCode": 200,
-            "body": f"Tables saved under snowflake-parquet/{date_prefix}/"
+            "body": f"Tables saved under {OUTPUT_PREFIX}/<table>/{date_prefix}/"
         }
 
     except Exception as e:
+        # Chunks finished so far stay checkpointed; a retry resumes from the manifest
         print("❌ Error:", e)
-        return {"statusCode": 500, "body": str(e)}
+        return {"statusCode": 500, "body": json.dumps({"date_prefix": date_prefix, "error": str(e)})}
 
     finally:
-        conn.close()
\ No newline at end of file
+        conn.close()
@@ -26,6 +26,8 @@ resource "aws_iam_policy" "lambda_s3_secrets_policy" {
         Action = [
           "s3:GetObject",
           "s3:PutObject",
+          "s3:DeleteObject",
+          "s3:AbortMultipartUpload",
           "s3:ListBucket"
         ],
         Resource = [
@@ -57,6 +57,8 @@ resource "aws_mwaa_environment" "this" {
 
   depends_on = [
     aws_s3_object.dag_script,
+    aws_s3_object.emr_lease_module,
+    aws_s3_object.source_fingerprint_module,
     aws_s3_object.requirements_txt,
     aws_iam_role_policy_attachment.attach_combined_policy
   ]
@@ -184,11 +186,24 @@ resource "aws_iam_policy" "mwaa_combined_policy" {
         Effect = "Allow",
         Action = [
           "dms:StartReplicationTask",
-          "dms:DescribeReplicationTasks"
+          "dms:DescribeReplicationTasks",
+          "dms:ModifyReplicationTask"
         ],
         Resource = "arn:aws:dms:${var.region}:${data.aws_caller_identity.current.account_id}:*:*"
       },
 
+      # Source change detection: PostgreSQL credentials and the last run's fingerprint
+      {
+        Effect   = "Allow",
+        Action   = "secretsmanager:GetSecretValue",
+        Resource = "arn:aws:secretsmanager:${var.region}:${data.aws_caller_identity.current.account_id}:secret:${var.postgresql_secret_name}-*"
+      },
+      {
+        Effect   = "Allow",
+        Action   = "s3:PutObject",
+        Resource = "${var.dag_bucket_arn}/emr-logs/imba-source/*"
+      },
+
       # EMR actions (correct service prefix)
       {
         Effect = "Allow",
@@ -198,6 +213,10 @@ resource "aws_iam_policy" "mwaa_combined_policy" {
           "elasticmapreduce:TerminateJobFlows",
           "elasticmapreduce:AddJobFlowSteps",
           "elasticmapreduce:DescribeStep",
+          "elasticmapreduce:ListClusters",
+          "elasticmapreduce:AddTags",
+          "elasticmapreduce:RemoveTags",
+          "elasticmapreduce:PutAutoTerminationPolicy",
           "iam:PassRole"
         ],
         Resource = "*"
@@ -253,15 +272,19 @@ resource "aws_iam_role_policy_attachment" "attach_combined_policy" {
 #-------------------
 resource "local_file" "generated_dag" {
   content = templatefile("${path.module}/../../scripts/dags/dms_to_emr_pipeline.py.tmpl", {
-    dms_task_arn         = var.dms_task_arn
-    script_s3_path       = "s3://${var.dag_bucket_name}/scripts/pyspark/bronze_to_silver.py"
-    log_uri              = "s3://${var.dag_bucket_name}/emr-logs/"
-    emr_role             = var.emr_role
-    ec2_instance_profile = var.emr_ec2_instance_profile
-    subnet_id            = var.subnet_id
-    emr_sg_master        = var.emr_sg_master
-    emr_sg_core          = var.emr_sg_core
-    emr_sg_service       = var.emr_sg_service
+    dms_task_arn                 = var.dms_task_arn
+    script_s3_path               = "s3://${var.dag_bucket_name}/scripts/pyspark/bronze_to_silver.py"
+    maintenance_script_s3_path   = "s3://${var.dag_bucket_name}/scripts/pyspark/iceberg_maintenance.py"
+    feature_store_script_s3_path = "s3://${var.dag_bucket_name}/scripts/pyspark/feature_store_export.py"
+    feature_store_module_s3_path = "s3://${var.dag_bucket_name}/scripts/pyspark/feature_store.py"
+    log_uri                      = "s3://${var.dag_bucket_name}/emr-logs/"
+    emr_role                     = var.emr_role
+    ec2_instance_profile         = var.emr_ec2_instance_profile
+    subnet_id                    = var.subnet_id
+    emr_sg_master                = var.emr_sg_master
+    emr_sg_core                  = var.emr_sg_core
+    emr_sg_service               = var.emr_sg_service
+    source_secret_name           = var.postgresql_secret_name
     # emr_ec2_instance_profile = var.emr_ec2_instance_profile
   })
 
@@ -278,6 +301,22 @@ resource "aws_s3_object" "dag_script" {
   depends_on = [local_file.generated_dag]
 }
 
+# Imported by the DAG for cluster leasing (cluster_mode = "lease")
+resource "aws_s3_object" "emr_lease_module" {
+  bucket = var.dag_bucket_name
+  key    = "scripts/mwaa/dags/emr_lease.py"
+  source = "${path.module}/../../scripts/dags/emr_lease.py"
+  etag   = filemd5("${path.module}/../../scripts/dags/emr_lease.py")
+}
+
+# Imported by the DAG for source change detection (detect_source_changes)
+resource "aws_s3_object" "source_fingerprint_module" {
+  bucket = var.dag_bucket_name
+  key    = "scripts/mwaa/dags/source_fingerprint.py"
+  source = "${path.module}/../../scripts/dags/source_fingerprint.py"
+  etag   = filemd5("${path.module}/../../scripts/dags/source_fingerprint.py")
+}
+
 resource "aws_s3_object" "requirements_txt" {
   bucket = var.dag_bucket_name
   key    = "scripts/mwaa/requirements.txt"
@@ -35,3 +35,9 @@ variable "emr_sg_core" {}
 variable "emr_sg_service" {}
 
 variable "emr_ec2_instance_profile" {}
+
+variable "postgresql_secret_name" {
+  description = "Name of the PostgreSQL (DMS source) secret, read by the source change detection"
+  type        = string
+  default     = "postgresql_dms"
+}
@@ -15,3 +15,19 @@ resource "aws_s3_bucket_versioning" "versioning" {
     status = "Enabled"
   }
 }
+
+# Parts of multipart uploads that were never completed or aborted (e.g. a Lambda timing out
+# mid-export) are billed until removed
+resource "aws_s3_bucket_lifecycle_configuration" "abort_incomplete_uploads" {
+  for_each = aws_s3_bucket.buckets
+
+  bucket = each.value.id
+  rule {
+    id     = "abort-incomplete-multipart-uploads"
+    status = "Enabled"
+    filter {}
+    abort_incomplete_multipart_upload {
+      days_after_initiation = var.abort_incomplete_upload_days
+    }
+  }
+}
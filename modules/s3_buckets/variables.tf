@@ -6,3 +6,9 @@ variable "bucket_names" {
     error_message = "You must provide exactly two bucket names."
   }
 }
+
+variable "abort_incomplete_upload_days" {
+  description = "Days after which incomplete multipart uploads are aborted"
+  type        = number
+  default     = 7
+}
@@ -178,6 +178,16 @@ resource "aws_security_group_rule" "postgres_ingress_pgsql_from_dms" {
   description              = "Allow PostgreSQL from DMS"
 }
 
+resource "aws_security_group_rule" "postgres_ingress_pgsql_from_mwaa" {
+  type                     = "ingress"
+  from_port                = 5432
+  to_port                  = 5432
+  protocol                 = "tcp"
+  source_security_group_id = aws_security_group.mwaa.id
+  security_group_id        = aws_security_group.postgres.id
+  description              = "Allow PostgreSQL from MWAA (source change detection)"
+}
+
 
 
 # DMS Security Group
@@ -0,0 +1,316 @@
+"""Parallel bulk loader for the PostgreSQL source tables.
+
+Loads the Instacart CSVs into the tables of init/init.sql, faster than running init.sql:
+
+- tables load concurrently over --workers connections, and CSVs larger than --chunk-mb are
+  split at line boundaries into parallel COPY FROM STDIN streams,
+- tables are created without primary keys; keys are built and the tables ANALYZEd once the
+  data is in,
+- type transforms happen in a single pass: orders is copied into an unlogged staging table and
+  inserted once with days_since_prior rounded to INTEGER, instead of an UPDATE and an
+  ALTER COLUMN TYPE that each rewrite the table.
+
+The final tables are regular (logged) tables, so DMS can replicate them with logical decoding.
+Files are read client-side, so the database needs no access to them:
+
+    python postgresql/bulk_load.py --dsn "host=localhost dbname=imba user=postgres" --data /tmp/data --workers 8
+
+Splitting assumes no quoted newlines in the CSVs (true for the Instacart files). Gzipped
+files (*.csv.gz) are used when the plain CSV is missing and load as a single stream.
+"""
+import argparse
+import gzip
+import io
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import psycopg2
+
+# Columns and types of init/init.sql, in CSV order
+TABLES = {
+    "orders": [
+        ("order_id", "INTEGER NOT NULL"),
+        ("user_id", "INTEGER NOT NULL"),
+        ("eval_set", "VARCHAR(20) NOT NULL"),
+        ("order_number", "INTEGER NOT NULL"),
+        ("order_dow", "INTEGER NOT NULL"),
+        ("order_hour_of_day", "INTEGER NOT NULL"),
+        ("days_since_prior", "INTEGER"),
+    ],
+    "aisles": [
+        ("aisle_id", "INTEGER NOT NULL"),
+        ("aisle", "VARCHAR(255) NOT NULL"),
+    ],
+    "departments": [
+        ("department_id", "INTEGER NOT NULL"),
+        ("department", "VARCHAR(255) NOT NULL"),
+    ],
+    "products": [
+        ("product_id", "INTEGER NOT NULL"),
+        ("product_name", "VARCHAR(255) NOT NULL"),
+        ("aisle_id", "INTEGER NOT NULL"),
+        ("department_id", "INTEGER NOT NULL"),
+    ],
+    "order_products__prior": [
+        ("order_id", "INTEGER NOT NULL"),
+        ("product_id", "INTEGER NOT NULL"),
+        ("add_to_cart_order", "INTEGER NOT NULL"),
+        ("reordered", "BOOLEAN NOT NULL"),
+    ],
+    "order_products__train": [
+        ("order_id", "INTEGER NOT NULL"),
+        ("product_id", "INTEGER NOT NULL"),
+        ("add_to_cart_order", "INTEGER NOT NULL"),
+        ("reordered", "BOOLEAN NOT NULL"),
+    ],
+}
+PRIMARY_KEYS = {
+    "orders": ["order_id"],
+    "aisles": ["aisle_id"],
+    "departments": ["department_id"],
+    "products": ["product_id"],
+}
+# Columns loaded through a staging table: (staging type, expression producing the final value)
+TRANSFORMS = {
+    "orders": {"days_since_prior": ("REAL", "round(days_since_prior)::INTEGER")},
+}
+STAGING_PREFIX = "_stage_"
+CHUNK_BYTES = 64 * 1024 * 1024
+LOAD_SETTINGS = {
+    # A crash only loses the load, which is rerun from scratch
+    "synchronous_commit": "off",
+    "maintenance_work_mem": "512MB",
+}
+
+logger = logging.getLogger("bulk_load")
+
+
+class CsvRange(io.RawIOBase):
+    """Read-only view of bytes [start, end) of a file, for one COPY stream"""
+
+    def __init__(self, path: str, start: int, end: int):
+        self.f = open(path, "rb")
+        self.f.seek(start)
+        self.remaining = end - start
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        if size is None or size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.f.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def readline(self, size=-1):
+        line = self.f.readline(self.remaining if size is None or size < 0 else min(size, self.remaining))
+        self.remaining -= len(line)
+        return line
+
+    def close(self):
+        self.f.close()
+        super().close()
+
+
+def source_file(data: str, table: str) -> str:
+    for name in (f"{table}.csv", f"{table}.csv.gz"):
+        path = os.path.join(data, name)
+        if os.path.exists(path):
+            return path
+    raise FileNotFoundError(f"No {table}.csv(.gz) in {data}")
+
+
+def split_csv(path: str, chunk_bytes: int = CHUNK_BYTES) -> list:
+    """(start, end) byte ranges of whole lines after the header, about chunk_bytes each"""
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        f.readline()
+        start = f.tell()
+        ranges = []
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            if f.tell() < size:
+                f.readline()
+            end = f.tell()
+            ranges.append((start, end))
+            start = end
+    # A header-only file still gets one (empty) stream, so the table is finalized
+    return ranges or [(start, start)]
+
+
+def plan_streams(data: str, tables: list, chunk_bytes: int = CHUNK_BYTES) -> list:
+    """(table, path, start, end) COPY streams, largest tables first; gzipped files are one stream"""
+    streams = []
+    for table in tables:
+        path = source_file(data, table)
+        if path.endswith(".gz"):
+            streams.append((table, path, None, None))
+        else:
+            streams.extend((table, path, start, end) for start, end in split_csv(path, chunk_bytes))
+    sizes = {table: os.path.getsize(source_file(data, table)) for table in tables}
+    return sorted(streams, key=lambda stream: -sizes[stream[0]])
+
+
+def connect(dsn: str):
+    conn = psycopg2.connect(dsn)
+    with conn.cursor() as cur:
+        for name, value in LOAD_SETTINGS.items():
+            cur.execute(f"SET {name} = %s", (value,))
+    return conn
+
+
+def load_table_name(table: str) -> str:
+    """Table the CSV is copied into: the staging table for transformed tables"""
+    return f"{STAGING_PREFIX}{table}" if table in TRANSFORMS else table
+
+
+def create_tables(dsn: str, tables: list) -> None:
+    """Drop and create the target tables (no keys) and the unlogged staging tables"""
+    conn = connect(dsn)
+    try:
+        with conn, conn.cursor() as cur:
+            for table in tables:
+                columns = TABLES[table]
+                cur.execute(f"DROP TABLE IF EXISTS {table}")
+                cur.execute(f"CREATE TABLE {table} ({', '.join(f'{name} {kind}' for name, kind in columns)})")
+                if table in TRANSFORMS:
+                    staged = [
+                        (name, TRANSFORMS[table][name][0] if name in TRANSFORMS[table] else kind)
+                        for name, kind in columns
+                    ]
+                    cur.execute(f"DROP TABLE IF EXISTS {load_table_name(table)}")
+                    cur.execute(
+                        f"CREATE UNLOGGED TABLE {load_table_name(table)} "
+                        f"({', '.join(f'{name} {kind}' for name, kind in staged)})"
+                    )
+    finally:
+        conn.close()
+
+
+def copy_stream(dsn: str, table: str, path: str, start: int, end: int):
+    """COPY one byte range (or a whole gzipped file) into the table's load target; (started, rows)"""
+    started = time.time()
+    columns = ", ".join(name for name, _ in TABLES[table])
+    conn = connect(dsn)
+    try:
+        if start is None:
+            source = gzip.open(path, "rb")
+            source.readline()
+        else:
+            source = CsvRange(path, start, end)
+        with conn, conn.cursor() as cur, source:
+            cur.copy_expert(f"COPY {load_table_name(table)} ({columns}) FROM STDIN WITH (FORMAT csv)", source)
+            return started, cur.rowcount
+    finally:
+        conn.close()
+
+
+def finalize_table(dsn: str, table: str) -> None:
+    """Apply the staging transforms in one INSERT, then build the primary key and ANALYZE"""
+    conn = connect(dsn)
+    try:
+        with conn, conn.cursor() as cur:
+            if table in TRANSFORMS:
+                columns = [name for name, _ in TABLES[table]]
+                expressions = [TRANSFORMS[table].get(name, (None, name))[1] for name in columns]
+                cur.execute(
+                    f"INSERT INTO {table} ({', '.join(columns)}) "
+                    f"SELECT {', '.join(expressions)} FROM {load_table_name(table)}"
+                )
+                cur.execute(f"DROP TABLE {load_table_name(table)}")
+            if table in PRIMARY_KEYS:
+                cur.execute(f"ALTER TABLE {table} ADD PRIMARY KEY ({', '.join(PRIMARY_KEYS[table])})")
+        # ANALYZE outside the load transaction, so the statistics see the committed rows
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute(f"ANALYZE {table}")
+    finally:
+        conn.close()
+
+
+def bulk_load(dsn: str, data: str, tables: list = None, workers: int = 4, chunk_bytes: int = CHUNK_BYTES) -> dict:
+    """Load the tables and return per-table rows, seconds and rows/sec"""
+    tables = tables or list(TABLES)
+    create_tables(dsn, tables)
+    streams = plan_streams(data, tables, chunk_bytes)
+    pending_streams = {table: sum(1 for stream in streams if stream[0] == table) for table in tables}
+    stats = {table: {"rows": 0, "streams": pending_streams[table], "started": float("inf")} for table in tables}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        running = {}
+        for table, path, start, end in streams:
+            running[pool.submit(copy_stream, dsn, table, path, start, end)] = ("copy", table)
+
+        errors = []
+        while running:
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                step, table = running.pop(future)
+                if future.cancelled():
+                    continue
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.error(f"❌ {step} of {table} failed: {e}")
+                    errors.append(e)
+                    continue
+                if step == "copy":
+                    started, rows = result
+                    stats[table]["started"] = min(stats[table]["started"], started)
+                    stats[table]["rows"] += rows
+                    pending_streams[table] -= 1
+                    if pending_streams[table] == 0 and not errors:
+                        stats[table]["loaded"] = time.time()
+                        running[pool.submit(finalize_table, dsn, table)] = ("finalize", table)
+                else:
+                    stats[table]["finished"] = time.time()
+                    logger.info(f"✅ {table} finalized")
+            if errors:
+                # Let the running streams finish, start nothing new
+                for future in running:
+                    future.cancel()
+        if errors:
+            raise errors[0]
+
+    report = {}
+    for table, s in stats.items():
+        load_seconds = s["loaded"] - s["started"]
+        total_seconds = s["finished"] - s["started"]
+        report[table] = {
+            "rows": s["rows"],
+            "streams": s["streams"],
+            "load_seconds": round(load_seconds, 3),
+            "total_seconds": round(total_seconds, 3),
+            "rows_per_second": round(s["rows"] / load_seconds) if load_seconds > 0 else None,
+        }
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="libpq connection string of the target database")
+    parser.add_argument("--data", default="/tmp/data", help="directory with <table>.csv(.gz)")
+    parser.add_argument("--tables", nargs="*", choices=list(TABLES), help="tables to load (default: all)")
+    parser.add_argument("--workers", type=int, default=4, help="concurrent connections")
+    parser.add_argument("--chunk-mb", type=int, default=CHUNK_BYTES // (1024 * 1024), help="bytes per COPY stream")
+    parser.add_argument("--output", help="write the report as JSON to this file")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+
+    start = time.time()
+    report = bulk_load(args.dsn, args.data, args.tables, args.workers, args.chunk_mb * 1024 * 1024)
+    for table, r in report.items():
+        print(f"🔥 {table:<22} {r['rows']:>10} rows  {r['streams']:>3} streams  "
+              f"load {r['load_seconds']:>8}s  total {r['total_seconds']:>8}s  {r['rows_per_second']} rows/s")
+    print(f"⏱️ Loaded {sum(r['rows'] for r in report.values())} rows in {time.time() - start:.1f}s")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Local-mode Spark with a Hadoop-catalog Iceberg warehouse on local disk, for the benchmarks"""
+import json
+import os
+import sys
+import time
+import urllib.request
+
+from pyspark.sql import SparkSession
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pyspark"))
+from bronze_to_silver import DataProcessor  # noqa: E402
+
+ICEBERG_PACKAGE = "org.apache.iceberg:iceberg-spark-runtime-3.5_2.12:1.6.1"
+LOCAL_CATALOG = "local"
+
+
+def local_spark(warehouse: str, app_name: str = "imba-benchmark", conf: dict = None) -> SparkSession:
+    builder = SparkSession.builder \
+        .appName(app_name) \
+        .master(os.environ.get("SPARK_MASTER", "local[*]")) \
+        .config("spark.jars.packages", ICEBERG_PACKAGE) \
+        .config("spark.sql.extensions", "org.apache.iceberg.spark.extensions.IcebergSparkSessionExtensions") \
+        .config(f"spark.sql.catalog.{LOCAL_CATALOG}", "org.apache.iceberg.spark.SparkCatalog") \
+        .config(f"spark.sql.catalog.{LOCAL_CATALOG}.type", "hadoop") \
+        .config(f"spark.sql.catalog.{LOCAL_CATALOG}.warehouse", os.path.abspath(warehouse)) \
+        .config("spark.scheduler.mode", "FAIR") \
+        .config("spark.ui.showConsoleProgress", "false")
+    for key, value in (conf or {}).items():
+        builder = builder.config(key, value)
+    spark = builder.getOrCreate()
+    spark.sparkContext.setLogLevel("WARN")
+    return spark
+
+
+def local_processor(spark: SparkSession, database: str = "imba_silver") -> DataProcessor:
+    """DataProcessor writing to the local warehouse instead of the Glue catalog"""
+    processor = DataProcessor(args=["local-benchmark"], spark=spark, catalog=LOCAL_CATALOG)
+    processor.silver_database = database
+    spark.sql(f"CREATE NAMESPACE IF NOT EXISTS {LOCAL_CATALOG}.{database}")
+    return processor
+
+
+def iceberg_table(spark: SparkSession, table: str):
+    return spark._jvm.org.apache.iceberg.spark.Spark3Util.loadIcebergTable(spark._jsparkSession, table)
+
+
+def files_scanned(spark: SparkSession, table: str, expression) -> int:
+    """Data files Iceberg plans for a filter, after partition and min/max pruning"""
+    tasks = iceberg_table(spark, table).newScan().filter(expression).planFiles()
+    try:
+        iterator, count = tasks.iterator(), 0
+        while iterator.hasNext():
+            iterator.next()
+            count += 1
+        return count
+    finally:
+        tasks.close()
+
+
+def table_files(spark: SparkSession, table: str) -> dict:
+    row = spark.sql(f"SELECT count(*) AS files, coalesce(sum(file_size_in_bytes), 0) AS bytes FROM {table}.files").first()
+    return {"files": row["files"], "bytes": row["bytes"]}
+
+
+# Stage fields summed per measured step (Spark REST API StageData)
+STAGE_METRICS = {
+    "executorRunTime": "executor_run_ms",
+    "inputBytes": "input_bytes",
+    "shuffleReadBytes": "shuffle_read_bytes",
+    "shuffleWriteBytes": "shuffle_write_bytes",
+    "memoryBytesSpilled": "memory_spilled_bytes",
+    "diskBytesSpilled": "disk_spilled_bytes",
+}
+
+
+def spark_rest(spark: SparkSession, path: str):
+    """GET from the Spark UI REST API of the running application"""
+    sc = spark.sparkContext
+    with urllib.request.urlopen(f"{sc.uiWebUrl}/api/v1/applications/{sc.applicationId}/{path}") as response:
+        return json.load(response)
+
+
+def last_job_id(spark: SparkSession) -> int:
+    return max((job["jobId"] for job in spark_rest(spark, "jobs")), default=-1)
+
+
+def measure(spark: SparkSession, action) -> dict:
+    """Run action and report wall time plus the summed metrics of the Spark stages it ran.
+
+    Jobs are attributed by id (everything after the last job before the action), so steps
+    must run one at a time; job groups set inside the action do not matter.
+    """
+    first_job = last_job_id(spark) + 1
+    start = time.time()
+    action()
+    wall = time.time() - start
+
+    # The status store is fed asynchronously by the listener bus
+    for _ in range(50):
+        jobs = [job for job in spark_rest(spark, "jobs") if job["jobId"] >= first_job]
+        if all(job["status"] != "RUNNING" for job in jobs):
+            break
+        time.sleep(0.2)
+    stage_ids = {stage_id for job in jobs for stage_id in job["stageIds"]}
+    stages = [stage for stage in spark_rest(spark, "stages") if stage["stageId"] in stage_ids]
+
+    metrics = {"wall_seconds": round(wall, 3), "jobs": len(jobs), "stages": len(stages)}
+    for field, name in STAGE_METRICS.items():
+        metrics[name] = sum(stage.get(field, 0) for stage in stages)
+    metrics["peak_execution_memory"] = max((stage.get("peakExecutionMemory", 0) for stage in stages), default=0)
+    return metrics
+
+
+def peak_jvm_heap(spark: SparkSession) -> int:
+    """Peak JVM heap over the executors (the driver in local mode), from executor heartbeats"""
+    return max(
+        ((executor.get("peakMemoryMetrics") or {}).get("JVMHeapMemory", 0) for executor in spark_rest(spark, "allexecutors")),
+        default=0,
+    )
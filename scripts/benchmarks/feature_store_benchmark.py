@@ -0,0 +1,205 @@
+"""Feature lookups from the memory-mapped feature store vs reading the Parquet directly.
+
+Writes a synthetic up_features-shaped table (user_id, product_id and four features) as one
+Parquet file and as a feature store file, then times random (user_id, product_id) lookups:
+
+- store single: FeatureTable.get, one key at a time
+- store batch: FeatureTable.find_batch + gather, --batch keys at a time
+- parquet filtered: pyarrow.parquet.read_table with a key filter per batch (row group pruning)
+- parquet loaded: the whole file read into memory, then np.searchsorted over its keys
+
+Each mode runs in a fresh process, so resident memory (RSS after the lookups, minus RSS
+before opening the data) is not shared between modes. Only NumPy and pyarrow are needed:
+
+    python scripts/benchmarks/feature_store_benchmark.py --users 200000 --dir /tmp/imba-feature-store
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pyspark"))
+from feature_store import FeatureStoreWriter, FeatureTable, encode_keys  # noqa: E402
+
+MODES = ("store_single", "store_batch", "parquet_filtered", "parquet_loaded")
+COLUMNS = {
+    "total_number_orders": "<i8",
+    "min_order_number": "<i4",
+    "max_order_number": "<i4",
+    "avg_add_to_cart_order": "<f8",
+}
+PARQUET_ROW_GROUP = 128 * 1024
+
+
+def synthetic_up_features(users: int, products_per_user: int, products: int, seed: int) -> dict:
+    """Sorted, unique (user_id, product_id) pairs with up_features-like values"""
+    rng = np.random.default_rng(seed)
+    user_id = np.repeat(np.arange(1, users + 1, dtype=np.int32), products_per_user)
+    product_id = rng.integers(1, products + 1, size=len(user_id), dtype=np.int32)
+    keys = np.unique(encode_keys(user_id, product_id))
+    rows = len(keys)
+    orders = rng.integers(1, 50, size=rows)
+    first = rng.integers(1, 50, size=rows).astype(np.int32)
+    return {
+        "user_id": (keys >> 32).astype(np.int32),
+        "product_id": (keys & 0xFFFFFFFF).astype(np.int32),
+        "total_number_orders": orders.astype(np.int64),
+        "min_order_number": first,
+        "max_order_number": first + rng.integers(0, 50, size=rows).astype(np.int32),
+        "avg_add_to_cart_order": rng.uniform(1, 20, size=rows),
+    }
+
+
+def write_inputs(directory: str, data: dict) -> dict:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    os.makedirs(directory, exist_ok=True)
+    parquet_path = os.path.join(directory, "up_features.parquet")
+    pq.write_table(pa.table(data), parquet_path, row_group_size=PARQUET_ROW_GROUP)
+
+    store_path = os.path.join(directory, "up_features.imf")
+    writer = FeatureStoreWriter(store_path, "up_features", ["user_id", "product_id"], COLUMNS)
+    keys = encode_keys(data["user_id"], data["product_id"])
+    writer.append_encoded({
+        "rows": len(keys),
+        "key": keys.tobytes(),
+        "values": {name: data[name].astype(dtype).tobytes() for name, dtype in COLUMNS.items()},
+        "valid": dict.fromkeys(COLUMNS),
+    })
+    writer.close()
+    return {
+        "rows": len(keys),
+        "parquet_bytes": os.path.getsize(parquet_path),
+        "store_bytes": os.path.getsize(store_path),
+    }
+
+
+def lookup_keys(directory: str, lookups: int, hit_ratio: float, seed: int) -> tuple:
+    """Random (user_id, product_id) lookups, hit_ratio of them existing"""
+    table = FeatureTable(os.path.join(directory, "up_features.imf"))
+    rng = np.random.default_rng(seed)
+    keys = table.keys[rng.integers(0, table.rows, size=lookups)].copy()
+    misses = rng.random(lookups) >= hit_ratio
+    # Product ids beyond any generated one never exist
+    keys[misses] = (keys[misses] >> 32 << 32) | (1 << 30)
+    table.close()
+    return (keys >> 32).astype(np.int32), (keys & 0xFFFFFFFF).astype(np.int32)
+
+
+def rss_bytes() -> int:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def run_mode(mode: str, directory: str, user_ids: np.ndarray, product_ids: np.ndarray, batch: int) -> dict:
+    baseline = rss_bytes()
+    found = 0
+    start = time.perf_counter()
+
+    if mode == "store_single":
+        table = FeatureTable(os.path.join(directory, "up_features.imf"))
+        for user_id, product_id in zip(user_ids.tolist(), product_ids.tolist()):
+            if table.get("avg_add_to_cart_order", user_id, product_id) is not None:
+                found += 1
+    elif mode == "store_batch":
+        table = FeatureTable(os.path.join(directory, "up_features.imf"))
+        keys = encode_keys(user_ids, product_ids)
+        out = {name: np.empty(batch, dtype=dtype) for name, dtype in COLUMNS.items()}
+        for offset in range(0, len(keys), batch):
+            rows = table.find_batch(keys[offset:offset + batch])
+            buffers = out if len(rows) == batch else None
+            found += int(table.gather(rows, out=buffers)["_found"].sum())
+    elif mode == "parquet_filtered":
+        import pyarrow.parquet as pq
+
+        path = os.path.join(directory, "up_features.parquet")
+        for offset in range(0, len(user_ids), batch):
+            users, products = user_ids[offset:offset + batch], product_ids[offset:offset + batch]
+            result = pq.read_table(path, filters=[("user_id", "in", np.unique(users).tolist())])
+            rows = encode_keys(result.column("user_id").to_numpy(), result.column("product_id").to_numpy())
+            found += int(np.isin(encode_keys(users, products), rows).sum())
+    elif mode == "parquet_loaded":
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(os.path.join(directory, "up_features.parquet"))
+        columns = {name: table.column(name).to_numpy() for name in ("user_id", "product_id", *COLUMNS)}
+        index = encode_keys(columns["user_id"], columns["product_id"])
+        keys = encode_keys(user_ids, product_ids)
+        for offset in range(0, len(keys), batch):
+            rows = np.minimum(np.searchsorted(index, keys[offset:offset + batch]), len(index) - 1)
+            hit = index[rows] == keys[offset:offset + batch]
+            for name in COLUMNS:
+                columns[name].take(rows)
+            found += int(hit.sum())
+    else:
+        raise ValueError(f"Unknown mode: {mode}")
+
+    seconds = time.perf_counter() - start
+    return {
+        "lookups": len(user_ids),
+        "found": found,
+        "seconds": round(seconds, 4),
+        "lookups_per_second": round(len(user_ids) / seconds) if seconds > 0 else None,
+        "resident_bytes": rss_bytes() - baseline,
+    }
+
+
+def run_isolated(mode: str, args) -> dict:
+    """run_mode in a fresh interpreter, so its resident memory is its own"""
+    command = [
+        sys.executable, os.path.abspath(__file__), "--mode", mode, "--dir", args.dir,
+        "--lookups", str(args.lookups), "--batch", str(args.batch),
+        "--hit-ratio", str(args.hit_ratio), "--seed", str(args.seed),
+    ]
+    output = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200000)
+    parser.add_argument("--products-per-user", type=int, default=50)
+    parser.add_argument("--products", type=int, default=49688)
+    parser.add_argument("--lookups", type=int, default=100000)
+    parser.add_argument("--batch", type=int, default=1000, help="keys per batched lookup")
+    parser.add_argument("--hit-ratio", type=float, default=0.9)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--dir", default="/tmp/imba-feature-store")
+    parser.add_argument("--modes", nargs="*", choices=MODES, default=list(MODES))
+    parser.add_argument("--mode", choices=MODES, help=argparse.SUPPRESS)
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.mode:
+        user_ids, product_ids = lookup_keys(args.dir, args.lookups, args.hit_ratio, args.seed)
+        # Parquet modes only read the batches they need; a smaller sample keeps them short
+        if args.mode == "parquet_filtered":
+            user_ids, product_ids = user_ids[:args.batch * 10], product_ids[:args.batch * 10]
+        print(json.dumps(run_mode(args.mode, args.dir, user_ids, product_ids, args.batch)))
+        return
+
+    start = time.time()
+    data = synthetic_up_features(args.users, args.products_per_user, args.products, args.seed)
+    results = {"inputs": write_inputs(args.dir, data), "modes": {}}
+    del data
+    print(f"Wrote {results['inputs']['rows']} rows: parquet {results['inputs']['parquet_bytes']} bytes, "
+          f"store {results['inputs']['store_bytes']} bytes")
+
+    for mode in args.modes:
+        results["modes"][mode] = r = run_isolated(mode, args)
+        print(f"🔥 {mode:<17} {r['lookups_per_second']:>12} lookups/s  "
+              f"{r['resident_bytes'] / 1024 / 1024:>8.1f} MiB resident  {r['found']}/{r['lookups']} found")
+    print(f"⏱️ Benchmark finished in {time.time() - start:.1f}s")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
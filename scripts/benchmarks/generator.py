@@ -0,0 +1,139 @@
+"""Deterministic, Instacart-shaped raw data at a configurable scale factor.
+
+Scale factor 1 is about the size of the Instacart dataset (206k users, 3.4M orders, 50k products).
+Skew follows the real data:
+
+- product popularity is Zipfian (log-uniform ranks), so a few products are in most baskets
+- orders per user are Pareto distributed between 4 and 100, so a few heavy users place most orders
+- basket sizes and days between orders are exponential, capped like the source data
+
+Every value is a hash of its keys and the seed, so the output does not depend on the number of
+partitions or cores. Tables use the schemas of postgresql/init/init.sql and are written the way
+the raw reader expects them: a DMS full load, <raw>/public/<table>/LOAD00000001.parquet, ...
+"""
+import json
+import os
+import shutil
+
+from pyspark.sql import SparkSession
+from pyspark.sql import functions as F
+from pyspark.sql.window import Window
+
+USERS = 206209
+PRODUCTS = 49688
+AISLES = 134
+DEPARTMENTS = 21
+MAX_ORDERS_PER_USER = 100
+MAX_BASKET = 145
+# Metadata written next to the tables, read back by the benchmark suite
+METADATA_FILE = "_generator.json"
+
+_HASH_RANGE = 1_000_000_007
+
+
+def uniform(seed: int, salt: int, *columns):
+    """Deterministic uniform [0, 1) from the hash of the given columns"""
+    return F.pmod(F.xxhash64(F.lit(seed), F.lit(salt), *columns), F.lit(_HASH_RANGE)) / F.lit(float(_HASH_RANGE))
+
+
+def generate(spark: SparkSession, scale: float, seed: int = 42) -> dict:
+    """DataFrames of the six raw tables at the given scale factor"""
+    users = max(10, int(USERS * scale))
+    # The catalog shrinks ten times slower than the users, so small samples keep a long tail
+    products = max(100, int(PRODUCTS * min(scale * 10, 1)))
+
+    departments = spark.range(1, DEPARTMENTS + 1).select(
+        F.col("id").cast("int").alias("department_id"),
+        F.concat(F.lit("department "), F.col("id")).alias("department"),
+    )
+    aisles = spark.range(1, AISLES + 1).select(
+        F.col("id").cast("int").alias("aisle_id"),
+        F.concat(F.lit("aisle "), F.col("id")).alias("aisle"),
+    )
+    product_aisle = (F.floor(uniform(seed, 1, "id") * AISLES) + 1).cast("int")
+    products_df = spark.range(1, products + 1).select(
+        F.col("id").cast("int").alias("product_id"),
+        F.concat(F.lit("product "), F.col("id")).alias("product_name"),
+        product_aisle.alias("aisle_id"),
+    ).withColumn("department_id", (F.pmod(F.col("aisle_id") * 7, F.lit(DEPARTMENTS)) + 1).cast("int"))
+
+    # Pareto(alpha=1.2) orders per user, scaled to start at 4
+    user_orders = F.least(
+        F.lit(MAX_ORDERS_PER_USER),
+        F.floor(F.lit(4.0) / F.pow(uniform(seed, 2, "id") + F.lit(1e-9), F.lit(1 / 1.2))),
+    ).cast("int")
+    orders = spark.range(1, users + 1) \
+        .select(F.col("id").cast("int").alias("user_id"), user_orders.alias("orders")) \
+        .select("user_id", "orders", F.explode(F.sequence(F.lit(1), F.col("orders"))).alias("order_number"))
+    last = F.col("order_number") == F.col("orders")
+    orders = orders.select(
+        (F.col("user_id") * MAX_ORDERS_PER_USER + F.col("order_number")).cast("int").alias("order_id"),
+        "user_id",
+        F.when(last & (uniform(seed, 3, "user_id") < 0.64), "train")
+         .when(last, "test")
+         .otherwise("prior").alias("eval_set"),
+        F.col("order_number").cast("int").alias("order_number"),
+        F.floor(uniform(seed, 4, "user_id", "order_number") * 7).cast("int").alias("order_dow"),
+        # Triangular around midday
+        F.floor((uniform(seed, 5, "user_id", "order_number") + uniform(seed, 6, "user_id", "order_number")) * 12)
+         .cast("int").alias("order_hour_of_day"),
+        F.when(F.col("order_number") == 1, None)
+         .otherwise(F.least(F.lit(30), F.floor(-F.log(uniform(seed, 7, "user_id", "order_number") + F.lit(1e-9)) * 10)))
+         .cast("int").alias("days_since_prior"),
+    )
+
+    # Exponential basket sizes; Zipfian products from log-uniform ranks, scattered over the ids
+    basket = F.least(F.lit(MAX_BASKET), F.floor(-F.log(uniform(seed, 8, "order_id") + F.lit(1e-9)) * 9) + 1).cast("int")
+    rank = F.least(F.lit(products), F.floor(F.exp(uniform(seed, 9, "order_id", "position") * F.log(F.lit(float(products))))) + 1)
+    lines = orders.filter(F.col("eval_set") != "test") \
+        .select("order_id", "eval_set", "order_number", F.explode(F.sequence(F.lit(1), basket)).alias("position")) \
+        .withColumn("product_id", (F.pmod(rank.cast("long") * 7919, F.lit(products)) + 1).cast("int")) \
+        .groupBy("order_id", "eval_set", "order_number", "product_id") \
+        .agg(F.min("position").alias("position"))
+    lines = lines.select(
+        "order_id",
+        "product_id",
+        F.row_number().over(Window.partitionBy("order_id").orderBy("position")).cast("int").alias("add_to_cart_order"),
+        # A PostgreSQL BOOLEAN as DMS writes it: "true"/"false"
+        ((F.col("order_number") > 1) & (uniform(seed, 10, "order_id", "product_id") < 0.6)).cast("string").alias("reordered"),
+        "eval_set",
+    )
+
+    return {
+        "departments": departments,
+        "aisles": aisles,
+        "products": products_df,
+        "orders": orders,
+        "order_products__prior": lines.filter(F.col("eval_set") == "prior").drop("eval_set"),
+        "order_products__train": lines.filter(F.col("eval_set") == "train").drop("eval_set"),
+    }
+
+
+def write_load_files(df, root: str) -> None:
+    """Write a table as DMS full-load files: the raw reader applies every other file as CDC"""
+    staging = os.path.join(root, "_load")
+    df.write.mode("overwrite").parquet(staging)
+    shutil.rmtree(root + ".tmp", ignore_errors=True)
+    os.makedirs(root + ".tmp")
+    parts = sorted(path for path in os.listdir(staging) if path.endswith(".parquet"))
+    for index, path in enumerate(parts, start=1):
+        os.replace(os.path.join(staging, path), os.path.join(root + ".tmp", f"LOAD{index:08d}.parquet"))
+    shutil.rmtree(root)
+    os.replace(root + ".tmp", root)
+
+
+def write_raw(tables: dict, raw: str, scale: float, seed: int) -> dict:
+    """Write the tables under <raw>/public/<table>/ and return their row counts"""
+    counts = {}
+    for name, df in tables.items():
+        write_load_files(df, os.path.join(raw, "public", name))
+        counts[name] = df.sparkSession.read.parquet(os.path.join(raw, "public", name)).count()
+        print(f"🔥 {name:<22} {counts[name]} rows")
+    with open(os.path.join(raw, METADATA_FILE), "w") as f:
+        json.dump({"scale": scale, "seed": seed, "rows": counts}, f, indent=2)
+    return counts
+
+
+def read_metadata(raw: str) -> dict:
+    with open(os.path.join(raw, METADATA_FILE)) as f:
+        return json.load(f)
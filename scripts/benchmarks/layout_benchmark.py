@@ -0,0 +1,120 @@
+"""Files written and files scanned for point/range queries, with and without TABLE_LAYOUTS.
+
+Writes orders, order_products_prior and the feature tables twice to a Hadoop-catalog Iceberg
+warehouse on local disk, once flat (spark.imba.tableLayouts=false) and once with the layouts:
+
+    python scripts/benchmarks/layout_benchmark.py --users 20000 --warehouse /tmp/imba-warehouse
+"""
+import argparse
+import json
+import time
+
+from pyspark.sql import functions as F
+
+from common import LOCAL_CATALOG, local_spark, local_processor, files_scanned, table_files
+
+
+def synthetic_orders(spark, users: int, orders_per_user: int, seed: int):
+    """Small Instacart-shaped orders and order lines (uniform, for layout comparisons only)"""
+    orders = spark.range(users * orders_per_user).select(
+        (F.col("id") + 1).cast("int").alias("order_id"),
+        (F.col("id") / orders_per_user + 1).cast("int").alias("user_id"),
+        F.when(F.col("id") % orders_per_user == orders_per_user - 1, "train").otherwise("prior").alias("eval_set"),
+        (F.col("id") % orders_per_user + 1).cast("int").alias("order_number"),
+        (F.abs(F.hash("id", F.lit(seed))) % 7).cast("int").alias("order_dow"),
+        (F.abs(F.hash("id", F.lit(seed + 1))) % 24).cast("int").alias("order_hour_of_day"),
+        F.when(F.col("id") % orders_per_user == 0, None)
+         .otherwise(F.abs(F.hash("id", F.lit(seed + 2))) % 31).cast("int").alias("days_since_prior"),
+    )
+    order_products = orders.select(
+        "order_id", F.explode(F.sequence(F.lit(1), (F.abs(F.hash("order_id", F.lit(seed + 3))) % 15 + 1).cast("int"))).alias("add_to_cart_order")
+    ).select(
+        "order_id",
+        (F.abs(F.hash("order_id", "add_to_cart_order", F.lit(seed + 4))) % 5000 + 1).cast("int").alias("product_id"),
+        "add_to_cart_order",
+        (F.abs(F.hash("order_id", "add_to_cart_order", F.lit(seed + 5))) % 2).cast("int").alias("reordered"),
+    ).dropDuplicates(["order_id", "product_id"])
+    return orders, order_products
+
+
+def timed_count(df) -> float:
+    start = time.time()
+    df.count()
+    return round(time.time() - start, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--orders-per-user", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--warehouse", default="/tmp/imba-warehouse")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    spark = local_spark(args.warehouse, "imba-layout-benchmark")
+    E = spark._jvm.org.apache.iceberg.expressions.Expressions
+    user, product = args.users // 2, 42
+    user_range = (args.users // 4, args.users // 4 + args.users // 100 + 1)
+    in_user_range = getattr(E, "and")(E.greaterThanOrEqual("user_id", user_range[0]), E.lessThan("user_id", user_range[1]))
+
+    queries = {
+        "orders": [
+            ("point user_id", E.equal("user_id", user), F.col("user_id") == user),
+            ("eval_set = train", E.equal("eval_set", "train"), F.col("eval_set") == "train"),
+        ],
+        "order_products_prior": [
+            ("point user_id", E.equal("user_id", user), F.col("user_id") == user),
+            ("range user_id", in_user_range, F.col("user_id").between(user_range[0], user_range[1] - 1)),
+        ],
+        "up_features": [
+            ("point user_id", E.equal("user_id", user), F.col("user_id") == user),
+            ("point (user_id, product_id)", getattr(E, "and")(E.equal("user_id", user), E.equal("product_id", product)),
+             (F.col("user_id") == user) & (F.col("product_id") == product)),
+            ("range user_id", in_user_range, F.col("user_id").between(user_range[0], user_range[1] - 1)),
+        ],
+        "prd_features": [
+            ("point product_id", E.equal("product_id", product), F.col("product_id") == product),
+        ],
+    }
+
+    results = {}
+    for variant, layouts in [("flat", False), ("layout", True)]:
+        processor = local_processor(spark, f"bench_{variant}")
+        processor.table_layouts = layouts
+        orders, order_products = synthetic_orders(spark, args.users, args.orders_per_user, args.seed)
+        order_products_prior = processor.process_order_products_prior(orders, order_products).cache()
+        features = processor.process_features(order_products_prior)
+        tables = {
+            "orders": orders,
+            "order_products_prior": order_products_prior,
+            "up_features": features["up_features"],
+            "prd_features": features["prd_features"],
+        }
+
+        results[variant] = {}
+        for name, df in tables.items():
+            start = time.time()
+            processor.write_table(df, name)
+            table = processor.silver_table(name)
+            result = {"write_seconds": round(time.time() - start, 3), **table_files(spark, table), "queries": {}}
+            for label, expression, condition in queries.get(name, []):
+                result["queries"][label] = {
+                    "files_scanned": files_scanned(spark, table, expression),
+                    "seconds": timed_count(spark.table(table).filter(condition)),
+                }
+            results[variant][name] = result
+            print(f"{variant:<7} {name:<22} files={result['files']:<5} " + "  ".join(
+                f"{label}: {q['files_scanned']} files" for label, q in result["queries"].items()))
+        order_products_prior.unpersist()
+
+    report = {"catalog": LOCAL_CATALOG, "users": args.users, "orders_per_user": args.orders_per_user, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
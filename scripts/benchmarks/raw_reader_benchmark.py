@@ -0,0 +1,96 @@
+"""Raw reads with schema inference vs the pinned-schema file reader, on a DMS-shaped local directory.
+
+Writes orders and order_products__prior the way DMS lands them (a LOAD file per table plus CDC
+files under YYYY/MM/DD date partitions), then times:
+
+- inferred: spark.read.parquet over the table prefix (recursive listing, schema from footers)
+- pinned: DataProcessor.read_table (cached listing, RAW_SCHEMAS, CDC files applied by key)
+- pinned + projection: read_table projected to the columns of user_features_1
+- pinned + window: read_table restricted to the last date partition (spark.imba.rawSince)
+
+    python scripts/benchmarks/raw_reader_benchmark.py --users 20000 --raw /tmp/imba-raw
+"""
+import argparse
+import json
+import os
+import shutil
+import time
+
+from pyspark.sql import functions as F
+
+from common import local_spark, local_processor
+from layout_benchmark import synthetic_orders
+
+DAYS = ["2025/01/01", "2025/01/02", "2025/01/03"]
+# Raw columns of user_features_1, the projection measured for orders
+PROJECTIONS = {"orders": ["user_id", "order_number", "days_since_prior"]}
+
+
+def write_dms_layout(spark, raw: str, table: str, df, days: list) -> None:
+    """Full load as LOAD00000001.parquet-style files, the rest split over date partitions"""
+    root = os.path.join(raw, "public", table)
+    df = df.withColumn("_slice", F.abs(F.hash(*df.columns)) % (len(days) + 1)).cache()
+    df.filter(F.col("_slice") == 0).drop("_slice").coalesce(1).write.mode("overwrite").parquet(os.path.join(root, "_load"))
+    for path in os.listdir(os.path.join(root, "_load")):
+        if path.endswith(".parquet"):
+            os.replace(os.path.join(root, "_load", path), os.path.join(root, "LOAD00000001.parquet"))
+    shutil.rmtree(os.path.join(root, "_load"))
+    for index, day in enumerate(days, start=1):
+        df.filter(F.col("_slice") == index).drop("_slice") \
+            .withColumn("Op", F.lit("I")) \
+            .coalesce(2).write.mode("overwrite").parquet(os.path.join(root, day))
+    df.unpersist()
+
+
+def timed_scan(build) -> dict:
+    """Build the DataFrame and read every one of its columns (a count alone would prune them all)"""
+    start = time.time()
+    df = build()
+    row = df.agg(F.count(F.lit(1)).alias("rows"), F.sum(F.hash(*df.columns)).alias("checksum")).first()
+    return {"seconds": round(time.time() - start, 3), "rows": row["rows"], "columns": len(df.columns)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--orders-per-user", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--raw", default="/tmp/imba-raw")
+    parser.add_argument("--warehouse", default="/tmp/imba-warehouse")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    args = parser.parse_args()
+
+    spark = local_spark(args.warehouse, "imba-raw-reader-benchmark")
+    orders, order_products = synthetic_orders(spark, args.users, args.orders_per_user, args.seed)
+    # DMS writes PostgreSQL booleans as "true"/"false" strings (MapBooleanAsBoolean is not set)
+    order_products = order_products.withColumn("reordered", (F.col("reordered") == 1).cast("string"))
+    tables = {"orders": orders, "order_products__prior": order_products}
+    for table, df in tables.items():
+        write_dms_layout(spark, args.raw, table, df, DAYS)
+
+    results = {}
+    for table in tables:
+        prefix = os.path.join(args.raw, "public", table)
+        processor = local_processor(spark)
+        processor.raw_path = os.path.abspath(args.raw)
+        columns = PROJECTIONS.get(table)
+
+        result = {"inferred": timed_scan(lambda: spark.read.option("recursiveFileLookup", "true").parquet(prefix).drop("Op"))}
+        result["pinned"] = timed_scan(lambda: processor.read_table(table))
+        if columns:
+            result["pinned + projection"] = timed_scan(lambda: processor.read_table(table, columns))
+        processor.raw_since = DAYS[-1]
+        result["pinned + window"] = timed_scan(lambda: processor.read_table(table))
+        results[table] = result
+        print(f"{table:<22} " + "  ".join(f"{label}: {r['seconds']}s" for label, r in result.items()))
+
+    report = {"raw": args.raw, "users": args.users, "orders_per_user": args.orders_per_user, "results": results}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Local benchmark suite for bronze_to_silver.py.
+
+generate writes deterministic Instacart-shaped raw tables (see generator.py), run times every
+DataProcessor stage and a full run against them in local-mode Spark with a Hadoop-catalog Iceberg
+warehouse, and compare flags the stages of a run that regressed against a baseline:
+
+    python scripts/benchmarks/suite.py generate --scale 0.05 --raw /tmp/imba-raw
+    python scripts/benchmarks/suite.py run --raw /tmp/imba-raw --output base.json
+    python scripts/benchmarks/suite.py run --raw /tmp/imba-raw --output new.json
+    python scripts/benchmarks/suite.py compare base.json new.json --threshold 0.2
+
+Each stage caches its output, so a stage is measured on top of its materialized inputs. The
+"run" stage is DataProcessor.run_full on its own (without the Spark session shutdown of run()).
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+
+from common import local_spark, local_processor, measure, peak_jvm_heap
+from generator import generate, write_raw, read_metadata
+
+# Metrics compared between runs, with the floor under which a difference is noise
+COMPARED_METRICS = {
+    "wall_seconds": 1.0,
+    "shuffle_write_bytes": 1024 * 1024,
+    "shuffle_read_bytes": 1024 * 1024,
+    "disk_spilled_bytes": 1024 * 1024,
+    "peak_execution_memory": 16 * 1024 * 1024,
+}
+SUITE_CONF = {
+    # Keep every job and stage of a full run in the status store
+    "spark.ui.retainedJobs": "100000",
+    "spark.ui.retainedStages": "100000",
+}
+
+
+def run_stages(spark, processor, logger) -> dict:
+    cached = []
+
+    def materialize(*dfs):
+        for df in dfs:
+            cached.append(df.cache())
+            df.count()
+
+    frames = {}
+
+    def stage(name, build):
+        """build returns a DataFrame or a dict of them, kept in frames[name]"""
+        def action():
+            result = build()
+            frames[name] = result
+            materialize(*(result.values() if isinstance(result, dict) else [result]))
+        return name, action
+
+    stages = [
+        stage("read_raw", lambda: {name: processor.read_table(name) for name in
+                                   ("orders", "products", "aisles", "departments", "order_products__prior", "order_products__train")}),
+        ("plan_execution", lambda: processor.plan_execution(logger, ["order_products_prior", "user_features_2", "up_features", "prd_features"])),
+        stage("process_order_products__eval", lambda: {
+            name: processor.process_order_products__eval(frames["read_raw"][name])
+            for name in ("order_products__prior", "order_products__train")
+        }),
+        stage("process_order_products", lambda: processor.process_order_products(
+            frames["process_order_products__eval"]["order_products__prior"],
+            frames["process_order_products__eval"]["order_products__train"])),
+        stage("process_order_products_prior", lambda: processor.process_order_products_prior(
+            frames["read_raw"]["orders"], frames["process_order_products"])),
+        stage("process_user_features_1", lambda: processor.process_user_features_1(frames["read_raw"]["orders"])),
+        stage("process_user_features_2", lambda: processor.process_user_features_2(frames["process_order_products_prior"])),
+        stage("process_up_features", lambda: processor.process_up_features(frames["process_order_products_prior"])),
+        stage("process_prd_features", lambda: processor.process_prd_features(frames["process_order_products_prior"])),
+        stage("process_features_fused", lambda: processor.process_features_fused(frames["process_order_products_prior"])),
+    ]
+
+    results = {}
+    for name, action in stages:
+        results[name] = measure(spark, action)
+        print(f"⏱️ {name:<32} {results[name]['wall_seconds']:>8}s  shuffle={results[name]['shuffle_write_bytes']}")
+
+    for df in cached:
+        df.unpersist()
+    spark.catalog.clearCache()
+
+    # The whole job, tables written to the local warehouse
+    results["run"] = measure(spark, lambda: processor.run_full(logger))
+    print(f"⏱️ {'run':<32} {results['run']['wall_seconds']:>8}s  shuffle={results['run']['shuffle_write_bytes']}")
+    return results
+
+
+def run(args) -> dict:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+    logger = logging.getLogger("benchmark")
+    metadata = read_metadata(args.raw)
+
+    conf = dict(SUITE_CONF)
+    conf.update(kv.split("=", 1) for kv in args.conf)
+    spark = local_spark(args.warehouse, "imba-benchmark-suite", conf)
+    try:
+        processor = local_processor(spark, args.database)
+        processor.raw_path = os.path.abspath(args.raw)
+        processor.skip_unchanged = False
+
+        stages = run_stages(spark, processor, logger)
+        report = {
+            "scale": metadata["scale"],
+            "seed": metadata["seed"],
+            "rows": metadata["rows"],
+            "spark_version": spark.version,
+            "master": spark.sparkContext.master,
+            "conf": conf,
+            "feature_engine": processor.feature_engine,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "peak_jvm_heap_bytes": peak_jvm_heap(spark),
+            "stages": stages,
+        }
+    finally:
+        spark.stop()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def compare(base: dict, new: dict, threshold: float) -> list:
+    """(stage, metric, base, new, change) for every metric that grew beyond the threshold"""
+    if (base["scale"], base["seed"]) != (new["scale"], new["seed"]):
+        print(f"⚠️ Runs are on different data: {base['scale']}/{base['seed']} vs {new['scale']}/{new['seed']}")
+
+    regressions = []
+    for stage, metrics in new["stages"].items():
+        if stage not in base["stages"]:
+            continue
+        for metric, floor in COMPARED_METRICS.items():
+            old, value = base["stages"][stage].get(metric, 0), metrics.get(metric, 0)
+            if max(old, value) < floor:
+                continue
+            change = (value - old) / old if old else float("inf")
+            print(f"  {stage:<32} {metric:<22} {old:>14} -> {value:<14} {change:+.1%}")
+            if change > threshold:
+                regressions.append((stage, metric, old, value, change))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    generate_parser = commands.add_parser("generate", help="write synthetic raw tables")
+    generate_parser.add_argument("--scale", type=float, default=0.05)
+    generate_parser.add_argument("--seed", type=int, default=42)
+    generate_parser.add_argument("--raw", default="/tmp/imba-raw")
+    generate_parser.add_argument("--warehouse", default="/tmp/imba-warehouse")
+
+    run_parser = commands.add_parser("run", help="benchmark the stages and a full run")
+    run_parser.add_argument("--raw", default="/tmp/imba-raw")
+    run_parser.add_argument("--warehouse", default="/tmp/imba-warehouse")
+    run_parser.add_argument("--database", default="bench_suite")
+    run_parser.add_argument("--conf", action="append", default=[], help="extra Spark conf, key=value (repeatable)")
+    run_parser.add_argument("--output", help="write the results as JSON to this file")
+
+    compare_parser = commands.add_parser("compare", help="flag regressions of a run against a baseline")
+    compare_parser.add_argument("base")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.2, help="relative increase flagged as a regression")
+
+    args = parser.parse_args()
+    if args.command == "generate":
+        spark = local_spark(args.warehouse, "imba-benchmark-generator")
+        try:
+            write_raw(generate(spark, args.scale, args.seed), args.raw, args.scale, args.seed)
+        finally:
+            spark.stop()
+    elif args.command == "run":
+        print(json.dumps(run(args)["stages"], indent=2))
+    else:
+        with open(args.base) as f:
+            base = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        regressions = compare(base, new, args.threshold)
+        if regressions:
+            print(f"❌ {len(regressions)} regressions beyond {args.threshold:.0%}:")
+            for stage, metric, old, value, change in regressions:
+                print(f"  {stage} {metric}: {old} -> {value} ({change:+.1%})")
+            sys.exit(1)
+        print(f"✅ No regressions beyond {args.threshold:.0%}")
+
+
+if __name__ == "__main__":
+    main()
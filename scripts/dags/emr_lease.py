@@ -0,0 +1,172 @@
+"""Warm EMR cluster reuse for the pipeline DAGs.
+
+In "lease" mode a DAG run first looks for a running, idle (WAITING) cluster created from the
+same configuration, tagged with its config hash. It leases that cluster by tagging it with its
+run id and submits its steps. At the end of the run it releases the cluster instead of
+terminating it. Clusters created in lease mode carry an idle-timeout auto-termination policy,
+so a cluster nobody leases again shuts itself down; a run that leases a cluster sets the policy
+to its own idle timeout. "ephemeral" mode creates and terminates a
+cluster per run, as before.
+
+EMR has no conditional tagging, so the lock is tag-then-verify: a run writes its lease tag,
+waits a few seconds and keeps the cluster only if the tag still names it. Leases expire after
+LEASE_TTL_SECONDS, so a crashed run cannot hold a cluster forever.
+
+The functions take a boto3 EMR client, so they run unchanged against moto's EMR mock. The
+*_callable factories wrap them as Airflow python_callables without importing Airflow.
+"""
+import hashlib
+import json
+import time
+
+import boto3
+
+CONFIG_TAG = "imba:config-hash"
+LEASE_TAG = "imba:lease"
+# Shut a cluster down after this long without steps
+IDLE_TIMEOUT_SECONDS = 30 * 60
+LEASE_TTL_SECONDS = 6 * 60 * 60
+LEASE_SETTLE_SECONDS = 5
+
+
+def config_hash(job_flow_overrides: dict) -> str:
+    """Hash of the settings that make two clusters interchangeable"""
+    instances = job_flow_overrides.get("Instances", {})
+    groups = sorted(
+        (group["InstanceRole"], group["InstanceType"], group["InstanceCount"])
+        for group in instances.get("InstanceGroups", [])
+    )
+    relevant = {
+        "ReleaseLabel": job_flow_overrides.get("ReleaseLabel"),
+        "Applications": sorted(app["Name"] for app in job_flow_overrides.get("Applications", [])),
+        "InstanceGroups": groups,
+        "Configurations": job_flow_overrides.get("Configurations", []),
+        "Subnet": instances.get("Ec2SubnetId"),
+        "JobFlowRole": job_flow_overrides.get("JobFlowRole"),
+        "ServiceRole": job_flow_overrides.get("ServiceRole"),
+        "SecurityGroups": {
+            key: instances.get(key)
+            for key in ("EmrManagedMasterSecurityGroup", "EmrManagedSlaveSecurityGroup", "ServiceAccessSecurityGroup")
+        },
+        "AdditionalSecurityGroups": {
+            key: sorted(instances.get(key, []))
+            for key in ("AdditionalMasterSecurityGroups", "AdditionalSlaveSecurityGroups")
+        },
+    }
+    return hashlib.sha256(json.dumps(relevant, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def cluster_tags(emr, cluster_id: str) -> dict:
+    cluster = emr.describe_cluster(ClusterId=cluster_id)["Cluster"]
+    return {tag["Key"]: tag["Value"] for tag in cluster.get("Tags", [])}
+
+
+def lease_owner(tags: dict, now: float = None):
+    """Owner of an unexpired lease, or None"""
+    value = tags.get(LEASE_TAG, "")
+    if not value:
+        return None
+    owner, _, expires = value.rpartition("|")
+    if expires.isdigit() and int(expires) < (now or time.time()):
+        return None
+    return owner
+
+
+def find_idle_clusters(emr, digest: str) -> list:
+    """WAITING clusters with a matching config hash and no live lease, oldest first"""
+    candidates = []
+    for page in emr.get_paginator("list_clusters").paginate(ClusterStates=["WAITING"]):
+        for cluster in page["Clusters"]:
+            tags = cluster_tags(emr, cluster["Id"])
+            if tags.get(CONFIG_TAG) == digest and lease_owner(tags) is None:
+                candidates.append((cluster["Status"]["Timeline"]["CreationDateTime"], cluster["Id"]))
+    return [cluster_id for _, cluster_id in sorted(candidates)]
+
+
+def acquire(emr, cluster_id: str, owner: str, settle_seconds: float = LEASE_SETTLE_SECONDS) -> bool:
+    """Tag a cluster with our lease and keep it if the tag still names us after settling"""
+    if lease_owner(cluster_tags(emr, cluster_id)) is not None:
+        return False
+    expires = int(time.time() + LEASE_TTL_SECONDS)
+    emr.add_tags(ResourceId=cluster_id, Tags=[{"Key": LEASE_TAG, "Value": f"{owner}|{expires}"}])
+    time.sleep(settle_seconds)
+
+    cluster = emr.describe_cluster(ClusterId=cluster_id)["Cluster"]
+    tags = {tag["Key"]: tag["Value"] for tag in cluster.get("Tags", [])}
+    return lease_owner(tags) == owner and cluster["Status"]["State"] == "WAITING"
+
+
+def create_cluster(emr, job_flow_overrides: dict, owner: str = None, idle_timeout: int = IDLE_TIMEOUT_SECONDS) -> str:
+    """Start a cluster; with an owner it is created leased, tagged and with idle auto-termination"""
+    overrides = dict(job_flow_overrides)
+    if owner is not None:
+        expires = int(time.time() + LEASE_TTL_SECONDS)
+        overrides["Tags"] = list(overrides.get("Tags", [])) + [
+            {"Key": CONFIG_TAG, "Value": config_hash(job_flow_overrides)},
+            {"Key": LEASE_TAG, "Value": f"{owner}|{expires}"},
+        ]
+        overrides["AutoTerminationPolicy"] = {"IdleTimeout": idle_timeout}
+    return emr.run_job_flow(**overrides)["JobFlowId"]
+
+
+def lease_cluster(emr, job_flow_overrides: dict, owner: str, idle_timeout: int = IDLE_TIMEOUT_SECONDS,
+                  settle_seconds: float = LEASE_SETTLE_SECONDS):
+    """(cluster id, reused) of a leased cluster: an idle matching one, or a new one"""
+    for cluster_id in find_idle_clusters(emr, config_hash(job_flow_overrides)):
+        if acquire(emr, cluster_id, owner, settle_seconds):
+            # The cluster was created with the idle timeout of an earlier run
+            emr.put_auto_termination_policy(ClusterId=cluster_id, AutoTerminationPolicy={"IdleTimeout": idle_timeout})
+            print(f"♻️ Leased warm cluster {cluster_id}")
+            return cluster_id, True
+        print(f"Cluster {cluster_id} was leased by another run, trying the next one")
+    cluster_id = create_cluster(emr, job_flow_overrides, owner, idle_timeout)
+    print(f"🔥 No idle cluster matches, created {cluster_id}")
+    return cluster_id, False
+
+
+def release(emr, cluster_id: str, owner: str) -> bool:
+    """Drop our lease; the cluster stays up until its idle timeout or the next lease"""
+    if lease_owner(cluster_tags(emr, cluster_id)) != owner:
+        print(f"Cluster {cluster_id} is not leased by {owner}, leaving it alone")
+        return False
+    emr.remove_tags(ResourceId=cluster_id, TagKeys=[LEASE_TAG])
+    print(f"✅ Released cluster {cluster_id}")
+    return True
+
+
+def run_owner(kwargs) -> str:
+    return f"{kwargs['dag'].dag_id}/{kwargs['run_id']}"
+
+
+def acquire_callable(job_flow_overrides: dict, default_mode: str = "ephemeral", idle_timeout: int = IDLE_TIMEOUT_SECONDS):
+    """python_callable returning the cluster id (XCom return_value) for the run's cluster_mode"""
+    def acquire_cluster(**kwargs):
+        conf = kwargs["dag_run"].conf or {}
+        mode = conf.get("cluster_mode", default_mode)
+        emr = boto3.client("emr")
+        if mode == "lease":
+            cluster_id, _ = lease_cluster(emr, job_flow_overrides, run_owner(kwargs), int(conf.get("idle_timeout", idle_timeout)))
+        elif mode == "ephemeral":
+            cluster_id = create_cluster(emr, job_flow_overrides)
+        else:
+            raise ValueError(f"Unknown cluster_mode: {mode}")
+        kwargs["ti"].xcom_push(key="cluster_mode", value=mode)
+        return cluster_id
+    return acquire_cluster
+
+
+def release_callable(create_task_id: str = "create_emr_cluster"):
+    """python_callable releasing a leased cluster, or terminating an ephemeral one"""
+    def release_cluster(**kwargs):
+        ti = kwargs["ti"]
+        cluster_id = ti.xcom_pull(task_ids=create_task_id, key="return_value")
+        if not cluster_id:
+            print("No cluster was created, nothing to release")
+            return
+        emr = boto3.client("emr")
+        if ti.xcom_pull(task_ids=create_task_id, key="cluster_mode") == "lease":
+            release(emr, cluster_id, run_owner(kwargs))
+        else:
+            emr.terminate_job_flows(JobFlowIds=[cluster_id])
+            print(f"Terminated cluster {cluster_id}")
+    return release_cluster
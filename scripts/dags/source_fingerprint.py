@@ -0,0 +1,240 @@
+"""Cheap change detection on the source PostgreSQL tables.
+
+A table's fingerprint comes from the statistics collector and the catalog, without scanning
+the table:
+
+- n_tup_ins / n_tup_upd / n_tup_del from pg_stat_user_tables (cumulative since the last stats reset),
+- the relation size (pg_relation_size),
+- the max of a single-column primary key, read from the end of its index.
+
+A table changed since the last run when any of these differ from the fingerprint stored in
+S3. A stats reset or a VACUUM FULL also changes the fingerprint, so a false positive costs a
+run, never a missed change. The DAG skips DMS and EMR when no table changed, or restricts
+the DMS table mappings to the changed tables.
+
+The functions take a DB-API connection, so they can be checked against a local PostgreSQL:
+
+    python scripts/dags/source_fingerprint.py --dsn "host=localhost dbname=imba user=postgres" \\
+        --previous /tmp/fingerprint.json --output /tmp/fingerprint.json
+"""
+import argparse
+import json
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+SCHEMA = "public"
+# The tables of postgresql/init/init.sql
+SOURCE_TABLES = (
+    "orders",
+    "aisles",
+    "departments",
+    "products",
+    "order_products__prior",
+    "order_products__train",
+)
+FINGERPRINT_FIELDS = ("n_tup_ins", "n_tup_upd", "n_tup_del", "relation_bytes", "max_pk")
+GATE_MODES = ("off", "skip", "tables")
+# Wait this long for a DMS task to leave the "modifying" state
+DMS_MODIFY_TIMEOUT_SECONDS = 300
+
+
+def primary_keys(cur, tables=SOURCE_TABLES) -> dict:
+    """Single-column primary key of each table that has one"""
+    cur.execute(
+        """
+        SELECT c.relname, max(a.attname)
+        FROM pg_index i
+        JOIN pg_class c ON c.oid = i.indrelid
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        JOIN pg_attribute a ON a.attrelid = i.indrelid AND a.attnum = ANY(i.indkey)
+        WHERE i.indisprimary AND n.nspname = %s AND c.relname = ANY(%s)
+        GROUP BY c.relname
+        HAVING count(*) = 1
+        """,
+        (SCHEMA, list(tables)),
+    )
+    return dict(cur.fetchall())
+
+
+def fingerprint(conn, tables=SOURCE_TABLES) -> dict:
+    """{table: {field: value}} for the tables that exist in the source"""
+    with conn.cursor() as cur:
+        cur.execute(
+            """
+            SELECT relname, n_tup_ins, n_tup_upd, n_tup_del, pg_relation_size(relid)
+            FROM pg_stat_user_tables
+            WHERE schemaname = %s AND relname = ANY(%s)
+            """,
+            (SCHEMA, list(tables)),
+        )
+        result = {
+            table: {"n_tup_ins": ins, "n_tup_upd": upd, "n_tup_del": dele, "relation_bytes": size, "max_pk": None}
+            for table, ins, upd, dele, size in cur.fetchall()
+        }
+        # max() of an indexed column is a single index probe
+        for table, column in primary_keys(cur, result).items():
+            cur.execute(f'SELECT max("{column}") FROM "{SCHEMA}"."{table}"')
+            result[table]["max_pk"] = cur.fetchone()[0]
+    # As stored in S3 and XCom, so it compares equal to a previous fingerprint
+    return json.loads(json.dumps(result, default=str))
+
+
+def changed_tables(current: dict, previous: dict) -> list:
+    """Tables whose fingerprint differs from the previous one (all of them without one)"""
+    return sorted(
+        table for table, stats in current.items()
+        if any(stats.get(field) != previous.get(table, {}).get(field) for field in FINGERPRINT_FIELDS)
+    )
+
+
+def load_previous(s3, path: str) -> dict:
+    bucket, _, key = path[len("s3://"):].partition("/")
+    try:
+        return json.loads(s3.get_object(Bucket=bucket, Key=key)["Body"].read())["tables"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return {}
+        raise
+
+
+def save(s3, path: str, current: dict, run_id: str = None) -> None:
+    bucket, _, key = path[len("s3://"):].partition("/")
+    body = {"run_id": run_id, "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()), "tables": current}
+    s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(body, indent=2).encode())
+
+
+def table_mappings(tables=None) -> dict:
+    """DMS selection rules for the given tables, or for every table of the schema"""
+    names = tables or ["%"]
+    return {
+        "rules": [
+            {
+                "rule-type": "selection",
+                "rule-id": str(index),
+                "rule-name": f"select-{name}" if name != "%" else "select",
+                "object-locator": {"schema-name": SCHEMA, "table-name": name},
+                "rule-action": "include",
+            }
+            for index, name in enumerate(names, start=1)
+        ]
+    }
+
+
+def apply_table_mappings(dms, task_arn: str, tables=None) -> bool:
+    """Point the (stopped) DMS task at the given tables; False when nothing had to change"""
+    task = dms.describe_replication_tasks(
+        Filters=[{"Name": "replication-task-arn", "Values": [task_arn]}]
+    )["ReplicationTasks"][0]
+    wanted = table_mappings(tables)
+    if json.loads(task["TableMappings"]) == wanted:
+        return False
+    if task["Status"].lower() not in ("ready", "stopped", "failed"):
+        print(f"DMS task is {task['Status']}, keeping its table mappings")
+        return False
+
+    dms.modify_replication_task(ReplicationTaskArn=task_arn, TableMappings=json.dumps(wanted))
+    deadline = time.time() + DMS_MODIFY_TIMEOUT_SECONDS
+    while True:
+        status = dms.describe_replication_tasks(
+            Filters=[{"Name": "replication-task-arn", "Values": [task_arn]}]
+        )["ReplicationTasks"][0]["Status"].lower()
+        if status != "modifying":
+            break
+        if time.time() > deadline:
+            raise Exception(f"DMS task still modifying after {DMS_MODIFY_TIMEOUT_SECONDS}s")
+        time.sleep(10)
+    print(f"DMS table mappings set to {', '.join(tables) if tables else 'all tables'}")
+    return True
+
+
+def connect_from_secret(secret_name: str):
+    """psycopg2 connection from the DMS source secret (host, port, username, password, dbname)"""
+    import psycopg2
+
+    secret = json.loads(boto3.client("secretsmanager").get_secret_value(SecretId=secret_name)["SecretString"])
+    return psycopg2.connect(
+        host=secret["host"],
+        port=int(secret.get("port", 5432)),
+        user=secret["username"],
+        password=secret["password"],
+        dbname=secret.get("dbname", "postgres"),
+        connect_timeout=10,
+    )
+
+
+def gate_callable(secret_name: str, state_path: str, task_arn: str, default_mode: str = "skip"):
+    """python_callable for a ShortCircuitOperator: False when no source table changed"""
+    def detect_source_changes(**kwargs):
+        conf = kwargs["dag_run"].conf or {}
+        mode = conf.get("source_gate", default_mode)
+        if mode not in GATE_MODES:
+            raise ValueError(f"Unknown source_gate: {mode}")
+
+        dms = boto3.client("dms", region_name="ap-southeast-2")
+        if mode == "off":
+            # No fingerprint is recorded, so the next gated run compares against an older one
+            apply_table_mappings(dms, task_arn)
+            return True
+
+        conn = connect_from_secret(secret_name)
+        try:
+            current = fingerprint(conn)
+        finally:
+            conn.close()
+        changed = changed_tables(current, load_previous(boto3.client("s3"), state_path))
+        kwargs["ti"].xcom_push(key="fingerprint", value=json.dumps(current))
+        kwargs["ti"].xcom_push(key="changed_tables", value=changed)
+        print(f"Changed source tables: {', '.join(changed) or 'none'}")
+
+        if not changed:
+            print("⏭️ No source table changed since the last run, skipping DMS and EMR")
+            return False
+        apply_table_mappings(dms, task_arn, changed if mode == "tables" else None)
+        return True
+    return detect_source_changes
+
+
+def record_callable(state_path: str, gate_task_id: str = "detect_source_changes"):
+    """python_callable storing the fingerprint of a successful run for the next gate"""
+    def record_source_fingerprint(**kwargs):
+        current = kwargs["ti"].xcom_pull(task_ids=gate_task_id, key="fingerprint")
+        if not current:
+            print("No source fingerprint to record")
+            return
+        save(boto3.client("s3"), state_path, json.loads(current), kwargs["run_id"])
+        print(f"✅ Recorded source fingerprint at {state_path}")
+    return record_source_fingerprint
+
+
+def main():
+    import psycopg2
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--dsn", required=True, help="libpq connection string of the source database")
+    parser.add_argument("--previous", help="fingerprint JSON of the last run")
+    parser.add_argument("--output", help="write the current fingerprint to this file")
+    args = parser.parse_args()
+
+    conn = psycopg2.connect(args.dsn)
+    try:
+        current = fingerprint(conn)
+    finally:
+        conn.close()
+    previous = {}
+    if args.previous:
+        try:
+            with open(args.previous) as f:
+                previous = json.load(f)["tables"]
+        except FileNotFoundError:
+            pass
+    print(json.dumps(current, indent=2))
+    print(f"Changed tables: {', '.join(changed_tables(current, previous)) or 'none'}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"tables": current}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 from airflow import DAG
 from airflow.utils.dates import days_ago
 from airflow.providers.amazon.aws.operators.dms import DmsStartTaskOperator
-from airflow.providers.amazon.aws.operators.emr import EmrCreateJobFlowOperator, EmrAddStepsOperator, EmrTerminateJobFlowOperator
+from airflow.providers.amazon.aws.operators.emr import EmrAddStepsOperator
 from airflow.providers.amazon.aws.sensors.dms import DmsTaskCompletedSensor
 from airflow.providers.amazon.aws.sensors.emr import EmrStepSensor
 from airflow.utils.trigger_rule import TriggerRule
@@ -9,6 +9,7 @@ from datetime import timedelta
 from airflow.operators.python import PythonOperator
 import boto3
 from botocore.exceptions import ClientError
+import emr_lease
 
 # Constants
 DMS_TASK_ARN = "arn:aws:dms:ap-southeast-2:794038230051:task:PFEKC7XIOVGTXBULAGD4BTNCXM"
@@ -24,6 +25,52 @@ EMR_SECURITY_GROUPS = {
 }
 EC2_INSTANCE_PROFILE = 'emr_ec2_instance_profile'
 
+JOB_FLOW_OVERRIDES = {
+    "Name": "airflow-emr-cluster",
+    "ReleaseLabel": "emr-7.6.0",
+    "Applications": [{"Name": "Spark"}],
+    "LogUri": LOG_URI,
+    "Instances": {
+        "InstanceGroups": [
+            {
+                "InstanceRole": "MASTER",
+                "InstanceType": "m5.xlarge",
+                "InstanceCount": 1,
+            },
+            {
+                "InstanceRole": "CORE",
+                "InstanceType": "m5.xlarge",
+                "InstanceCount": 1,
+            }
+        ],
+        
+        "Ec2SubnetId": SUBNET_ID,
+        "EmrManagedMasterSecurityGroup": EMR_SECURITY_GROUPS["master"],
+        "EmrManagedSlaveSecurityGroup": EMR_SECURITY_GROUPS["core"],
+        "ServiceAccessSecurityGroup": EMR_SECURITY_GROUPS["service"],
+        "KeepJobFlowAliveWhenNoSteps": True,   # Keeps the EMR cluster running after all steps are completed.
+    },
+    "Configurations": [
+    {
+        "Classification": "spark-hive-site",
+        "Properties": {
+            "hive.metastore.client.factory.class": "com.amazonaws.glue.catalog.metastore.AWSGlueDataCatalogHiveClientFactory",
+            # Optionally provide catalog ID explicitly:
+            # "hive.metastore.glue.catalogid": "123456789012"
+        }
+    },
+    {
+        "Classification": "iceberg-defaults",
+        "Properties": {
+            "iceberg.enabled": "true"
+        }
+    }
+],
+    "JobFlowRole": EC2_ROLE,
+    "ServiceRole": EMR_ROLE,
+    "VisibleToAllUsers": True,
+}
+
 default_args = {
     'owner': 'airflow',
     'retry_delay': timedelta(minutes=5),
@@ -95,53 +142,11 @@ with DAG(
     timeout=60 * 30    # timeout after 30 minutes
 )
 
-    create_emr_cluster = EmrCreateJobFlowOperator(
+    # Creates a cluster, or leases a warm one with {"cluster_mode": "lease"} (see emr_lease.py);
+    # the cluster id is the return value, like EmrCreateJobFlowOperator's
+    create_emr_cluster = PythonOperator(
         task_id="create_emr_cluster",
-        job_flow_overrides={
-            "Name": "airflow-emr-cluster",
-            "ReleaseLabel": "emr-7.6.0",
-            "Applications": [{"Name": "Spark"}],
-            "LogUri": LOG_URI,
-            "Instances": {
-                "InstanceGroups": [
-                    {
-                        "InstanceRole": "MASTER",
-                        "InstanceType": "m5.xlarge",
-                        "InstanceCount": 1,
-                    },
-                    {
-                        "InstanceRole": "CORE",
-                        "InstanceType": "m5.xlarge",
-                        "InstanceCount": 1,
-                    }
-                ],
-                
-                "Ec2SubnetId": SUBNET_ID,
-                "EmrManagedMasterSecurityGroup": EMR_SECURITY_GROUPS["master"],
-                "EmrManagedSlaveSecurityGroup": EMR_SECURITY_GROUPS["core"],
-                "ServiceAccessSecurityGroup": EMR_SECURITY_GROUPS["service"],
-                "KeepJobFlowAliveWhenNoSteps": True,   # Keeps the EMR cluster running after all steps are completed.
-            },
-            "Configurations": [
-            {
-                "Classification": "spark-hive-site",
-                "Properties": {
-                    "hive.metastore.client.factory.class": "com.amazonaws.glue.catalog.metastore.AWSGlueDataCatalogHiveClientFactory",
-                    # Optionally provide catalog ID explicitly:
-                    # "hive.metastore.glue.catalogid": "123456789012"
-                }
-            },
-            {
-                "Classification": "iceberg-defaults",
-                "Properties": {
-                    "iceberg.enabled": "true"
-                }
-            }
-        ],
-            "JobFlowRole": EC2_ROLE,
-            "ServiceRole": EMR_ROLE,
-            "VisibleToAllUsers": True,
-        }
+        python_callable=emr_lease.acquire_callable(JOB_FLOW_OVERRIDES),
     )
 
     add_spark_step = EmrAddStepsOperator(
@@ -168,9 +173,10 @@ with DAG(
         step_id="{{ task_instance.xcom_pull(task_ids='add_spark_step', key='return_value')[0] }}",
     )
 
-    terminate_emr_cluster = EmrTerminateJobFlowOperator(
+    # Terminates the cluster, or releases a leased one for the next run
+    terminate_emr_cluster = PythonOperator(
         task_id="terminate_emr_cluster",
-        job_flow_id="{{ task_instance.xcom_pull(task_ids='create_emr_cluster', key='return_value') }}",
+        python_callable=emr_lease.release_callable(),
         trigger_rule=TriggerRule.ALL_DONE  # ensure cluster is terminated even if step fails
     )
 
@@ -1,21 +1,253 @@
 from pyspark.sql import SparkSession, DataFrame
 from pyspark.sql.functions import when, col, lower
 from pyspark.sql import functions as F
+from pyspark.sql.types import StructType, StructField, IntegerType, StringType
 from pyspark.sql.window import Window
+from pyspark import StorageLevel
+from pyspark.java_gateway import ensure_callback_server_started
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import contextmanager
+from datetime import datetime, timezone
+import urllib.request
 import sys
+import time
+import json
+import re
+import hashlib
+import inspect
 import logging
 import traceback
 
+try:
+    import boto3
+except ImportError:  # listings fall back to the Hadoop file system (no ETags)
+    boto3 = None
+
 # Also silence the noisy JVM logs
 logger = logging.getLogger("py4j")
 logger.setLevel(logging.INFO)
 
+# Primary keys from postgresql/init/init.sql. order_products__* declare no PK,
+# (order_id, product_id) is their natural key.
+PRIMARY_KEYS = {
+    "orders": ["order_id"],
+    "aisles": ["aisle_id"],
+    "departments": ["department_id"],
+    "products": ["product_id"],
+    "order_products__prior": ["order_id", "product_id"],
+    "order_products__train": ["order_id", "product_id"],
+}
+
+# Schemas of the raw tables as DMS lands them (parquet-1-0, types from postgresql/init/init.sql).
+# Raw files are read with these instead of the Glue raw tables, whose definitions predate
+# the Parquet endpoint, and without schema inference. BOOLEAN columns (reordered) land as
+# "true"/"false" strings, since the source endpoint does not set MapBooleanAsBoolean.
+RAW_SCHEMAS = {
+    "orders": StructType([
+        StructField("order_id", IntegerType()),
+        StructField("user_id", IntegerType()),
+        StructField("eval_set", StringType()),
+        StructField("order_number", IntegerType()),
+        StructField("order_dow", IntegerType()),
+        StructField("order_hour_of_day", IntegerType()),
+        StructField("days_since_prior", IntegerType()),
+    ]),
+    "aisles": StructType([
+        StructField("aisle_id", IntegerType()),
+        StructField("aisle", StringType()),
+    ]),
+    "departments": StructType([
+        StructField("department_id", IntegerType()),
+        StructField("department", StringType()),
+    ]),
+    "products": StructType([
+        StructField("product_id", IntegerType()),
+        StructField("product_name", StringType()),
+        StructField("aisle_id", IntegerType()),
+        StructField("department_id", IntegerType()),
+    ]),
+    "order_products__prior": StructType([
+        StructField("order_id", IntegerType()),
+        StructField("product_id", IntegerType()),
+        StructField("add_to_cart_order", IntegerType()),
+        StructField("reordered", StringType()),
+    ]),
+    "order_products__train": StructType([
+        StructField("order_id", IntegerType()),
+        StructField("product_id", IntegerType()),
+        StructField("add_to_cart_order", IntegerType()),
+        StructField("reordered", StringType()),
+    ]),
+}
+
+# DMS CDC files sit under date partitions: <table>/YYYY/MM/DD/<timestamp>.parquet
+DATE_PARTITION = re.compile(r"^(\d{4})/(\d{2})/(\d{2})/")
+
+# DMS CDC output: "Op" is I/U/D, the commit timestamp column is set by
+# timestamp_column_name on the S3 endpoint (modules/dms/main.tf)
+DMS_OP_COLUMN = "Op"
+DMS_COMMIT_TS_COLUMN = "dms_commit_ts"
+
+# Table property holding the last CDC file (relative to the table prefix) merged into a silver table
+WATERMARK_PROPERTY = "imba.cdc.watermark"
+
+# Inputs of every silver table: "raw.<table>" is a raw-zone prefix, anything else a silver table.
+# Listed in write order.
+TABLE_INPUTS = {
+    "products": ["raw.products"],
+    "aisles": ["raw.aisles"],
+    "departments": ["raw.departments"],
+    "orders": ["raw.orders"],
+    "order_products__prior": ["raw.order_products__prior"],
+    "order_products__train": ["raw.order_products__train"],
+    "order_products": ["order_products__prior", "order_products__train"],
+    "order_products_prior": ["orders", "order_products"],
+    "user_features_1": ["orders"],
+    "user_features_2": ["order_products_prior"],
+    "up_features": ["order_products_prior"],
+    "prd_features": ["order_products_prior"],
+}
+
+# DataProcessor methods whose source goes into a table's fingerprint: the read and write path
+# every table goes through, plus the transformations of each table
+TABLE_IO_CODE = [
+    "read_table", "read_changes", "write_table", "replace_table", "set_write_order",
+    "cluster_for_layout", "partition_field", "partition_value", "publish_write", "quality_summary",
+]
+FEATURE_ENGINE_CODE = ["process_features", "process_features_fused", "process_pair_partials"]
+TABLE_CODE = {
+    "order_products__prior": ["process_order_products__eval"],
+    "order_products__train": ["process_order_products__eval"],
+    "order_products": ["process_order_products"],
+    "order_products_prior": ["process_order_products_prior"],
+    "user_features_1": ["process_user_features_1"],
+    "user_features_2": FEATURE_ENGINE_CODE + ["process_user_features_2", "user_features_2_state_from_pairs", "user_features_2_from_state"],
+    "up_features": FEATURE_ENGINE_CODE + ["process_up_features"],
+    "prd_features": FEATURE_ENGINE_CODE + ["process_prd_features", "prd_features_from_pairs"],
+}
+
+# Table property holding the fingerprint of the inputs and code a silver table was written from
+FINGERPRINT_PROPERTY = "imba.source.fingerprint"
+
+# Physical layout of the silver tables, applied by write_table when it creates a table:
+# - partition_by: Iceberg partition fields, a column or bucket(<n>, <column>)
+# - sort_by: sort order within partitions and files, kept for later writes and compaction
+# - distribution: write.distribution-mode for later writes (hash by partition, range by sort order)
+# - target_file_size: write.target-file-size-bytes
+DEFAULT_TARGET_FILE_SIZE = 128 * 1024 * 1024
+TABLE_LAYOUTS = {
+    "orders": {"partition_by": ["eval_set"], "sort_by": ["user_id", "order_number"], "distribution": "hash"},
+    "order_products__prior": {"sort_by": ["order_id", "product_id"], "distribution": "range"},
+    "order_products__train": {"sort_by": ["order_id", "product_id"], "distribution": "range"},
+    "order_products": {"sort_by": ["order_id", "product_id"], "distribution": "range"},
+    "order_products_prior": {"partition_by": ["bucket(16, user_id)"], "sort_by": ["user_id", "product_id", "order_number"], "distribution": "hash"},
+    "user_features_1": {"sort_by": ["user_id"], "distribution": "range", "target_file_size": 64 * 1024 * 1024},
+    "user_features_2": {"sort_by": ["user_id"], "distribution": "range", "target_file_size": 64 * 1024 * 1024},
+    "up_features": {"partition_by": ["bucket(16, user_id)"], "sort_by": ["user_id", "product_id"], "distribution": "hash"},
+    "prd_features": {"sort_by": ["product_id"], "distribution": "range", "target_file_size": 64 * 1024 * 1024},
+}
+BUCKET_TRANSFORM = re.compile(r"bucket\((\d+),\s*(\w+)\)")
+
+# Execution planner inputs: raw sizes are compressed Parquet bytes, expanded by PARQUET_EXPANSION
+# for shuffle and cache estimates. Row counts come from the footers of up to FOOTER_SAMPLE_FILES
+# files per table, extrapolated by bytes. Executor sizes follow Spark's memory model: a
+# RESERVED_MEMORY_BYTES slice of the heap is reserved, the memory overhead is at least
+# MIN_MEMORY_OVERHEAD_BYTES.
+PARQUET_EXPANSION = 4
+TARGET_PARTITION_BYTES = 128 * 1024 * 1024
+MAX_BROADCAST_BYTES = 512 * 1024 * 1024
+FOOTER_SAMPLE_FILES = 8
+RESERVED_MEMORY_BYTES = 300 * 1024 * 1024
+MIN_MEMORY_OVERHEAD_BYTES = 384 * 1024 * 1024
+UNBOUNDED_EXECUTORS = 2 ** 31 - 1
+
+# Hot-key handling: keys are counted in a SKEW_SAMPLE_FRACTION sample. A key is hot when it holds
+# more than HOT_KEY_FACTOR times the rows of an average shuffle partition (and at least
+# HOT_KEY_MIN_SAMPLE sampled rows). Hot keys are spread over SALT_BUCKETS salts in aggregations.
+SKEW_SAMPLE_FRACTION = 0.01
+SKEW_SAMPLE_SEED = 17
+HOT_KEY_FACTOR = 4
+HOT_KEY_MIN_SAMPLE = 20
+MAX_HOT_KEYS = 64
+SALT_BUCKETS = 32
+
+# Run report: task duration quantiles per Spark stage, and the time format of the status API
+REPORT_QUANTILES = [0.0, 0.25, 0.5, 0.75, 1.0]
+STATUS_TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f%Z"
+
+# Data quality rules of the silver tables, checked on metrics of the written rows before the commit
+# (one aggregate over the cached output, or over the changed rows of a MERGE). Keys and not_null
+# columns must have no nulls, the approximate distinct count of the key must be within
+# QUALITY_DISTINCT_TOLERANCE of the row count, ranges are inclusive (None for an open bound),
+# and a table needs at least min_rows rows (default 1).
+QUALITY_RULES = {
+    "products": {"keys": ["product_id"], "not_null": ["aisle_id", "department_id"]},
+    "aisles": {"keys": ["aisle_id"]},
+    "departments": {"keys": ["department_id"]},
+    "orders": {
+        "keys": ["order_id"],
+        "not_null": ["user_id", "eval_set", "order_number"],
+        "ranges": {"order_number": (1, None), "order_dow": (0, 6), "order_hour_of_day": (0, 23), "days_since_prior": (0, 30)},
+    },
+    "order_products__prior": {"keys": ["order_id", "product_id"], "ranges": {"add_to_cart_order": (1, None), "reordered": (0, 1)}},
+    "order_products__train": {"keys": ["order_id", "product_id"], "ranges": {"add_to_cart_order": (1, None), "reordered": (0, 1)}},
+    "order_products": {"keys": ["order_id", "product_id"], "ranges": {"add_to_cart_order": (1, None), "reordered": (0, 1)}},
+    "order_products_prior": {
+        "keys": ["order_id", "product_id"],
+        "not_null": ["user_id", "order_number"],
+        "ranges": {"order_number": (1, None), "add_to_cart_order": (1, None), "reordered": (0, 1)},
+    },
+    "user_features_1": {"keys": ["user_id"], "ranges": {"max_order_num": (1, None), "avg_days_since_prior_order": (0, 30)}},
+    "user_features_2": {
+        "keys": ["user_id"],
+        "ranges": {"total_number_products": (1, None), "total_number_distinct_products": (1, None), "user_reorder_ratio": (0, 1)},
+    },
+    "up_features": {"keys": ["user_id", "product_id"], "ranges": {"total_number_orders": (1, None), "min_order_number": (1, None)}},
+    "prd_features": {
+        "keys": ["product_id"],
+        "ranges": {"total_purchases": (1, None), "total_reorders": (0, None), "first_time_purchases": (1, None)},
+    },
+}
+QUALITY_DISTINCT_RSD = 0.01
+QUALITY_DISTINCT_TOLERANCE = 0.05
+# Snapshot summary properties of the data commit carrying the metrics (imba.dq.rows, imba.dq.nulls.<column>, ...)
+QUALITY_PROPERTY_PREFIX = "imba.dq."
+
+# Partial aggregate state behind the feature tables, keyed like the feature table itself.
+# prd_features holds only counts and sums, so it is its own state.
+FEATURE_STATE_TABLES = {
+    "user_features_1": ("user_features_1_state", ["user_id"]),
+    "user_features_2": ("user_features_2_state", ["user_id"]),
+    "up_features": ("up_features_state", ["user_id", "product_id"]),
+}
+
+class _CallableAction:
+    """A Python function as a java.util.concurrent.Callable, keeping the error it raised"""
+
+    def __init__(self, action):
+        self.action = action
+        self.error = None
+
+    def call(self):
+        try:
+            self.action()
+        except Exception as e:
+            self.error = e
+            raise
+
+    class Java:
+        implements = ["java.util.concurrent.Callable"]
+
+
 class DataProcessor:
-    def __init__(self):
-        self.data_bucket = sys.argv[1] if len(sys.argv) > 1 else "destination-bucket-chien" 
-        self.raw_database = sys.argv[2] if len(sys.argv) > 2 else "imba_raw"  
+    def __init__(self, args: list = None, spark: SparkSession = None, catalog: str = "glue_catalog"):
+        # args default to the spark-submit arguments; an existing session and Iceberg catalog
+        # can be passed in to run against a local warehouse (benchmarks)
+        args = sys.argv[1:] if args is None else args
+        self.data_bucket = args[0] if len(args) > 0 else "destination-bucket-chien" 
+        self.raw_database = args[1] if len(args) > 1 else "imba_raw"  
         self.silver_database = "imba_silver"  # Always use imba_silver for output
-        self.silver_data_folder = sys.argv[3] if len(sys.argv) > 3 else "imba-silver"  
+        self.silver_data_folder = args[2] if len(args) > 2 else "imba-silver"  
         
         # Validate inputs to prevent empty paths
         if not self.data_bucket or self.data_bucket.strip() == "":
@@ -26,6 +258,7 @@ class DataProcessor:
         # Clean up paths to prevent empty strings
         self.data_bucket = self.data_bucket.strip()
         self.silver_data_folder = self.silver_data_folder.strip().strip('/')
+        self.catalog = catalog
         warehouse_path = f"s3://{self.data_bucket}/{self.silver_data_folder}/"
         
         logging.info(f"Initializing Spark with warehouse path: {warehouse_path}")
@@ -34,13 +267,14 @@ class DataProcessor:
         # - spark_catalog remains as default Glue/Hive catalog (for Glue default tables),
     	# -	glue_catalog is the Iceberg catalog you use for writing.
 
-        self.spark = SparkSession.builder \
+        self.spark = spark or SparkSession.builder \
             .appName("DataProcessing") \
             .config("spark.sql.extensions", "org.apache.iceberg.spark.extensions.IcebergSparkSessionExtensions") \
             .config("spark.sql.catalog.glue_catalog", "org.apache.iceberg.spark.SparkCatalog") \
             .config("spark.sql.catalog.glue_catalog.catalog-impl", "org.apache.iceberg.aws.glue.GlueCatalog") \
             .config("spark.sql.catalog.glue_catalog.io-impl", "org.apache.iceberg.aws.s3.S3FileIO") \
             .config("spark.sql.catalog.glue_catalog.warehouse", f"s3://{self.data_bucket}/{self.silver_data_folder}/") \
+            .config("spark.scheduler.mode", "FAIR") \
             .config("spark.hadoop.hive.metastore.client.factory.class", 
                     "com.amazonaws.glue.catalog.metastore.AWSGlueDataCatalogHiveClientFactory") \
             .enableHiveSupport() \
@@ -48,20 +282,896 @@ class DataProcessor:
         
             
         self.spark.sparkContext.setLogLevel("WARN")
-                
 
-    def read_table(self, table_name: str) -> DataFrame:
-        """Read table from raw database"""
-        # Read from spark_catalog, non-iceberg raw data
-        return self.spark.read.table(f"spark_catalog.{self.raw_database}.{table_name}")
+        # Job options are passed with spark-submit --conf spark.imba.<option>=...
+        # - writeMode: "full" rewrites every table, "incremental" merges DMS CDC files
+        # - rawPath: S3 prefix DMS writes to (bucket_folder of the S3 endpoint)
+        # - featureEngine: "fused" shuffles order_products_prior once for all feature tables,
+        #   "legacy" runs one aggregation per feature table
+        # - maxConcurrentWrites: number of table writes submitted to Spark at the same time
+        # - skipUnchanged: skip full-mode writes whose input fingerprint is unchanged
+        # - tableLayouts: create silver tables with the partitioning/sort order of TABLE_LAYOUTS
+        # - rawReader: "files" reads raw Parquet from rawPath with RAW_SCHEMAS, "catalog" the Glue raw tables
+        # - rawUntil: only read DMS CDC date partitions up to this day (YYYY-MM-DD, inclusive).
+        #   rawSince (read_table only, e.g. benchmarks) also skips the full-load LOAD files, so
+        #   runs reject it: a silver table built from it would lose every row loaded before
+        # - planner: "auto" sizes shuffles, joins and caching from the raw file metadata, "off"
+        #   leaves the Spark defaults
+        # - reportPath: where the JSON run report (per-stage Spark metrics) is written, e.g. next
+        #   to the EMR logs; empty only logs it
+        # - skewHandling: "auto" detects hot product_ids and salts their aggregations, "off" disables it
+        # - qualityChecks: "enforce" checks QUALITY_RULES on every write and publishes only passing
+        #   writes, "record" publishes them all and records the failures, "off" skips the checks
+        self.write_mode = self.spark.conf.get("spark.imba.writeMode", "full").lower()
+        self.raw_path = self.spark.conf.get("spark.imba.rawPath", "s3://source-bucket-chien/imba-raw").rstrip("/")
+        self.feature_engine = self.spark.conf.get("spark.imba.featureEngine", "fused").lower()
+        self.max_concurrent_writes = int(self.spark.conf.get("spark.imba.maxConcurrentWrites", "4"))
+        self.skip_unchanged = self.spark.conf.get("spark.imba.skipUnchanged", "true").lower() == "true"
+        self.table_layouts = self.spark.conf.get("spark.imba.tableLayouts", "true").lower() == "true"
+        self.raw_reader = self.spark.conf.get("spark.imba.rawReader", "files").lower()
+        self.raw_since = self.spark.conf.get("spark.imba.rawSince", "").replace("-", "/")
+        self.raw_until = self.spark.conf.get("spark.imba.rawUntil", "").replace("-", "/")
+        self.planner = self.spark.conf.get("spark.imba.planner", "auto").lower()
+        self.report_path = self.spark.conf.get("spark.imba.reportPath", "")
+        self.skew_handling = self.spark.conf.get("spark.imba.skewHandling", "auto").lower()
+        self.quality_checks = self.spark.conf.get("spark.imba.qualityChecks", "enforce").lower()
+        # Raw-zone listings, made once per run and shared by fingerprints, reads and CDC
+        self.raw_listings = {}
+        # Execution plan of the run (see plan_execution); empty means Spark decides
+        self.plan = {}
+        if self.write_mode not in ("full", "incremental"):
+            raise ValueError(f"Unknown write mode: {self.write_mode}")
+        if self.feature_engine not in ("fused", "legacy"):
+            raise ValueError(f"Unknown feature engine: {self.feature_engine}")
+        if self.raw_reader not in ("files", "catalog"):
+            raise ValueError(f"Unknown raw reader: {self.raw_reader}")
+        if self.planner not in ("auto", "off"):
+            raise ValueError(f"Unknown planner: {self.planner}")
+        if self.skew_handling not in ("auto", "off"):
+            raise ValueError(f"Unknown skew handling: {self.skew_handling}")
+        if self.quality_checks not in ("enforce", "record", "off"):
+            raise ValueError(f"Unknown quality checks: {self.quality_checks}")
+        if self.raw_since:
+            raise ValueError("spark.imba.rawSince would leave the full load out of the silver tables, only rawUntil applies to runs")
+
+
+    def read_table(self, table_name: str, columns: list = None) -> DataFrame:
+        """Current rows of a raw table: the full load with its CDC files applied, optionally projected"""
+        if self.raw_reader == "catalog":
+            # Read from spark_catalog, non-iceberg raw data
+            df = self.spark.read.table(f"spark_catalog.{self.raw_database}.{table_name}")
+            return df.select(*columns) if columns else df
+
+        # Read the listed DMS files directly with the pinned schema: no directory listing,
+        # partition discovery or footer sampling on the Spark side. The projection keeps the
+        # primary key, which the CDC files are applied by.
+        keys = PRIMARY_KEYS[table_name]
+        schema = RAW_SCHEMAS[table_name]
+        if columns:
+            schema = StructType([field for field in schema if field.name in columns or field.name in keys])
+        files = [(relative_path, path) for relative_path, path in self.list_raw_files(table_name) if self.in_raw_window(relative_path)]
+        load = [path for relative_path, path in files if relative_path.startswith("LOAD")]
+        changes = sorted(file for file in files if not file[0].startswith("LOAD"))
+
+        df = self.spark.read.schema(schema).parquet(*load) if load else self.spark.createDataFrame([], schema)
+        if changes:
+            # Last change per key wins over the full load; deleted keys drop out
+            latest = self.read_changes(table_name, changes)
+            df = df.join(latest.select(*keys), on=keys, how="left_anti").unionByName(
+                latest.filter(col(DMS_OP_COLUMN) != "D").select(*[col(f.name).cast(f.dataType) for f in schema]))
+        return df.select(*columns) if columns else df
+
+    def cdc_watermark(self, table_name: str) -> str:
+        """Last CDC file read_table applies to a table: the watermark of a full load ("" for none)"""
+        if self.raw_reader == "catalog":
+            # The Glue raw tables do not apply CDC files, the next incremental run replays all of them
+            return ""
+        files = self.list_cdc_files(table_name)
+        return files[-1][0] if files else ""
+
+    def list_raw_files(self, table_name: str) -> list:
+        """Parquet files of a raw table as (path relative to the table prefix, full path)"""
+        prefix = f"{self.raw_path}/public/{table_name}/"
+        marker = f"/public/{table_name}/"
+        files = []
+        for key, _, _ in self.list_raw_objects(table_name):
+            relative_path = key.split(marker, 1)[-1]
+            if relative_path.endswith(".parquet"):
+                files.append((relative_path, prefix + relative_path))
+        return files
+
+    def in_raw_window(self, relative_path: str) -> bool:
+        """Whether a raw file falls inside rawSince/rawUntil (by its DMS date partition)"""
+        if not self.raw_since and not self.raw_until:
+            return True
+        match = DATE_PARTITION.match(relative_path)
+        if not match:
+            # Full-load files predate every CDC partition
+            return not self.raw_since
+        date = "/".join(match.groups())
+        return (not self.raw_since or date >= self.raw_since) and (not self.raw_until or date <= self.raw_until)
+
+    def silver_table(self, table_name: str) -> str:
+        return f"{self.catalog}.{self.silver_database}.{table_name}"
+
+    def read_silver_table(self, table_name: str) -> DataFrame:
+        """Read table from silver database"""
+        return self.spark.read.table(self.silver_table(table_name))
+
+    def write_table(self, df: DataFrame, table_name: str, properties: dict = None) -> None:
+        rules = QUALITY_RULES.get(table_name) if self.quality_checks != "off" else None
+        layout = TABLE_LAYOUTS.get(table_name) if self.table_layouts else None
+        # The quality metrics and the write read the same rows: cache them unless they already are
+        cached = bool(rules) and not df.is_cached
+        if cached:
+            df = df.persist(StorageLevel.MEMORY_AND_DISK)
+        try:
+            self.publish_write(table_name, lambda summary: self.replace_table(df, table_name, layout, properties, summary), df)
+        finally:
+            if cached:
+                df.unpersist()
+
+    def replace_table(self, df: DataFrame, table_name: str, layout: dict, properties: dict = None, summary: dict = None) -> None:
+        """Create or replace a silver table with the data, partitioning and properties of a write"""
+        if layout:
+            df = self.cluster_for_layout(df, layout)
 
-    def write_table(self, df: DataFrame, table_name: str) -> None:
         # Write to glue_catalog defined in configuration with iceberg
-        df.writeTo(f"glue_catalog.{self.silver_database}.{table_name}") \
+        writer = df.writeTo(self.silver_table(table_name)) \
             .using("iceberg") \
-            .tableProperty("format-version", "2") \
-            .createOrReplace()
-        
+            .tableProperty("format-version", "2")
+        if layout:
+            partition_fields = [self.partition_field(field) for field in layout.get("partition_by", [])]
+            if partition_fields:
+                writer = writer.partitionedBy(*partition_fields)
+            writer = writer \
+                .tableProperty("write.distribution-mode", layout.get("distribution", "hash")) \
+                .tableProperty("write.target-file-size-bytes", str(layout.get("target_file_size", DEFAULT_TARGET_FILE_SIZE))) \
+                .option("distribution-mode", "none")  # this write is already clustered and sorted
+        for key, value in (properties or {}).items():
+            writer = writer.tableProperty(key, value)
+        for key, value in (summary or {}).items():
+            writer = writer.option(f"snapshot-property.{key}", value)
+        writer.createOrReplace()
+        self.set_write_order(table_name, layout)
+
+    def set_write_order(self, table_name: str, layout: dict) -> None:
+        # The sort order cannot be declared on create; later MERGEs, overwrites and compactions follow it.
+        # WRITE ORDERED BY also switches the table to range distribution, so hash layouts only
+        # order rows locally, within their partitions.
+        if layout and layout.get("sort_by"):
+            order = ", ".join(layout["sort_by"])
+            if layout.get("distribution", "hash") == "range":
+                write_order = f"WRITE ORDERED BY {order}"
+            else:
+                write_order = f"WRITE DISTRIBUTED BY PARTITION LOCALLY ORDERED BY {order}"
+            self.spark.sql(f"ALTER TABLE {self.silver_table(table_name)} {write_order}")
+
+    def partition_field(self, field: str):
+        """Partition transform for DataFrameWriterV2.partitionedBy"""
+        match = BUCKET_TRANSFORM.fullmatch(field)
+        if match:
+            return F.bucket(int(match.group(1)), match.group(2))
+        return col(field)
+
+    def partition_value(self, field: str):
+        """Value of a partition transform, usable in an ordinary expression"""
+        match = BUCKET_TRANSFORM.fullmatch(field)
+        if match:
+            return F.expr(f"{self.catalog}.system.bucket({match.group(1)}, {match.group(2)})")
+        return col(field)
+
+    def cluster_for_layout(self, df: DataFrame, layout: dict) -> DataFrame:
+        """Cluster rows by partition and sort them within, so each task writes few, sorted files"""
+        partitions = [self.partition_value(field) for field in layout.get("partition_by", [])]
+        sort_by = layout.get("sort_by", [])
+        if partitions:
+            return df.repartition(*partitions).sortWithinPartitions(*partitions, *sort_by)
+        if sort_by:
+            return df.repartitionByRange(*sort_by).sortWithinPartitions(*sort_by)
+        return df
+
+    def table_exists(self, table_name: str) -> bool:
+        return self.spark.catalog.tableExists(self.silver_table(table_name))
+
+    def get_table_properties(self, table_name: str) -> dict:
+        rows = self.spark.sql(f"SHOW TBLPROPERTIES {self.silver_table(table_name)}").collect()
+        return {row["key"]: row["value"] for row in rows}
+
+    def set_table_properties(self, table_name: str, properties: dict) -> None:
+        assignments = ", ".join(f"'{key}' = '{value}'" for key, value in properties.items())
+        self.spark.sql(f"ALTER TABLE {self.silver_table(table_name)} SET TBLPROPERTIES ({assignments})")
+
+    # ---------------------------
+    #   Data quality
+    # ---------------------------
+
+    def quality_metrics(self, rules: dict) -> list:
+        """Aggregate expressions over the written rows: rows, nulls, approximate distinct keys, min/max"""
+        keys = rules.get("keys", [])
+        metrics = [F.count(F.lit(1)).alias("rows")]
+        for column in dict.fromkeys(keys + rules.get("not_null", [])):
+            metrics.append(F.coalesce(F.sum(col(column).isNull().cast("long")), F.lit(0)).alias(f"nulls.{column}"))
+        if keys:
+            key = col(keys[0]) if len(keys) == 1 else F.xxhash64(*keys)
+            metrics.append(F.approx_count_distinct(key, QUALITY_DISTINCT_RSD).alias("distinct_keys"))
+        for column in rules.get("ranges", {}):
+            metrics.append(F.min(column).cast("double").alias(f"min.{column}"))
+            metrics.append(F.max(column).cast("double").alias(f"max.{column}"))
+        return metrics
+
+    def quality_failures(self, rules: dict, metrics: dict) -> list:
+        """Descriptions of the rules the metrics break"""
+        failures = []
+        rows = metrics["rows"]
+        if rows < rules.get("min_rows", 1):
+            failures.append(f"{rows} rows, expected at least {rules.get('min_rows', 1)}")
+        for name, value in metrics.items():
+            if name.startswith("nulls.") and value:
+                failures.append(f"{value} nulls in {name[len('nulls.'):]}")
+        if rules.get("keys") and rows and metrics["distinct_keys"] < rows * (1 - QUALITY_DISTINCT_TOLERANCE):
+            failures.append(f"about {rows - metrics['distinct_keys']} duplicate ({', '.join(rules['keys'])}) keys")
+        for column, (low, high) in rules.get("ranges", {}).items():
+            lowest, highest = metrics[f"min.{column}"], metrics[f"max.{column}"]
+            if low is not None and lowest is not None and lowest < low:
+                failures.append(f"{column} min {lowest} < {low}")
+            if high is not None and highest is not None and highest > high:
+                failures.append(f"{column} max {highest} > {high}")
+        return failures
+
+    def quality_summary(self, metrics: dict, failures: list) -> dict:
+        """Snapshot summary properties recording the metrics and outcome of a write"""
+        summary = {f"{QUALITY_PROPERTY_PREFIX}{name}": str(value) for name, value in metrics.items() if value is not None}
+        summary[f"{QUALITY_PROPERTY_PREFIX}status"] = "failed" if failures else "passed"
+        if failures:
+            summary[f"{QUALITY_PROPERTY_PREFIX}failures"] = "; ".join(failures)
+        return summary
+
+    def publish_write(self, table_name: str, write, rows: DataFrame, changes: bool = False) -> None:
+        """Check QUALITY_RULES on the rows a write puts in a table, then commit them with their metrics.
+
+        write(summary) writes the table and commits summary as snapshot properties, so the data
+        and its metrics are one snapshot. rows are the written rows: the whole table, or with
+        changes=True only the rows a MERGE or partial overwrite inserts or updates (the rest of
+        the table was checked when it was written, and min_rows does not apply). A failing write
+        is never started when the checks are enforced. Tables without rules, or with the checks
+        off, are written without metrics.
+        """
+        rules = QUALITY_RULES.get(table_name) if self.quality_checks != "off" else None
+        if not rules:
+            write({})
+            return
+        if changes:
+            rules = dict(rules, min_rows=0)
+
+        metrics = rows.agg(*self.quality_metrics(rules)).first().asDict()
+        failures = self.quality_failures(rules, metrics)
+        if failures and self.quality_checks == "enforce":
+            raise ValueError(f"Data quality rules failed for {table_name}, not written: {'; '.join(failures)}")
+        if failures:
+            logging.warning(f"Data quality rules failed for {table_name} (recorded only): {'; '.join(failures)}")
+
+        summary = self.quality_summary(metrics, failures)
+        write(summary)
+        logging.info(f"✅ Data quality of {table_name}: {metrics['rows']} rows, {summary[QUALITY_PROPERTY_PREFIX + 'status']}")
+
+    def with_commit_properties(self, summary: dict, action) -> None:
+        """Run a SQL write (MERGE) whose commit carries summary as snapshot properties.
+
+        SQL statements take no snapshot-property.* write options; Iceberg reads them from
+        CommitMetadata, a thread-local set around the statement. action runs as the Java
+        Callable, called back on this thread (PySpark pins Python threads to JVM threads).
+        """
+        if not summary:
+            action()
+            return
+        gateway = self.spark.sparkContext._gateway
+        ensure_callback_server_started(gateway)
+        properties = gateway.jvm.java.util.HashMap()
+        for key, value in summary.items():
+            properties.put(key, value)
+
+        callable_action = _CallableAction(action)
+        try:
+            gateway.jvm.org.apache.iceberg.spark.CommitMetadata.withCommitProperties(
+                properties, callable_action, gateway.jvm.java.lang.Class.forName("java.lang.RuntimeException"))
+        except Exception:
+            # Report the error of the statement rather than its Py4J wrapper
+            if callable_action.error is not None:
+                raise callable_action.error
+            raise
+
+    # ---------------------------
+    #   Source fingerprints
+    # ---------------------------
+
+    def list_raw_objects(self, table_name: str) -> list:
+        """(key, size, ETag) of every object under the raw-zone prefix of a table, listed once"""
+        if table_name not in self.raw_listings:
+            self.raw_listings[table_name] = self._list_raw_objects(table_name)
+        return self.raw_listings[table_name]
+
+    def _list_raw_objects(self, table_name: str) -> list:
+        prefix = f"{self.raw_path}/public/{table_name}/"
+        if prefix.startswith("s3://") and boto3 is not None:
+            bucket, _, key_prefix = prefix[len("s3://"):].partition("/")
+            paginator = boto3.client("s3").get_paginator("list_objects_v2")
+            return sorted(
+                (obj["Key"], obj["Size"], obj["ETag"])
+                for page in paginator.paginate(Bucket=bucket, Prefix=key_prefix)
+                for obj in page.get("Contents", [])
+            )
+
+        # Other file systems: the modification time stands in for the ETag
+        jvm = self.spark._jvm
+        root = jvm.org.apache.hadoop.fs.Path(prefix)
+        fs = root.getFileSystem(self.spark._jsc.hadoopConfiguration())
+        if not fs.exists(root):
+            return []
+        objects = []
+        iterator = fs.listFiles(root, True)
+        while iterator.hasNext():
+            status = iterator.next()
+            objects.append((status.getPath().toString(), status.getLen(), str(status.getModificationTime())))
+        return sorted(objects)
+
+    def code_fingerprint(self, table_name: str) -> str:
+        methods = TABLE_IO_CODE + TABLE_CODE.get(table_name, [])
+        source = "".join(inspect.getsource(getattr(DataProcessor, method)) for method in methods)
+        source += f"{self.raw_reader}:{self.raw_since}:{self.raw_until}"
+        source += json.dumps(TABLE_LAYOUTS.get(table_name) if self.table_layouts else None, sort_keys=True)
+        if table_name in ("user_features_2", "up_features", "prd_features"):
+            source += self.feature_engine
+        return hashlib.sha256(source.encode()).hexdigest()
+
+    def compute_fingerprints(self) -> dict:
+        """Fingerprint of every silver table from its raw listings, code and upstream fingerprints.
+
+        A derived table hashes the fingerprints of its inputs, so a change anywhere upstream
+        invalidates it transitively.
+        """
+        fingerprints = {}
+        for name, inputs in TABLE_INPUTS.items():
+            parts = {"code": self.code_fingerprint(name)}
+            for source in inputs:
+                if source.startswith("raw."):
+                    parts[source] = self.list_raw_objects(source[len("raw."):])
+                else:
+                    parts[source] = fingerprints[source]
+            fingerprints[name] = hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+        return fingerprints
+
+    def stored_fingerprint(self, table_name: str):
+        if not self.table_exists(table_name):
+            return None
+        return self.get_table_properties(table_name).get(FINGERPRINT_PROPERTY)
+
+    # ---------------------------
+    #   Execution planner
+    # ---------------------------
+
+    def parquet_row_count(self, path: str) -> int:
+        """Row count from a Parquet footer, without reading any data"""
+        jvm = self.spark._jvm
+        conf = self.spark._jsc.hadoopConfiguration()
+        input_file = jvm.org.apache.parquet.hadoop.util.HadoopInputFile.fromPath(jvm.org.apache.hadoop.fs.Path(path), conf)
+        reader = jvm.org.apache.parquet.hadoop.ParquetFileReader.open(input_file)
+        try:
+            return reader.getRecordCount()
+        finally:
+            reader.close()
+
+    def raw_table_stats(self, table_name: str) -> dict:
+        """Files, compressed bytes and (estimated) rows of the raw files read_table would read"""
+        sizes = {key.split(f"/public/{table_name}/", 1)[-1]: size for key, size, _ in self.list_raw_objects(table_name)}
+        files = [(path, sizes[relative_path]) for relative_path, path in self.list_raw_files(table_name) if self.in_raw_window(relative_path)]
+        total_bytes = sum(size for _, size in files)
+
+        # Footers of evenly spaced files, extrapolated by bytes
+        step = max(1, len(files) // FOOTER_SAMPLE_FILES)
+        sample = files[::step][:FOOTER_SAMPLE_FILES]
+        sample_bytes = sum(size for _, size in sample)
+        sample_rows = sum(self.parquet_row_count(path) for path, _ in sample)
+        rows = int(sample_rows * total_bytes / sample_bytes) if sample_bytes else 0
+        return {"files": len(files), "bytes": total_bytes, "rows": rows}
+
+    def catalog_table_stats(self, table_name: str):
+        """Bytes and rows of a Glue raw table from its catalog statistics, None when it has none"""
+        relation = self.spark.read.table(f"spark_catalog.{self.raw_database}.{table_name}")
+        stats = relation._jdf.queryExecution().optimizedPlan().stats()
+        size = stats.sizeInBytes().toLong()
+        # Spark falls back to spark.sql.defaultSizeInBytes (Long.MaxValue) for tables without totalSize
+        if size >= int(self.spark.conf.get("spark.sql.defaultSizeInBytes", str(2 ** 63 - 1))):
+            return None
+        rows = stats.rowCount().get().toLong() if stats.rowCount().isDefined() else 0
+        return {"files": None, "bytes": size, "rows": rows}
+
+    def storage_memory_bytes(self) -> int:
+        """Storage memory of the block managers currently registered (driver included)"""
+        status = self.spark.sparkContext._jsc.sc().getExecutorMemoryStatus()
+        iterator, total = status.values().iterator(), 0
+        while iterator.hasNext():
+            total += iterator.next()._1()
+        return total
+
+    def bytes_conf(self, key: str, default: str) -> int:
+        return self.spark._jvm.org.apache.spark.network.util.JavaUtils.byteStringAsBytes(self.spark.conf.get(key, default))
+
+    def configured_executors(self) -> int:
+        """Executors the job is configured to get (the dynamic allocation maximum), 0 when unbounded"""
+        conf = self.spark.conf
+        if conf.get("spark.dynamicAllocation.enabled", "false").lower() == "true":
+            executors = int(conf.get("spark.dynamicAllocation.maxExecutors", str(UNBOUNDED_EXECUTORS)))
+        else:
+            executors = int(conf.get("spark.executor.instances", "0"))
+        return 0 if executors >= UNBOUNDED_EXECUTORS else executors
+
+    def yarn_executor_slots(self, executor_cores: int, executor_bytes: int) -> int:
+        """Executors of this size that fit on the running YARN nodes"""
+        jvm = self.spark._jvm
+        client = jvm.org.apache.hadoop.yarn.client.api.YarnClient.createYarnClient()
+        client.init(self.spark._jsc.hadoopConfiguration())
+        client.start()
+        try:
+            node_state = jvm.org.apache.hadoop.yarn.api.records.NodeState
+            states = self.spark.sparkContext._gateway.new_array(node_state, 1)
+            states[0] = node_state.RUNNING
+            slots = 0
+            for report in client.getNodeReports(states):
+                capability = report.getCapability()
+                slots += min(capability.getVirtualCores() // executor_cores,
+                             capability.getMemorySize() * 1024 * 1024 // executor_bytes)
+            return slots
+        finally:
+            client.stop()
+
+    def cluster_capacity(self) -> dict:
+        """Executors, task slots and storage memory of the cluster the job runs on.
+
+        Taken from the configuration and the YARN nodes, not from the executors registered so
+        far: at startup (and with dynamic allocation) only a few of them, or none, exist yet.
+        """
+        sc = self.spark.sparkContext
+        if not sc.master.startswith("yarn"):
+            # Local mode: the driver runs the tasks and is registered from the start
+            return {"executors": 1, "cores": sc.defaultParallelism, "storage_memory_bytes": self.storage_memory_bytes()}
+
+        executor_cores = int(self.spark.conf.get("spark.executor.cores", "1"))
+        heap_bytes = self.bytes_conf("spark.executor.memory", "1g")
+        overhead_bytes = max(MIN_MEMORY_OVERHEAD_BYTES, int(heap_bytes * float(self.spark.conf.get("spark.executor.memoryOverheadFactor", "0.1"))))
+        executors = self.configured_executors()
+        if not executors:
+            try:
+                executors = self.yarn_executor_slots(executor_cores, heap_bytes + overhead_bytes)
+            except Exception as e:
+                logging.warning(f"Could not read the YARN nodes, planning for the registered executors: {e}")
+                executors = sc._jsc.sc().getExecutorMemoryStatus().size() - 1
+            executors = max(1, executors)
+        storage_fraction = float(self.spark.conf.get("spark.memory.fraction", "0.6"))
+        return {
+            "executors": executors,
+            "cores": executors * executor_cores,
+            "storage_memory_bytes": int(executors * max(0, heap_bytes - RESERVED_MEMORY_BYTES) * storage_fraction),
+        }
+
+    def broadcast_limit(self) -> int:
+        """Largest side worth broadcasting: an eighth of executor memory, capped"""
+        return min(MAX_BROADCAST_BYTES, self.bytes_conf("spark.executor.memory", "1g") // 8)
+
+    def configure_adaptive(self, shuffle_partitions: int, broadcast_bytes: int) -> None:
+        """AQE on, with the initial shuffle partitions and the runtime broadcast limit"""
+        conf = self.spark.conf
+        conf.set("spark.sql.adaptive.enabled", "true")
+        conf.set("spark.sql.adaptive.coalescePartitions.enabled", "true")
+        conf.set("spark.sql.adaptive.skewJoin.enabled", "true")
+        conf.set("spark.sql.adaptive.advisoryPartitionSizeInBytes", str(TARGET_PARTITION_BYTES))
+        conf.set("spark.sql.adaptive.autoBroadcastJoinThreshold", str(broadcast_bytes))
+        conf.set("spark.sql.shuffle.partitions", str(shuffle_partitions))
+
+    def plan_execution(self, logger, built: list) -> dict:
+        """Choose shuffle partitions, the order_products_prior join and its cache level.
+
+        - shuffle partitions: the expanded bytes of the join inputs over TARGET_PARTITION_BYTES,
+          rounded up to whole waves of the cluster's task slots (AQE coalesces the small ones)
+        - join: broadcast the prior orders when they fit an eighth of executor memory,
+          otherwise sort-merge
+        - cache: none unless order_products_prior is read by more than one step, memory only
+          when it fits half the cluster's storage memory, memory and disk otherwise
+
+        The files reader sizes the inputs from the raw listing and footers, the catalog reader
+        from the Glue table statistics. Without sizes, the shuffle partitions stay at the Spark
+        setting (in whole waves), the join is sort-merge and the cache spills to disk.
+        """
+        if self.planner == "off":
+            self.plan = {}
+            return self.plan
+
+        if self.raw_reader == "catalog":
+            stats = {name: self.catalog_table_stats(name) for name in RAW_SCHEMAS}
+        else:
+            stats = {name: self.raw_table_stats(name) for name in RAW_SCHEMAS}
+        orders, lines = stats["orders"], [stats["order_products__prior"], stats["order_products__train"]]
+        capacity = self.cluster_capacity()
+        parallelism = max(1, capacity["cores"])
+        broadcast_bytes = self.broadcast_limit()
+        consumers = [name for name in ("order_products_prior", "user_features_2", "up_features", "prd_features") if name in built]
+
+        if orders is not None and None not in lines:
+            orders_bytes = orders["bytes"] * PARQUET_EXPANSION
+            lines_bytes = sum(s["bytes"] for s in lines) * PARQUET_EXPANSION
+            lines_rows = sum(s["rows"] for s in lines)
+            partitions = max(1, -(-(orders_bytes + lines_bytes) // TARGET_PARTITION_BYTES))
+            join = "broadcast" if orders_bytes <= broadcast_bytes else "merge"
+            # Every order line carries its order's columns after the join
+            order_row_bytes = orders_bytes / orders["rows"] if orders["rows"] else 0
+            cache_bytes = int(lines_bytes + lines_rows * order_row_bytes)
+        else:
+            partitions = int(self.spark.conf.get("spark.sql.shuffle.partitions", "200"))
+            join, cache_bytes = "merge", None
+        partitions = -(-partitions // parallelism) * parallelism
+
+        if len(consumers) < 2:
+            cache_level = "NONE"
+        elif cache_bytes is not None and cache_bytes <= capacity["storage_memory_bytes"] // 2:
+            cache_level = "MEMORY_ONLY"
+        else:
+            cache_level = "MEMORY_AND_DISK"
+
+        self.configure_adaptive(partitions, broadcast_bytes)
+        self.plan = {
+            "raw": stats,
+            "executors": capacity["executors"],
+            "task_slots": parallelism,
+            "shuffle_partitions": partitions,
+            "broadcast_bytes": broadcast_bytes,
+            "order_products_prior_join": join,
+            "order_products_prior_cache": cache_level,
+            "cache_bytes_estimate": cache_bytes,
+            "storage_memory_bytes": capacity["storage_memory_bytes"],
+        }
+        logger.info(f"Execution plan: {json.dumps(self.plan)}")
+        return self.plan
+
+    def persist(self, df: DataFrame, level: str) -> DataFrame:
+        """Persist with a StorageLevel name; "NONE" leaves the DataFrame uncached"""
+        if level == "NONE":
+            return df
+        return df.persist(getattr(StorageLevel, level))
+
+    # ---------------------------
+    #   Hot keys
+    # ---------------------------
+
+    def hot_keys(self, df: DataFrame, column: str, label: str) -> list:
+        """Heavy-hitter values of a column, estimated from a sample in one Spark job"""
+        if self.skew_handling == "off":
+            return []
+        with self.stage(f"hot_keys.{label}"):
+            return self._hot_keys(df, column, label)
+
+    def _hot_keys(self, df: DataFrame, column: str, label: str) -> list:
+        # The per-key counts are cached, so the total and the top keys come from one sample scan;
+        # the top keys are a takeOrdered, no single row collects every key
+        counts = df.select(column).sample(fraction=SKEW_SAMPLE_FRACTION, seed=SKEW_SAMPLE_SEED) \
+            .filter(col(column).isNotNull()) \
+            .groupBy(column).count() \
+            .persist(StorageLevel.MEMORY_AND_DISK)
+        try:
+            total = counts.agg(F.sum("count")).first()[0]
+            if not total:
+                return []
+            top = counts.orderBy(F.desc("count")).limit(MAX_HOT_KEYS).collect()
+        finally:
+            counts.unpersist()
+
+        partitions = int(self.spark.conf.get("spark.sql.shuffle.partitions"))
+        threshold = max(HOT_KEY_MIN_SAMPLE, HOT_KEY_FACTOR * total / partitions)
+        hot = [entry for entry in top if entry["count"] > threshold]
+        if hot:
+            logging.info(f"Hot {column} keys for {label} (estimated rows): " + ", ".join(
+                f"{entry[column]}={int(entry['count'] / SKEW_SAMPLE_FRACTION)}" for entry in hot))
+        return [entry[column] for entry in hot]
+
+    def two_phase_agg(self, df: DataFrame, key: str, salt_column: str, partials: dict, hot: list) -> DataFrame:
+        """groupBy(key).agg(partials), with the rows of hot keys pre-aggregated over salted groups.
+
+        partials must be sums or counts, so that the salted partials add up to the same result;
+        non-nullable partials (counts) stay non-nullable.
+        """
+        if not hot:
+            return df.groupBy(key).agg(*[expr.alias(name) for name, expr in partials.items()])
+
+        salt = when(col(key).isin(hot), F.pmod(F.xxhash64(salt_column), F.lit(SALT_BUCKETS))).otherwise(0)
+        salted = df.withColumn("_salt", salt) \
+            .groupBy(key, "_salt") \
+            .agg(*[expr.alias(name) for name, expr in partials.items()])
+        return salted.groupBy(key).agg(*[
+            (F.sum(name) if salted.schema[name].nullable else F.coalesce(F.sum(name), F.lit(0))).alias(name)
+            for name in partials
+        ])
+
+    # ---------------------------
+    #   Run report
+    # ---------------------------
+
+    @contextmanager
+    def stage(self, name: str):
+        """Tag the Spark jobs started in the block (on this thread) with a DataProcessor stage"""
+        sc = self.spark.sparkContext
+        previous = [(key, sc.getLocalProperty(key)) for key in ("spark.jobGroup.id", "spark.job.description")]
+        sc.setJobGroup(f"{sc.applicationId}-{name}", name)
+        try:
+            yield
+        finally:
+            for key, value in previous:
+                sc.setLocalProperty(key, value)
+
+    def spark_status(self, path: str):
+        """GET from the REST API of Spark's status store (fed by its own listener)"""
+        sc = self.spark.sparkContext
+        with urllib.request.urlopen(f"{sc.uiWebUrl}/api/v1/applications/{sc.applicationId}/{path}") as response:
+            return json.load(response)
+
+    @staticmethod
+    def _status_time(value: str) -> float:
+        return datetime.strptime(value, STATUS_TIME_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+
+    def task_durations(self, spark_stage: dict) -> list:
+        quantiles = ",".join(str(q) for q in REPORT_QUANTILES)
+        summary = self.spark_status(f"stages/{spark_stage['stageId']}/{spark_stage['attemptId']}/taskSummary?quantiles={quantiles}")
+        return summary.get("duration", [])
+
+    def stage_metrics(self) -> dict:
+        """Metrics of the Spark jobs of the run, grouped by the DataProcessor stage that started them.
+
+        Jobs are tagged by job group (run_step and stage()); a Spark stage reused by a later
+        job (cached or shuffled data) counts for the job that ran it first. Lazy process_*
+        transformations run inside the jobs of the write or action that consumes them.
+        """
+        prefix = f"{self.spark.sparkContext.applicationId}-"
+        jobs = sorted(self.spark_status("jobs"), key=lambda job: job["jobId"])
+        spark_stages = {}
+        for spark_stage in self.spark_status("stages"):
+            if spark_stage["status"] != "SKIPPED":
+                spark_stages[spark_stage["stageId"]] = spark_stage
+
+        groups, owner = {}, {}
+        for job in jobs:
+            group = job.get("jobGroup") or ""
+            name = group[len(prefix):] if group.startswith(prefix) else "untagged"
+            groups.setdefault(name, []).append(job)
+            for stage_id in job["stageIds"]:
+                owner.setdefault(stage_id, name)
+
+        report = {}
+        for name, group_jobs in groups.items():
+            owned = [spark_stages[i] for i, stage_name in owner.items() if stage_name == name and i in spark_stages]
+            started = [self._status_time(job["submissionTime"]) for job in group_jobs if job.get("submissionTime")]
+            finished = [self._status_time(job["completionTime"]) for job in group_jobs if job.get("completionTime")]
+            metrics = {
+                "wall_seconds": round(max(finished) - min(started), 3) if started and finished else None,
+                "jobs": len(group_jobs),
+                "failed_jobs": sum(job["status"] == "FAILED" for job in group_jobs),
+                "spark_stages": len(owned),
+                "tasks": sum(st["numCompleteTasks"] for st in owned),
+                "executor_run_ms": sum(st["executorRunTime"] for st in owned),
+                "gc_ms": sum(st.get("jvmGcTime", 0) for st in owned),
+                "input_bytes": sum(st["inputBytes"] for st in owned),
+                "shuffle_read_bytes": sum(st["shuffleReadBytes"] for st in owned),
+                "shuffle_write_bytes": sum(st["shuffleWriteBytes"] for st in owned),
+                "memory_spilled_bytes": sum(st["memoryBytesSpilled"] for st in owned),
+                "disk_spilled_bytes": sum(st["diskBytesSpilled"] for st in owned),
+                "output_records": sum(st["outputRecords"] for st in owned),
+            }
+
+            # Task durations of the heaviest Spark stage, skew (max/median task) of the worst one
+            skew, skewed_stage = 1.0, None
+            for spark_stage in sorted(owned, key=lambda st: st["executorRunTime"], reverse=True):
+                if spark_stage["numCompleteTasks"] < 2:
+                    continue
+                durations = self.task_durations(spark_stage)
+                if "task_duration_ms" not in metrics:
+                    metrics["task_duration_ms"] = dict(zip(["min", "p25", "median", "p75", "max"], durations))
+                if len(durations) == len(REPORT_QUANTILES) and durations[2] > 0 and durations[-1] / durations[2] > skew:
+                    skew, skewed_stage = durations[-1] / durations[2], spark_stage["stageId"]
+            metrics["skew_ratio"] = round(skew, 2)
+            metrics["skewed_spark_stage"] = skewed_stage
+            report[name] = metrics
+        return report
+
+    def table_commit(self, table_name: str, since: float) -> dict:
+        """Rows and files added by the latest snapshot of a silver table, if committed since"""
+        if not self.table_exists(table_name):
+            return {}
+        rows = self.spark.sql(
+            f"SELECT committed_at, summary FROM {self.silver_table(table_name)}.snapshots ORDER BY committed_at DESC LIMIT 1"
+        ).collect()
+        if not rows or rows[0]["committed_at"].timestamp() < since:
+            return {}
+        summary = rows[0]["summary"]
+        # Tables with rules carry the data quality outcome in the same snapshot
+        quality = {}
+        if f"{QUALITY_PROPERTY_PREFIX}status" in summary:
+            quality = {"quality_status": summary[f"{QUALITY_PROPERTY_PREFIX}status"]}
+        return {
+            "output_rows": int(summary.get("added-records", 0)),
+            "output_files": int(summary.get("added-data-files", 0)),
+            "operation": summary.get("operation"),
+            **quality,
+        }
+
+    def write_run_report(self, logger, status: str, started: float) -> None:
+        """Log the per-stage report and write it as JSON to spark.imba.reportPath"""
+        if not self.spark.sparkContext.uiWebUrl:
+            logger.warning("Spark UI is disabled, no run report")
+            return
+        try:
+            stages = self.stage_metrics()
+            for name, metrics in stages.items():
+                if name in TABLE_INPUTS or name in PRIMARY_KEYS:
+                    metrics.update(self.table_commit(name, started))
+
+            report = {
+                "app_id": self.spark.sparkContext.applicationId,
+                "status": status,
+                "write_mode": self.write_mode,
+                "feature_engine": self.feature_engine,
+                "started_at": datetime.fromtimestamp(started, timezone.utc).isoformat(),
+                "wall_seconds": round(time.time() - started, 3),
+                "plan": {key: value for key, value in self.plan.items() if key != "raw"},
+                "stages": stages,
+            }
+            for name, metrics in sorted(stages.items(), key=lambda item: -(item[1]["wall_seconds"] or 0)):
+                logger.info(
+                    f"Stage {name}: {metrics['wall_seconds']}s, {metrics['tasks']} tasks, "
+                    f"shuffle {metrics['shuffle_write_bytes']}B, spill {metrics['disk_spilled_bytes']}B, "
+                    f"gc {metrics['gc_ms']}ms, skew x{metrics['skew_ratio']}"
+                )
+
+            if self.report_path:
+                jvm = self.spark._jvm
+                path = jvm.org.apache.hadoop.fs.Path(self.report_path)
+                out = path.getFileSystem(self.spark._jsc.hadoopConfiguration()).create(path, True)
+                try:
+                    out.write(bytearray(json.dumps(report, indent=2).encode()))
+                finally:
+                    out.close()
+                logger.info(f"Run report written to {self.report_path}")
+        except Exception as e:
+            # The report never fails (or masks the failure of) the job itself
+            logger.warning(f"Could not build the run report: {e}")
+
+    # ---------------------------
+    #   Step scheduler
+    # ---------------------------
+
+    def run_step(self, logger, name: str, action) -> None:
+        """Run one step in its own job group and FAIR scheduler pool (set per thread)"""
+        sc = self.spark.sparkContext
+        sc.setJobGroup(f"{sc.applicationId}-{name}", f"Writing {name}", interruptOnCancel=True)
+        sc.setLocalProperty("spark.scheduler.pool", name)
+        start = time.time()
+        logger.info(f"Writing table: {name}")
+        print(f"🔥 Writing {name} to Iceberg format in silver database...")
+        try:
+            action()
+        finally:
+            sc.setLocalProperty("spark.scheduler.pool", None)
+        logger.info(f"Finished table: {name} in {time.time() - start:.1f}s")
+
+    def run_steps(self, logger, steps: list) -> None:
+        """Run (name, action, dependencies) steps concurrently, each once its dependencies finished.
+
+        Up to spark.imba.maxConcurrentWrites steps run at a time. The first failure cancels the
+        Spark jobs of every running step and the steps not started yet, then re-raises.
+        """
+        pending = {name: (action, set(dependencies)) for name, action, dependencies in steps}
+        unknown = {dep for _, deps in pending.values() for dep in deps} - pending.keys()
+        if unknown:
+            raise ValueError(f"Unknown step dependencies: {sorted(unknown)}")
+
+        sc = self.spark.sparkContext
+        done, running = set(), {}
+        with ThreadPoolExecutor(max_workers=self.max_concurrent_writes) as executor:
+            try:
+                while pending or running:
+                    ready = [name for name, (_, deps) in pending.items() if deps <= done]
+                    if not ready and not running:
+                        raise ValueError(f"Circular step dependencies: {sorted(pending)}")
+                    for name in ready:
+                        action, _ = pending.pop(name)
+                        running[executor.submit(self.run_step, logger, name, action)] = name
+
+                    finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        name = running.pop(future)
+                        future.result()
+                        done.add(name)
+            except Exception:
+                logger.error(f"Step failed, cancelling {sorted(running.values())}")
+                for future, name in running.items():
+                    future.cancel()
+                    sc.cancelJobGroup(f"{sc.applicationId}-{name}")
+                raise
+
+    # ---------------------------
+    #   CDC (incremental mode)
+    # ---------------------------
+
+    def list_cdc_files(self, table_name: str, watermark: str = "") -> list:
+        """List DMS CDC files for a table newer than the watermark.
+
+        DMS writes the full load as LOAD*.parquet at the table prefix and CDC files under
+        date partitions (YYYY/MM/DD/<timestamp>.parquet), so the path relative to the
+        table prefix sorts in commit order.
+        """
+        return sorted(
+            (relative_path, path) for relative_path, path in self.list_raw_files(table_name)
+            if not relative_path.startswith("LOAD") and relative_path > watermark and self.in_raw_window(relative_path)
+        )
+
+    def read_changes(self, table_name: str, files: list) -> DataFrame:
+        """Read CDC files and keep the last change per primary key"""
+        keys = PRIMARY_KEYS[table_name]
+        df = self.spark.read.parquet(*[path for _, path in files]) \
+            .withColumn("_cdc_file", F.input_file_name()) \
+            .withColumn("_cdc_seq", F.monotonically_increasing_id())
+
+        order = [F.col("_cdc_file").desc(), F.col("_cdc_seq").desc()]
+        if DMS_COMMIT_TS_COLUMN in df.columns:
+            order.insert(0, F.col(DMS_COMMIT_TS_COLUMN).desc_nulls_last())
+        window = Window.partitionBy(*keys).orderBy(*order)
+
+        return df.withColumn("_cdc_rank", F.row_number().over(window)) \
+            .filter(col("_cdc_rank") == 1) \
+            .drop("_cdc_rank", "_cdc_file", "_cdc_seq")
+
+    def merge_table(self, changes: DataFrame, table_name: str, keys: list) -> None:
+        """MERGE deduplicated changes (with the DMS Op column) into a silver table, checked before the commit"""
+        target_columns = self.read_silver_table(table_name).columns
+        view = f"cdc_{table_name}"
+        # The quality metrics and the MERGE both read the changes
+        source = changes.select(*target_columns, DMS_OP_COLUMN).persist(StorageLevel.MEMORY_AND_DISK)
+        source.createOrReplaceTempView(view)
+
+        on = " AND ".join(f"t.{key} = s.{key}" for key in keys)
+        updates = ", ".join(f"t.{c} = s.{c}" for c in target_columns)
+        values = ", ".join(f"s.{c}" for c in target_columns)
+
+        def merge():
+            self.spark.sql(f"""
+                MERGE INTO {self.silver_table(table_name)} t
+                USING {view} s
+                ON {on}
+                WHEN MATCHED AND s.{DMS_OP_COLUMN} = 'D' THEN DELETE
+                WHEN MATCHED THEN UPDATE SET {updates}
+                WHEN NOT MATCHED AND s.{DMS_OP_COLUMN} <> 'D' THEN INSERT ({", ".join(target_columns)}) VALUES ({values})
+            """)
+
+        try:
+            self.publish_write(table_name, lambda summary: self.with_commit_properties(summary, merge),
+                               source.filter(col(DMS_OP_COLUMN) != "D").drop(DMS_OP_COLUMN), changes=True)
+        finally:
+            source.unpersist()
+
+    def current_snapshot_id(self, table_name: str):
+        rows = self.spark.sql(f"SELECT snapshot_id FROM {self.silver_table(table_name)}.refs WHERE name = 'main'").collect()
+        return rows[0]["snapshot_id"] if rows else None
+
+    def read_silver_snapshot(self, table_name: str, snapshot_id) -> DataFrame:
+        """Read a silver table as of a snapshot (time travel)"""
+        return self.spark.read.option("snapshot-id", snapshot_id).table(self.silver_table(table_name))
+
+    def replace_orders(self, df: DataFrame, table_name: str, order_ids: list) -> None:
+        """Atomically replace the rows of the given orders in a silver table, checked before the commit"""
+        def overwrite(summary):
+            writer = df.writeTo(self.silver_table(table_name))
+            for key, value in summary.items():
+                writer = writer.option(f"snapshot-property.{key}", value)
+            writer.overwrite(col("order_id").isin(order_ids))
+
+        self.publish_write(table_name, overwrite, df, changes=True)
+
 
     def process_order_products__eval(self, df: DataFrame) -> DataFrame:
         # print("Before transform reordered: ")
@@ -82,11 +1192,15 @@ class DataProcessor:
         return order_products
 
     def process_order_products_prior(self, orders_df: DataFrame, order_products: DataFrame) -> DataFrame:
-        orders_prior_df = orders_df.filter(col('eval_set')=='prior').repartition("order_id")
-        order_products = order_products.repartition("order_id")
-        return orders_prior_df.join(order_products, on="order_id", how="inner").select(
-            orders_prior_df['*'], order_products['product_id'], order_products['add_to_cart_order'], order_products['reordered']
-        )
+        # The join shuffles (or broadcasts) on order_id itself, no repartition needed up front.
+        # An order has at most a few hundred lines, so order_id is not skewed; AQE still splits
+        # oversized sort-merge partitions (spark.sql.adaptive.skewJoin.enabled)
+        orders_prior_df = orders_df.filter(col('eval_set')=='prior')
+        columns = orders_prior_df.columns + ['product_id', 'add_to_cart_order', 'reordered']
+        join = self.plan.get("order_products_prior_join")
+        if join:
+            orders_prior_df = orders_prior_df.hint(join)
+        return orders_prior_df.join(order_products, on="order_id", how="inner").select(*columns)
 
     def process_user_features_1(self, orders_df: DataFrame) -> DataFrame:
         return orders_df.groupBy('user_id').agg(
@@ -118,63 +1232,525 @@ class DataProcessor:
     def process_prd_features(self, order_products_prior: DataFrame) -> DataFrame:
         window = Window.partitionBy('user_id', 'product_id').orderBy('order_number')
         df = order_products_prior.withColumn('product_seq_time', F.row_number().over(window))
-        return df.groupBy('product_id').agg(
+        return self.two_phase_agg(df, 'product_id', 'user_id', {
+            'total_purchases': F.count('*'),
+            'total_reorders': F.sum(when(col('reordered') == 1, 1).otherwise(0)),
+            'first_time_purchases': F.sum(when(col('product_seq_time') == 1, 1).otherwise(0)),
+            'second_time_purchases': F.sum(when(col('product_seq_time') == 2, 1).otherwise(0)),
+        }, self.hot_keys(order_products_prior, 'product_id', 'prd_features'))
+
+    # ---------------------------
+    #   Fused feature engine
+    # ---------------------------
+
+    def process_pair_partials(self, order_products_prior: DataFrame) -> DataFrame:
+        """Partial aggregates per (user_id, product_id), the only shuffle of order_products_prior.
+
+        up_features is a projection of it, user and product features are rollups of it. The first
+        and second time purchases of a pair are its first and second order, so they follow from
+        the per-pair order count without the row_number() window.
+        """
+        return order_products_prior.groupBy(['user_id', 'product_id']).agg(
+            F.count('order_id').alias('total_number_orders'),
+            F.min('order_number').alias('min_order_number'),
+            F.max('order_number').alias('max_order_number'),
+            F.mean('add_to_cart_order').alias('avg_add_to_cart_order'),
+            F.sum('add_to_cart_order').alias('add_to_cart_order_sum'),
+            F.count('add_to_cart_order').alias('add_to_cart_order_count'),
+            F.count('*').alias('row_count'),
+            F.count('product_id').alias('product_count'),
+            F.sum(when(col('reordered') == 1, 1).otherwise(0)).alias('reordered_sum'),
+            F.count(when(col('order_number') > 1, 1)).alias('repeat_order_count')
+        )
+
+    def up_features_state_from_pairs(self, pairs: DataFrame) -> DataFrame:
+        return pairs.select(
+            'user_id', 'product_id', 'total_number_orders', 'min_order_number', 'max_order_number',
+            'add_to_cart_order_sum', 'add_to_cart_order_count'
+        )
+
+    def user_features_2_state_from_pairs(self, pairs: DataFrame) -> DataFrame:
+        # coalesce keeps count() columns non-nullable, so the table schemas match the legacy engine
+        return pairs.groupBy('user_id').agg(
+            F.coalesce(F.sum('product_count'), F.lit(0)).alias('total_number_products'),
+            F.count('product_id').alias('total_number_distinct_products'),
+            F.sum('reordered_sum').alias('reordered_sum'),
+            F.sum('repeat_order_count').alias('repeat_order_count')
+        )
+
+    def prd_features_from_pairs(self, pairs: DataFrame) -> DataFrame:
+        return self.two_phase_agg(pairs, 'product_id', 'user_id', {
+            'total_purchases': F.coalesce(F.sum('row_count'), F.lit(0)),
+            'total_reorders': F.sum('reordered_sum'),
+            'first_time_purchases': F.sum(F.lit(1)),
+            'second_time_purchases': F.sum(when(col('row_count') >= 2, 1).otherwise(0)),
+        }, self.hot_keys(pairs, 'product_id', 'prd_features'))
+
+    def process_features_fused(self, order_products_prior: DataFrame) -> dict:
+        pairs = self.process_pair_partials(order_products_prior).cache()
+        return {
+            "user_features_2": self.user_features_2_from_state(self.user_features_2_state_from_pairs(pairs)),
+            "up_features": pairs.select(
+                'user_id', 'product_id', 'total_number_orders', 'min_order_number', 'max_order_number', 'avg_add_to_cart_order'
+            ),
+            "prd_features": self.prd_features_from_pairs(pairs),
+        }
+
+    def process_features(self, order_products_prior: DataFrame) -> dict:
+        """user_features_2, up_features and prd_features with the configured engine"""
+        if self.feature_engine == "fused":
+            return self.process_features_fused(order_products_prior)
+        return {
+            "user_features_2": self.process_user_features_2(order_products_prior),
+            "up_features": self.process_up_features(order_products_prior),
+            "prd_features": self.process_prd_features(order_products_prior),
+        }
+
+    # ---------------------------
+    #   Feature partial state
+    # ---------------------------
+
+    def process_user_features_1_state(self, orders_df: DataFrame) -> DataFrame:
+        return orders_df.groupBy('user_id').agg(
+            F.max('order_number').alias('max_order_num'),
+            F.sum('days_since_prior').alias('sum_days_since_prior_order'),
+            F.count('days_since_prior').alias('days_since_prior_count')
+        )
+
+    def process_user_features_2_state(self, order_products_prior: DataFrame) -> DataFrame:
+        df = order_products_prior.withColumn(
+            'reordered_flag', when(col('reordered') == 1, 1).otherwise(0)
+        ).withColumn(
+            'repeat_order_flag', when(col('order_number') > 1, 1).otherwise(None)
+        )
+        return df.groupBy('user_id').agg(
+            F.count('product_id').alias('total_number_products'),
+            F.countDistinct('product_id').alias('total_number_distinct_products'),
+            F.sum('reordered_flag').alias('reordered_sum'),
+            F.count('repeat_order_flag').alias('repeat_order_count')
+        )
+
+    def process_up_features_state(self, order_products_prior: DataFrame) -> DataFrame:
+        return order_products_prior.groupBy(['user_id', 'product_id']).agg(
+            F.count('order_id').alias('total_number_orders'),
+            F.min('order_number').alias('min_order_number'),
+            F.max('order_number').alias('max_order_number'),
+            F.sum('add_to_cart_order').alias('add_to_cart_order_sum'),
+            F.count('add_to_cart_order').alias('add_to_cart_order_count')
+        )
+
+    def user_features_1_from_state(self, state: DataFrame) -> DataFrame:
+        return state.select(
+            'user_id', 'max_order_num', 'sum_days_since_prior_order',
+            (col('sum_days_since_prior_order') / col('days_since_prior_count')).alias('avg_days_since_prior_order')
+        )
+
+    def user_features_2_from_state(self, state: DataFrame) -> DataFrame:
+        return state.select(
+            'user_id', 'total_number_products', 'total_number_distinct_products',
+            (col('reordered_sum') / col('repeat_order_count')).alias('user_reorder_ratio')
+        )
+
+    def up_features_from_state(self, state: DataFrame) -> DataFrame:
+        return state.select(
+            'user_id', 'product_id', 'total_number_orders', 'min_order_number', 'max_order_number',
+            (col('add_to_cart_order_sum') / col('add_to_cart_order_count')).alias('avg_add_to_cart_order')
+        )
+
+    @staticmethod
+    def _add(old: str, new: str):
+        # Sum of two partial sums where either side may be missing (null when both are)
+        return F.coalesce(col(old) + col(new), col(old), col(new))
+
+    @staticmethod
+    def _add_counts(old: str, new: str):
+        return F.coalesce(col(old), F.lit(0)) + F.coalesce(col(new), F.lit(0))
+
+    def fold_user_features_1_state(self, state: DataFrame, delta: DataFrame) -> DataFrame:
+        o, d = state.alias('o'), delta.alias('d')
+        return d.join(o, on='user_id', how='left').select(
+            'user_id',
+            F.greatest('o.max_order_num', 'd.max_order_num').alias('max_order_num'),
+            self._add('o.sum_days_since_prior_order', 'd.sum_days_since_prior_order').alias('sum_days_since_prior_order'),
+            self._add_counts('o.days_since_prior_count', 'd.days_since_prior_count').alias('days_since_prior_count')
+        )
+
+    def fold_user_features_2_state(self, state: DataFrame, delta: DataFrame) -> DataFrame:
+        # delta.total_number_distinct_products counts only pairs new to up_features_state
+        o, d = state.alias('o'), delta.alias('d')
+        return d.join(o, on='user_id', how='left').select(
+            'user_id',
+            self._add_counts('o.total_number_products', 'd.total_number_products').alias('total_number_products'),
+            self._add_counts('o.total_number_distinct_products', 'd.total_number_distinct_products').alias('total_number_distinct_products'),
+            self._add_counts('o.reordered_sum', 'd.reordered_sum').alias('reordered_sum'),
+            self._add_counts('o.repeat_order_count', 'd.repeat_order_count').alias('repeat_order_count')
+        )
+
+    def fold_up_features_state(self, state: DataFrame, delta: DataFrame) -> DataFrame:
+        o, d = state.alias('o'), delta.alias('d')
+        return d.join(o, on=['user_id', 'product_id'], how='left').select(
+            'user_id', 'product_id',
+            self._add_counts('o.total_number_orders', 'd.total_number_orders').alias('total_number_orders'),
+            F.least('o.min_order_number', 'd.min_order_number').alias('min_order_number'),
+            F.greatest('o.max_order_number', 'd.max_order_number').alias('max_order_number'),
+            self._add('o.add_to_cart_order_sum', 'd.add_to_cart_order_sum').alias('add_to_cart_order_sum'),
+            self._add_counts('o.add_to_cart_order_count', 'd.add_to_cart_order_count').alias('add_to_cart_order_count')
+        )
+
+    def fold_prd_features(self, features: DataFrame, delta: DataFrame) -> DataFrame:
+        o, d = features.alias('o'), delta.alias('d')
+        return d.join(o, on='product_id', how='left').select(
+            'product_id',
+            *[self._add_counts(f'o.{c}', f'd.{c}').alias(c)
+              for c in ['total_purchases', 'total_reorders', 'first_time_purchases', 'second_time_purchases']]
+        )
+
+    def delta_prd_features(self, delta_rows: DataFrame, delta_up: DataFrame, old_up: DataFrame) -> DataFrame:
+        """prd_features increments: a pair crossing 1 (2) purchases adds a first (second) time purchase"""
+        crossings = delta_up.alias('d').join(old_up.alias('o'), on=['user_id', 'product_id'], how='left') \
+            .select(
+                'product_id',
+                F.coalesce(col('o.total_number_orders'), F.lit(0)).alias('before'),
+                (F.coalesce(col('o.total_number_orders'), F.lit(0)) + col('d.total_number_orders')).alias('after')
+            ).groupBy('product_id').agg(
+                F.sum(when(col('before') == 0, 1).otherwise(0)).alias('first_time_purchases'),
+                F.sum(when((col('before') < 2) & (col('after') >= 2), 1).otherwise(0)).alias('second_time_purchases')
+            )
+        purchases = delta_rows.groupBy('product_id').agg(
             F.count('*').alias('total_purchases'),
-            F.sum(when(col('reordered') == 1, 1).otherwise(0)).alias('total_reorders'),
-            F.sum(when(col('product_seq_time') == 1, 1).otherwise(0)).alias('first_time_purchases'),
-            F.sum(when(col('product_seq_time') == 2, 1).otherwise(0)).alias('second_time_purchases')
+            F.sum(when(col('reordered') == 1, 1).otherwise(0)).alias('total_reorders')
         )
+        return purchases.join(crossings, on='product_id', how='inner')
+
+    def delta_user_features_2_state(self, delta_rows: DataFrame, delta_up: DataFrame, old_up: DataFrame) -> DataFrame:
+        new_pairs = delta_up.join(old_up, on=['user_id', 'product_id'], how='left_anti') \
+            .groupBy('user_id').agg(F.count('*').alias('new_distinct_products'))
+        return self.process_user_features_2_state(delta_rows) \
+            .join(new_pairs, on='user_id', how='left') \
+            .withColumn('total_number_distinct_products', F.coalesce(col('new_distinct_products'), F.lit(0))) \
+            .drop('new_distinct_products')
+
+    def run_full(self, logger) -> None:
+        fingerprints = self.compute_fingerprints()
+        unchanged = {
+            name for name in TABLE_INPUTS
+            if self.skip_unchanged and self.stored_fingerprint(name) == fingerprints[name]
+        }
+
+        def source(name, build):
+            # An unchanged table is read back from silver instead of being rebuilt from raw
+            return self.read_silver_table(name) if name in unchanged else build()
+
+        # Read the raw tables whose silver copy is out of date
+        built = [name for name in TABLE_INPUTS if name not in unchanged]
+        self.plan_execution(logger, built)
+        raw = self.read_table
+        print("🔥 Starting to read first table...")
+        products_df = source("products", lambda: raw("products"))
+        departments_df = source("departments", lambda: raw("departments"))
+        aisles_df = source("aisles", lambda: raw("aisles"))
+        orders_df = source("orders", lambda: raw("orders"))
+        logger.info("Successfully loaded all raw tables.")
+
+        # Process data
+        order_products__train_df2 = source("order_products__train", lambda: self.process_order_products__eval(raw("order_products__train")))
+        order_products__prior_df2 = source("order_products__prior", lambda: self.process_order_products__eval(raw("order_products__prior")))
+        order_products = source("order_products", lambda: self.process_order_products(order_products__prior_df2, order_products__train_df2))
+        order_products_prior = self.persist(
+            source("order_products_prior", lambda: self.process_order_products_prior(orders_df, order_products)),
+            self.plan.get("order_products_prior_cache", "MEMORY_AND_DISK"))
+
+        user_features_1 = self.process_user_features_1(orders_df)
+        # Only build the feature frames when one of them is written (hot key detection runs eagerly)
+        feature_tables = ("user_features_2", "up_features", "prd_features")
+        if any(name not in unchanged for name in feature_tables):
+            features = self.process_features(order_products_prior)
+        else:
+            features = dict.fromkeys(feature_tables)
+
+        logger.info("Writing transformed tables to Iceberg format in silver database...")
+
+        # The feature tables wait for order_products_prior to fill its cache. With the fused
+        # engine up_features fills the pair partials cache the other two roll up from.
+        pairs_dependency = ["up_features"] if self.feature_engine == "fused" else []
+        steps = [
+            (name, df, dependencies)
+            for name, df, dependencies in [
+                ("products", products_df, []),
+                ("aisles", aisles_df, []),
+                ("departments", departments_df, []),
+                ("orders", orders_df, []),
+                ("order_products__prior", order_products__prior_df2, []),
+                ("order_products__train", order_products__train_df2, []),
+                ("order_products", order_products, []),
+                ("order_products_prior", order_products_prior, []),
+                ("user_features_1", user_features_1, []),
+                ("user_features_2", features["user_features_2"], ["order_products_prior"] + pairs_dependency),
+                ("up_features", features["up_features"], ["order_products_prior"]),
+                ("prd_features", features["prd_features"], ["order_products_prior"] + pairs_dependency),
+            ]
+            if name not in unchanged
+        ]
+        def properties(name):
+            # A write keeps the old properties: base tables always get the watermark of this
+            # load, so the next incremental run starts after the CDC files it already applied
+            if name in PRIMARY_KEYS:
+                return {FINGERPRINT_PROPERTY: fingerprints[name], WATERMARK_PROPERTY: self.cdc_watermark(name)}
+            return {FINGERPRINT_PROPERTY: fingerprints[name]}
+
+        written = {name for name, _, _ in steps}
+        self.run_steps(logger, [
+            (name,
+             lambda df=df, name=name: self.write_table(df, name, properties(name)),
+             [dependency for dependency in dependencies if dependency in written])
+            for name, df, dependencies in steps
+        ])
+
+        if written & {"user_features_1", "user_features_2", "up_features", "prd_features"}:
+            self.drop_feature_state()
+
+        print("🔥 Fingerprint report (hit = unchanged, skipped):")
+        for name in TABLE_INPUTS:
+            print(f"  {name:<24} {'hit' if name in unchanged else 'miss'}  {fingerprints[name][:12]}")
+        logger.info(f"Skipped {len(unchanged)} unchanged tables, wrote {len(written)}")
+
+    def run_incremental(self, logger) -> None:
+        missing = [name for name in PRIMARY_KEYS if not self.table_exists(name)]
+        if missing:
+            logger.info(f"Silver tables {missing} do not exist yet, running a full load first.")
+            self.run_full(logger)
+            return
+
+        if self.planner == "auto":
+            # CDC batches are small next to the silver tables they are joined with: keep the
+            # partition count and let AQE coalesce partitions and broadcast at runtime
+            self.configure_adaptive(int(self.spark.conf.get("spark.sql.shuffle.partitions")), self.broadcast_limit())
+
+        # Collect the CDC batch of each base table
+        batches = {}
+        for name in PRIMARY_KEYS:
+            watermark = self.get_table_properties(name).get(WATERMARK_PROPERTY, "")
+            files = self.list_cdc_files(name, watermark)
+            logger.info(f"{name}: {len(files)} CDC files after watermark '{watermark}'")
+            if files:
+                batches[name] = files
+
+        if not batches:
+            logger.info("No new CDC files, nothing to merge.")
+            return
+
+        changes = {name: self.read_changes(name, files).cache() for name, files in batches.items()}
+        for name in ("order_products__prior", "order_products__train"):
+            if name in changes:
+                changes[name] = self.process_order_products__eval(changes[name])
+
+        order_product_changes = [changes[name] for name in ("order_products__prior", "order_products__train") if name in changes]
+        order_products_changes = None
+        if order_product_changes:
+            order_products_changes = order_product_changes[0]
+            for df in order_product_changes[1:]:
+                order_products_changes = order_products_changes.unionByName(df)
+
+        # Orders touched by the batch, and the "dirty" ones among them: anything but an insert of a
+        # new key. Only clean orders can be folded into the feature state, dirty ones are recomputed.
+        # Replays of a half-applied batch see their inserts as existing keys, so they are recomputed too.
+        touched, dirty = [], []
+        if "orders" in changes:
+            orders_changes = changes["orders"].join(
+                self.read_silver_table("orders").select("order_id", F.lit(True).alias("_existing")),
+                on="order_id", how="left")
+            touched.append(orders_changes.select("order_id"))
+            dirty.append(orders_changes.filter((col(DMS_OP_COLUMN) != "I") | col("_existing").isNotNull()).select("order_id"))
+        if order_products_changes is not None:
+            order_products_changes_flagged = order_products_changes.join(
+                self.read_silver_table("order_products").select("order_id", "product_id", F.lit(True).alias("_existing")),
+                on=["order_id", "product_id"], how="left")
+            touched.append(order_products_changes.select("order_id"))
+            dirty.append(order_products_changes_flagged.filter((col(DMS_OP_COLUMN) != "I") | col("_existing").isNotNull()).select("order_id"))
+
+        with self.stage("read_changes"):
+            touched_ids = {row["order_id"] for df in touched for row in df.distinct().collect()}
+            dirty_ids = {row["order_id"] for df in dirty for row in df.distinct().collect()}
+        snapshots = {name: self.current_snapshot_id(name) for name in ("orders", "order_products_prior")}
+        logger.info(f"Batch touches {len(touched_ids)} orders, {len(dirty_ids)} of them with updates or deletes")
+
+        # Base tables and order_products (the union of prior and train, so it takes the same
+        # changes) are independent merges
+        merges = [
+            (name, lambda df=df, name=name: self.merge_table(df, name, PRIMARY_KEYS[name]), [])
+            for name, df in changes.items()
+        ]
+        if order_products_changes is not None:
+            merges.append(("order_products", lambda: self.merge_table(order_products_changes, "order_products", ["order_id", "product_id"]), []))
+        self.run_steps(logger, merges)
+
+        # order_products_prior: rebuild the rows of every order touched by the batch
+        order_ids = sorted(touched_ids)
+        if order_ids:
+            logger.info(f"Rebuilding {len(order_ids)} orders in table: order_products_prior")
+            orders_df = self.read_silver_table("orders").filter(col("order_id").isin(order_ids))
+            order_products = self.read_silver_table("order_products").filter(col("order_id").isin(order_ids))
+            with self.stage("order_products_prior"):
+                self.replace_orders(self.process_order_products_prior(orders_df, order_products), "order_products_prior", order_ids)
+
+        with self.stage("update_features"):
+            self.update_features(logger, touched_ids, dirty_ids, snapshots)
+
+        # Watermarks move only once every dependent table is updated. A failed run replays
+        # the same batch, which is safe because the changes are last-op-wins per key.
+        for name, files in batches.items():
+            self.set_table_properties(name, {WATERMARK_PROPERTY: files[-1][0]})
+
+    def rebuild_features(self, logger) -> None:
+        """Recompute the feature state and feature tables from the silver history"""
+        orders_df = self.read_silver_table("orders")
+        order_products_prior = self.read_silver_table("order_products_prior").cache()
+        if self.feature_engine == "fused":
+            pairs = self.process_pair_partials(order_products_prior).cache()
+            states = {
+                "user_features_1": self.process_user_features_1_state(orders_df),
+                "user_features_2": self.user_features_2_state_from_pairs(pairs),
+                "up_features": self.up_features_state_from_pairs(pairs),
+            }
+            prd_features = self.prd_features_from_pairs(pairs)
+        else:
+            states = {
+                "user_features_1": self.process_user_features_1_state(orders_df),
+                "user_features_2": self.process_user_features_2_state(order_products_prior),
+                "up_features": self.process_up_features_state(order_products_prior),
+            }
+            prd_features = self.process_prd_features(order_products_prior)
+        for name, state in states.items():
+            state_table, _ = FEATURE_STATE_TABLES[name]
+            logger.info(f"Writing table: {state_table}")
+            self.write_table(state, state_table)
+
+        for name, df in [
+            ("user_features_1", self.user_features_1_from_state(self.read_silver_table("user_features_1_state"))),
+            ("user_features_2", self.user_features_2_from_state(self.read_silver_table("user_features_2_state"))),
+            ("up_features", self.up_features_from_state(self.read_silver_table("up_features_state"))),
+            ("prd_features", prd_features),
+        ]:
+            logger.info(f"Writing table: {name}")
+            self.write_table(df, name)
+
+    def drop_feature_state(self) -> None:
+        # A full rewrite of the feature tables leaves the partial state stale
+        for state_table, _ in FEATURE_STATE_TABLES.values():
+            self.spark.sql(f"DROP TABLE IF EXISTS {self.silver_table(state_table)}")
+
+    def upsert_keys(self, logger, df: DataFrame, keys_df: DataFrame, table_name: str, keys: list) -> None:
+        """MERGE recomputed/folded rows for a set of keys; keys without a row are deleted"""
+        source = keys_df.distinct().join(df.withColumn(DMS_OP_COLUMN, F.lit("U")), on=keys, how="left") \
+            .withColumn(DMS_OP_COLUMN, F.coalesce(col(DMS_OP_COLUMN), F.lit("D")))
+        logger.info(f"Merging feature delta into table: {table_name}")
+        self.merge_table(source, table_name, keys)
+
+    def update_features(self, logger, touched_ids: set, dirty_ids: set, snapshots: dict) -> None:
+        """Update the feature tables for the keys affected by a CDC batch.
+
+        Keys reached by a dirty order (update, delete, replayed insert) are recomputed from the silver
+        history. All other keys fold the new order lines into their stored partial state
+        (counts, sums, min/max, mean as sum + count).
+        """
+        if not all(self.table_exists(state_table) for state_table, _ in FEATURE_STATE_TABLES.values()):
+            logger.info("Feature state does not exist yet, recomputing the feature tables.")
+            self.rebuild_features(logger)
+            return
+        if not touched_ids:
+            return
+
+        dirty = sorted(dirty_ids)
+        clean = sorted(touched_ids - dirty_ids)
+        history = self.read_silver_table("order_products_prior")
+        orders_before = self.read_silver_snapshot("orders", snapshots["orders"])
+        prior_before = self.read_silver_snapshot("order_products_prior", snapshots["order_products_prior"])
+        orders_after = self.read_silver_table("orders")
+
+        # Keys to recompute: everything the dirty orders reached before or after the merge
+        dirty_rows = prior_before.filter(col("order_id").isin(dirty)).select("user_id", "product_id") \
+            .unionByName(history.filter(col("order_id").isin(dirty)).select("user_id", "product_id"))
+        recompute_users = orders_before.filter(col("order_id").isin(dirty)).select("user_id") \
+            .unionByName(orders_after.filter(col("order_id").isin(dirty)).select("user_id")) \
+            .unionByName(dirty_rows.select("user_id")).distinct().cache()
+        recompute_pairs = dirty_rows.distinct().cache()
+        recompute_products = dirty_rows.select("product_id").distinct().cache()
+
+        # New rows of the clean orders (orders and order lines that did not exist before)
+        new_orders = orders_after.filter(col("order_id").isin(clean)) \
+            .join(orders_before.filter(col("order_id").isin(clean)), on="order_id", how="left_anti")
+        new_rows = history.filter(col("order_id").isin(clean)) \
+            .join(prior_before.filter(col("order_id").isin(clean)), on=["order_id", "product_id"], how="left_anti") \
+            .cache()
+
+        # State pinned to its snapshot before this run's writes, so the folds never see their own output
+        old = {}
+        for name in ("user_features_1", "user_features_2", "up_features"):
+            state_table, _ = FEATURE_STATE_TABLES[name]
+            old[name] = self.read_silver_snapshot(state_table, self.current_snapshot_id(state_table))
+        old_up = old["up_features"]
+        old_prd = self.read_silver_snapshot("prd_features", self.current_snapshot_id("prd_features"))
+
+        # up_features
+        pair_rows = new_rows.join(recompute_pairs, on=["user_id", "product_id"], how="left_anti")
+        delta_up = self.process_up_features_state(pair_rows)
+        up_state = self.fold_up_features_state(old_up, delta_up) \
+            .unionByName(self.process_up_features_state(history.join(recompute_pairs, on=["user_id", "product_id"], how="left_semi")))
+        up_keys = delta_up.select("user_id", "product_id").unionByName(recompute_pairs)
+
+        # user_features_2
+        user_rows = new_rows.join(recompute_users, on="user_id", how="left_anti")
+        delta_user_2 = self.delta_user_features_2_state(
+            user_rows, self.process_up_features_state(user_rows), old_up)
+        user_state_2 = self.fold_user_features_2_state(old["user_features_2"], delta_user_2) \
+            .unionByName(self.process_user_features_2_state(history.join(recompute_users, on="user_id", how="left_semi")))
+        user_2_keys = delta_user_2.select("user_id").unionByName(recompute_users)
+
+        # user_features_1 (over all orders, not only prior ones)
+        delta_user_1 = self.process_user_features_1_state(new_orders.join(recompute_users, on="user_id", how="left_anti"))
+        user_state_1 = self.fold_user_features_1_state(old["user_features_1"], delta_user_1) \
+            .unionByName(self.process_user_features_1_state(orders_after.join(recompute_users, on="user_id", how="left_semi")))
+        user_1_keys = delta_user_1.select("user_id").unionByName(recompute_users)
+
+        # prd_features
+        product_rows = new_rows.join(recompute_products, on="product_id", how="left_anti")
+        delta_prd = self.delta_prd_features(product_rows, self.process_up_features_state(product_rows), old_up)
+        prd = self.fold_prd_features(old_prd, delta_prd) \
+            .unionByName(self.process_prd_features(history.join(recompute_products, on="product_id", how="left_semi")))
+        prd_keys = delta_prd.select("product_id").unionByName(recompute_products)
+
+        # Each state feeds two merges (state table and feature table)
+        up_state, user_state_2, user_state_1 = [df.cache() for df in (up_state, user_state_2, user_state_1)]
+        for name, state, keys_df in [
+            ("up_features", up_state, up_keys),
+            ("user_features_2", user_state_2, user_2_keys),
+            ("user_features_1", user_state_1, user_1_keys),
+        ]:
+            state_table, keys = FEATURE_STATE_TABLES[name]
+            from_state = getattr(self, f"{name}_from_state")
+            self.upsert_keys(logger, state, keys_df, state_table, keys)
+            self.upsert_keys(logger, from_state(state), keys_df, name, keys)
+        self.upsert_keys(logger, prd, prd_keys, "prd_features", ["product_id"])
 
     def run(self):
         logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
         logger = logging.getLogger(__name__)
+        started, status = time.time(), "failed"
 
         try:
-            logger.info(f"Reading tables from Glue Catalog database: {self.raw_database}")
+            if self.raw_reader == "catalog":
+                logger.info(f"Reading tables from Glue Catalog database: {self.raw_database}")
+            else:
+                logger.info(f"Reading raw Parquet files from: {self.raw_path}")
             logger.info(f"Writing tables to Glue Catalog database: {self.silver_database}")
-            
-            # Read all raw tables
-            print("🔥 Starting to read first table...")
-            order_products__train_df = self.read_table("order_products__train")
-            order_products__prior_df = self.read_table("order_products__prior")
-            orders_df = self.read_table("orders")
-            products_df = self.read_table("products")
-            departments_df = self.read_table("departments")
-            aisles_df = self.read_table("aisles")
-            logger.info("Successfully loaded all raw tables.")
-            
-            # Process data
-            order_products__train_df2 = self.process_order_products__eval(order_products__train_df)
-            order_products__prior_df2 = self.process_order_products__eval(order_products__prior_df)
-            order_products = self.process_order_products(order_products__prior_df2, order_products__train_df2)
-            order_products_prior = self.process_order_products_prior(orders_df, order_products).cache()
-
-            user_features_1 = self.process_user_features_1(orders_df)
-            user_features_2 = self.process_user_features_2(order_products_prior)
-            up_features = self.process_up_features(order_products_prior)
-            prd_features = self.process_prd_features(order_products_prior)
+            logger.info(f"Write mode: {self.write_mode}, feature engine: {self.feature_engine}")
 
-            logger.info("Writing transformed tables to Iceberg format in silver database...")
-            
-            # Write other tables
-            for name, df in [
-                ("products", products_df),
-                ("aisles", aisles_df),
-                ("departments", departments_df),
-                ("orders", orders_df),
-                ("order_products__prior", order_products__prior_df2),
-                ("order_products__train", order_products__train_df2),
-                ("order_products", order_products),
-                ("order_products_prior", order_products_prior),
-                ("user_features_1", user_features_1),
-                ("user_features_2", user_features_2),
-                ("up_features", up_features),
-                ("prd_features", prd_features),
-            ]:
-                logger.info(f"Writing table: {name}")
-                print(f"🔥 Writing {name} to Iceberg format in silver database...")
-                self.write_table(df, name)
+            if self.write_mode == "incremental":
+                self.run_incremental(logger)
+            else:
+                self.run_full(logger)
 
+            status = "succeeded"
             logger.info("✅ All processing completed successfully.")
             logger.info(f"✅ All tables written to {self.silver_database} database in Iceberg format")
 
@@ -185,6 +1761,7 @@ class DataProcessor:
             raise
 
         finally:
+            self.write_run_report(logger, status, started)
             logger.info("Stopping Spark session.")
             self.spark.stop()
 
@@ -0,0 +1,275 @@
+"""Memory-mapped feature lookup store for model scoring.
+
+Each feature table is one file, <table>.imf. The file holds the rows sorted by key, one
+contiguous little-endian array per column, so it can be memory-mapped and read without parsing:
+
+    magic (8 bytes) | header length (uint64) | JSON header | 64-byte aligned arrays
+
+- key: int64 per row, sorted and unique. It encodes user_id or product_id as is, and
+  (user_id, product_id) as user_id << 32 | product_id. The key array is the index: a lookup is a
+  binary search over it.
+- one array per feature column with its Spark type (int32, int64, float64, ...), plus a uint8
+  validity array for the columns that contain nulls.
+
+FeatureTable.find / get look up one key with bisect over a memoryview of the mmapped keys, so
+they allocate no arrays. find_batch / gather look up many keys with np.searchsorted and gather
+the columns with np.take into caller-provided buffers. Only the pages that lookups touch become
+resident.
+
+Only NumPy is needed, so scorers can use this module without Spark. The export job
+(feature_store_export.py) writes the files with FeatureStoreWriter.
+"""
+import bisect
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+
+import numpy as np
+
+MAGIC = b"IMBAFS01"
+ALIGNMENT = 64
+SUFFIX = ".imf"
+# Spark SQL type names -> array dtypes
+SPARK_DTYPES = {
+    "tinyint": "<i1",
+    "smallint": "<i2",
+    "int": "<i4",
+    "bigint": "<i8",
+    "float": "<f4",
+    "double": "<f8",
+    "boolean": "|u1",
+}
+KEY_DTYPE = np.dtype("<i8")
+
+
+def encode_keys(*parts) -> np.ndarray:
+    """int64 keys from one or two arrays of non-negative int32 key columns"""
+    if len(parts) == 1:
+        return np.asarray(parts[0], dtype=KEY_DTYPE)
+    if len(parts) == 2:
+        return (np.asarray(parts[0], dtype=KEY_DTYPE) << 32) | np.asarray(parts[1], dtype=KEY_DTYPE)
+    raise ValueError(f"Keys of one or two columns are supported, got {len(parts)}")
+
+
+def encode_key(*parts) -> int:
+    """Python int key, like encode_keys for a single lookup"""
+    return parts[0] if len(parts) == 1 else (parts[0] << 32) | parts[1]
+
+
+def encode_rows(rows, key_columns: list, dtypes: dict) -> dict:
+    """Arrays of one chunk of (already sorted) rows, as bytes: {"rows", "key", "values", "valid"}.
+
+    Runs on the executors, so the driver receives compact buffers instead of Row objects.
+    """
+    keys = [[] for _ in key_columns]
+    values = {name: [] for name in dtypes}
+    valid = {name: [] for name in dtypes}
+    for row in rows:
+        for i, name in enumerate(key_columns):
+            keys[i].append(row[name])
+        for name in dtypes:
+            value = row[name]
+            valid[name].append(value is not None)
+            values[name].append(0 if value is None else value)
+    encoded = {"rows": len(keys[0]), "key": encode_keys(*keys).tobytes(), "values": {}, "valid": {}}
+    for name, dtype in dtypes.items():
+        array = np.asarray(values[name], dtype=dtype)
+        mask = np.asarray(valid[name], dtype=bool)
+        if not mask.all() and array.dtype.kind == "f":
+            array[~mask] = np.nan
+        encoded["values"][name] = array.tobytes()
+        encoded["valid"][name] = None if mask.all() else mask.astype(np.uint8).tobytes()
+    return encoded
+
+
+def _aligned(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class FeatureStoreWriter:
+    """Write a feature table file from chunks appended in key order"""
+
+    def __init__(self, path: str, table: str, key_columns: list, dtypes: dict):
+        self.path = path
+        self.table = table
+        self.key_columns = list(key_columns)
+        self.dtypes = dict(dtypes)
+        self.rows = 0
+        self.last_key = None
+        self.has_nulls = dict.fromkeys(self.dtypes, False)
+        # Columns are spooled to one file each until the row count (and so the layout) is known
+        self.spool = tempfile.mkdtemp(prefix=f"{table}-", dir=os.path.dirname(os.path.abspath(path)))
+        self.files = {"key": open(os.path.join(self.spool, "key"), "wb")}
+        for name in self.dtypes:
+            self.files[name] = open(os.path.join(self.spool, name), "wb")
+            self.files[f"{name}.valid"] = open(os.path.join(self.spool, f"{name}.valid"), "wb")
+
+    def append_encoded(self, chunk: dict) -> None:
+        """Append a chunk from encode_rows"""
+        rows = chunk["rows"]
+        if not rows:
+            return
+        keys = np.frombuffer(chunk["key"], dtype=KEY_DTYPE)
+        if np.any(keys[1:] <= keys[:-1]) or (self.last_key is not None and keys[0] <= self.last_key):
+            raise ValueError(f"Keys of {self.table} are not sorted and unique")
+        self.last_key = int(keys[-1])
+        self.files["key"].write(chunk["key"])
+        for name in self.dtypes:
+            self.files[name].write(chunk["values"][name])
+            valid = chunk["valid"][name]
+            if valid is not None:
+                self.has_nulls[name] = True
+            self.files[f"{name}.valid"].write(valid if valid is not None else b"\x01" * rows)
+        self.rows += rows
+
+    def close(self) -> dict:
+        """Assemble the file: header, then the key, value and validity arrays; returns the header"""
+        for f in self.files.values():
+            f.close()
+        try:
+            arrays = [("key", "key", KEY_DTYPE.str)]
+            for name, dtype in self.dtypes.items():
+                arrays.append((name, name, dtype))
+                if self.has_nulls[name]:
+                    arrays.append((f"{name}.valid", f"{name}.valid", "|u1"))
+
+            header = {"table": self.table, "key_columns": self.key_columns, "rows": self.rows, "arrays": {}}
+            # Offsets depend on the header length, which depends on the offsets: lay out twice
+            for _ in range(2):
+                offset = _aligned(len(MAGIC) + 8 + len(json.dumps(header).encode()) + 256)
+                for name, _, dtype in arrays:
+                    header["arrays"][name] = {"dtype": dtype, "offset": offset}
+                    offset = _aligned(offset + self.rows * np.dtype(dtype).itemsize)
+            encoded = json.dumps(header).encode()
+
+            with open(self.path, "wb") as out:
+                out.write(MAGIC)
+                out.write(struct.pack("<Q", len(encoded)))
+                out.write(encoded)
+                for name, spool_name, _ in arrays:
+                    out.seek(header["arrays"][name]["offset"])
+                    with open(os.path.join(self.spool, spool_name), "rb") as f:
+                        shutil.copyfileobj(f, out, 16 * 1024 * 1024)
+                out.truncate(_aligned(out.tell()))
+        finally:
+            shutil.rmtree(self.spool, ignore_errors=True)
+        return header
+
+
+class FeatureTable:
+    """Read-only, memory-mapped feature table"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a feature store file")
+        (length,) = struct.unpack_from("<Q", self._mmap, len(MAGIC))
+        self.header = json.loads(self._mmap[len(MAGIC) + 8:len(MAGIC) + 8 + length])
+        self.table = self.header["table"]
+        self.key_columns = self.header["key_columns"]
+        self.rows = self.header["rows"]
+
+        def array(name):
+            spec = self.header["arrays"][name]
+            return np.frombuffer(self._mmap, dtype=spec["dtype"], count=self.rows, offset=spec["offset"])
+
+        self.keys = array("key")
+        self.columns = [name for name in self.header["arrays"] if name != "key" and not name.endswith(".valid")]
+        self.values = {name: array(name) for name in self.columns}
+        self.valid = {name: array(f"{name}.valid") for name in self.columns if f"{name}.valid" in self.header["arrays"]}
+        # memoryviews give single lookups Python scalars without NumPy scalar objects
+        key_offset = self.header["arrays"]["key"]["offset"]
+        self._key_view = memoryview(self._mmap)[key_offset:key_offset + self.rows * KEY_DTYPE.itemsize].cast("q")
+
+    def find(self, *key) -> int:
+        """Row of a key, or -1"""
+        value = encode_key(*key)
+        row = bisect.bisect_left(self._key_view, value)
+        return row if row < self.rows and self._key_view[row] == value else -1
+
+    def get(self, column: str, *key):
+        """One feature of one key; None when the key is missing or the value is null"""
+        row = self.find(*key)
+        if row < 0 or (column in self.valid and not self.valid[column][row]):
+            return None
+        return self.values[column][row].item()
+
+    def row(self, *key):
+        """All features of one key as a dict, or None"""
+        row = self.find(*key)
+        if row < 0:
+            return None
+        return {
+            name: None if name in self.valid and not self.valid[name][row] else self.values[name][row].item()
+            for name in self.columns
+        }
+
+    def find_batch(self, keys: np.ndarray) -> np.ndarray:
+        """Rows of encoded keys (see encode_keys), -1 where missing"""
+        rows = np.searchsorted(self.keys, keys)
+        if not self.rows:
+            rows.fill(-1)
+            return rows
+        np.minimum(rows, self.rows - 1, out=rows)
+        rows[self.keys[rows] != keys] = -1
+        return rows
+
+    def gather(self, rows: np.ndarray, columns: list = None, out: dict = None) -> dict:
+        """Feature arrays for rows from find_batch, into out[column] buffers when given.
+
+        Missing rows and nulls come back as NaN in float columns and 0 in the others; the
+        "_found" entry marks the rows that exist.
+        """
+        columns = columns or self.columns
+        out = {} if out is None else out
+        missing = rows < 0
+        safe = np.where(missing, 0, rows)
+        for name in columns:
+            target = out.get(name)
+            if not self.rows:
+                gathered = np.empty(len(rows), dtype=self.values[name].dtype) if target is None else target
+                gathered.fill(np.nan if gathered.dtype.kind == "f" else 0)
+                out[name] = gathered
+                continue
+            gathered = np.take(self.values[name], safe, out=target)
+            empty = missing | (self.valid[name][safe] == 0) if name in self.valid else missing
+            if empty.any():
+                gathered[empty] = np.nan if gathered.dtype.kind == "f" else 0
+            out[name] = gathered
+        out["_found"] = ~missing
+        return out
+
+    def key_range(self, user_id: int) -> slice:
+        """Rows of every (user_id, product_id) key of a user in a two-column key table"""
+        if len(self.key_columns) != 2:
+            raise ValueError(f"{self.table} is keyed by {self.key_columns[0]} only")
+        start = bisect.bisect_left(self._key_view, user_id << 32)
+        end = bisect.bisect_left(self._key_view, (user_id + 1) << 32)
+        return slice(start, end)
+
+    def close(self) -> None:
+        self._key_view.release()
+        self.keys = self.values = self.valid = None
+        self._mmap.close()
+
+
+class FeatureStore:
+    """The feature tables of an exported directory, by table name"""
+
+    def __init__(self, directory: str):
+        self.tables = {
+            name[:-len(SUFFIX)]: FeatureTable(os.path.join(directory, name))
+            for name in sorted(os.listdir(directory)) if name.endswith(SUFFIX)
+        }
+
+    def __getitem__(self, table: str) -> FeatureTable:
+        return self.tables[table]
+
+    def close(self) -> None:
+        for table in self.tables.values():
+            table.close()
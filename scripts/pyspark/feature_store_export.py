@@ -0,0 +1,147 @@
+from bronze_to_silver import DataProcessor
+from feature_store import FeatureStoreWriter, SPARK_DTYPES, SUFFIX, encode_rows
+from datetime import datetime
+import json
+import logging
+import math
+import os
+import shutil
+import tempfile
+import traceback
+
+from pyspark.sql import functions as F
+
+# Feature tables served to the scorers and their lookup keys, in key order
+FEATURE_STORE_TABLES = {
+    "user_features_1": ["user_id"],
+    "user_features_2": ["user_id"],
+    "up_features": ["user_id", "product_id"],
+    "prd_features": ["product_id"],
+}
+# Rows encoded per range partition, and so per chunk held by the driver at a time
+ROWS_PER_CHUNK = 1_000_000
+MANIFEST = "manifest.json"
+
+
+class FeatureStoreExport:
+    """Export the silver feature tables to memory-mapped lookup files (feature_store.py) for model scoring"""
+
+    def __init__(self, processor: DataProcessor):
+        self.processor = processor
+        self.spark = processor.spark
+        self.now = datetime.utcnow()
+
+        # Job options are passed with spark-submit --conf spark.imba.featureStore.<option>=...
+        # - path: export location; each export goes to <path>/<version>/ and <path>/manifest.json
+        #   points to the latest one, so scorers never see a half-written export
+        # - tables: comma separated tables to export (default: every table of FEATURE_STORE_TABLES)
+        self.path = (
+            self.spark.conf.get("spark.imba.featureStore.path", "") or f"s3://{processor.data_bucket}/feature-store"
+        ).rstrip("/")
+        tables = self.spark.conf.get("spark.imba.featureStore.tables", "")
+        self.tables = [t.strip() for t in tables.split(",") if t.strip()] or list(FEATURE_STORE_TABLES)
+        unknown = [t for t in self.tables if t not in FEATURE_STORE_TABLES]
+        if unknown:
+            raise ValueError(f"No lookup keys for spark.imba.featureStore.tables: {', '.join(unknown)}")
+        self.version = f"{self.now:%Y%m%dT%H%M%SZ}"
+
+    def column_dtypes(self, df, key_columns: list) -> dict:
+        dtypes = {}
+        for field in df.schema.fields:
+            if field.name in key_columns:
+                continue
+            spark_type = field.dataType.simpleString()
+            if spark_type not in SPARK_DTYPES:
+                raise ValueError(f"{field.name} has type {spark_type}, the feature store supports {', '.join(SPARK_DTYPES)}")
+            dtypes[field.name] = SPARK_DTYPES[spark_type]
+        return dtypes
+
+    def export_table(self, logger, table_name: str, local_dir: str) -> dict:
+        key_columns = FEATURE_STORE_TABLES[table_name]
+        snapshot_id = self.processor.current_snapshot_id(table_name)
+        df = self.processor.read_silver_snapshot(table_name, snapshot_id) \
+            .filter(" AND ".join(f"{key} IS NOT NULL" for key in key_columns))
+        dtypes = self.column_dtypes(df, key_columns)
+        rows = df.count()
+        partitions = max(1, math.ceil(rows / ROWS_PER_CHUNK))
+        logger.info(f"{table_name}: {rows} rows in {partitions} chunks, keyed by {', '.join(key_columns)}")
+
+        # Range partitions come back in key order, so the driver appends chunks without sorting;
+        # executors encode each chunk to column buffers and only one chunk is on the driver at a time
+        chunks = df.select(*key_columns, *dtypes) \
+            .repartitionByRange(partitions, *[F.col(key) for key in key_columns]) \
+            .sortWithinPartitions(*key_columns) \
+            .rdd \
+            .mapPartitions(lambda part: [encode_rows(part, key_columns, dtypes)]) \
+            .toLocalIterator()
+
+        path = os.path.join(local_dir, f"{table_name}{SUFFIX}")
+        writer = FeatureStoreWriter(path, table_name, key_columns, dtypes)
+        for chunk in chunks:
+            writer.append_encoded(chunk)
+        header = writer.close()
+        if header["rows"] != rows:
+            raise ValueError(f"{table_name}: exported {header['rows']} rows, the snapshot has {rows}")
+
+        self.copy_to_store(path, f"{self.path}/{self.version}/{table_name}{SUFFIX}")
+        report = {
+            "rows": rows,
+            "bytes": os.path.getsize(path),
+            "key_columns": key_columns,
+            "columns": list(dtypes),
+            "snapshot_id": snapshot_id,
+        }
+        os.remove(path)
+        logger.info(f"{table_name}: {report['bytes']} bytes from snapshot {snapshot_id}")
+        return report
+
+    def copy_to_store(self, local_path: str, target: str) -> None:
+        jvm = self.spark._jvm
+        target_path = jvm.org.apache.hadoop.fs.Path(target)
+        fs = target_path.getFileSystem(self.spark._jsc.hadoopConfiguration())
+        fs.copyFromLocalFile(False, True, jvm.org.apache.hadoop.fs.Path(f"file://{os.path.abspath(local_path)}"), target_path)
+
+    def write_manifest(self, tables: dict, local_dir: str) -> None:
+        manifest = {"version": self.version, "exported_at": self.now.isoformat() + "Z", "tables": tables}
+        path = os.path.join(local_dir, MANIFEST)
+        with open(path, "w") as f:
+            json.dump(manifest, f, indent=2, default=str)
+        # Kept with the export, then published: the manifest at the root switches scorers to it
+        self.copy_to_store(path, f"{self.path}/{self.version}/{MANIFEST}")
+        self.copy_to_store(path, f"{self.path}/{MANIFEST}")
+
+    def run(self):
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+        logger = logging.getLogger(__name__)
+        local_dir = tempfile.mkdtemp(prefix="imba-feature-store-")
+
+        try:
+            logger.info(f"Exporting {self.tables} to {self.path}/{self.version}")
+            reports = {}
+            for table_name in self.tables:
+                if not self.processor.table_exists(table_name):
+                    raise ValueError(f"{table_name} does not exist in {self.processor.silver_database}")
+                with self.processor.stage(f"feature_store_{table_name}"):
+                    reports[table_name] = self.export_table(logger, table_name, local_dir)
+            self.write_manifest(reports, local_dir)
+
+            print("🔥 Feature store export:")
+            print(json.dumps(reports, indent=2, default=str))
+            logger.info(f"✅ Feature store {self.version} published to {self.path}/{MANIFEST}")
+            return reports
+
+        except Exception as e:
+            logger.error("❌ An error occurred during the feature store export.")
+            logger.error(str(e))
+            logger.debug(traceback.format_exc())
+            raise
+
+        finally:
+            shutil.rmtree(local_dir, ignore_errors=True)
+            logger.info("Stopping Spark session.")
+            self.spark.stop()
+
+
+if __name__ == "__main__":
+    export = FeatureStoreExport(DataProcessor())
+    export.run()
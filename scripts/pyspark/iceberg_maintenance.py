@@ -0,0 +1,170 @@
+from bronze_to_silver import DataProcessor, TABLE_INPUTS, TABLE_LAYOUTS, FEATURE_STATE_TABLES, DEFAULT_TARGET_FILE_SIZE
+from datetime import datetime, timedelta
+import json
+import logging
+import traceback
+
+# Maintenance policy of every silver table, overridden per table in TABLE_POLICIES
+# - min_files / small_file_ratio: compact only when the table has at least min_files data files
+#   and the share of files below small_file_fraction of the target file size reaches small_file_ratio
+# - strategy: "sort" rewrites by the sort order recorded on the table (binpack when it has none),
+#   "binpack" only merges files
+# - snapshot_retention_days / retain_last: expire_snapshots older_than and retain_last
+# - orphan_retention_days: remove_orphan_files older_than, longer than any write can take
+DEFAULT_POLICY = {
+    "min_files": 10,
+    "small_file_ratio": 0.3,
+    "small_file_fraction": 0.75,
+    "strategy": "binpack",
+    "snapshot_retention_days": 7,
+    "retain_last": 5,
+    "orphan_retention_days": 3,
+}
+TABLE_POLICIES = {
+    "products": {"min_files": 4, "snapshot_retention_days": 30},
+    "aisles": {"min_files": 4, "snapshot_retention_days": 30},
+    "departments": {"min_files": 4, "snapshot_retention_days": 30},
+    "orders": {"strategy": "sort"},
+    "order_products_prior": {"strategy": "sort", "min_files": 32, "snapshot_retention_days": 3, "retain_last": 3},
+    "order_products": {"min_files": 32, "snapshot_retention_days": 3, "retain_last": 3},
+    "up_features": {"strategy": "sort"},
+    "up_features_state": {"strategy": "binpack", "snapshot_retention_days": 3},
+}
+
+
+class TableMaintenance:
+    """Compaction, manifest rewrite, snapshot expiry and orphan cleanup of the silver Iceberg tables"""
+
+    def __init__(self, processor: DataProcessor):
+        self.processor = processor
+        self.spark = processor.spark
+        self.catalog = processor.catalog
+        self.now = datetime.utcnow()
+
+        # Job options are passed with spark-submit --conf spark.imba.maintenance.<option>=...
+        # - tables: comma separated tables to maintain (default: every silver and state table)
+        # - dryRun: only report what would be compacted and which orphan files would be removed
+        tables = self.spark.conf.get("spark.imba.maintenance.tables", "")
+        self.tables = [t.strip() for t in tables.split(",") if t.strip()] or \
+            list(TABLE_INPUTS) + [state_table for state_table, _ in FEATURE_STATE_TABLES.values()]
+        self.dry_run = self.spark.conf.get("spark.imba.maintenance.dryRun", "false").lower() == "true"
+
+    def policy(self, table_name: str) -> dict:
+        return {**DEFAULT_POLICY, **TABLE_POLICIES.get(table_name, {})}
+
+    def target_file_size(self, properties: dict, table_name: str) -> int:
+        return int(properties.get(
+            "write.target-file-size-bytes",
+            TABLE_LAYOUTS.get(table_name, {}).get("target_file_size", DEFAULT_TARGET_FILE_SIZE)
+        ))
+
+    def stats(self, table_name: str, small_file_bytes: int) -> dict:
+        table = self.processor.silver_table(table_name)
+        files = self.spark.sql(f"""
+            SELECT count(*) AS files,
+                   coalesce(sum(file_size_in_bytes), 0) AS bytes,
+                   count_if(file_size_in_bytes < {small_file_bytes}) AS small_files
+            FROM {table}.data_files
+        """).first()
+        return {
+            "files": files["files"],
+            "bytes": files["bytes"],
+            "small_files": files["small_files"],
+            "manifests": self.spark.sql(f"SELECT count(*) AS n FROM {table}.manifests").first()["n"],
+            "snapshots": self.spark.sql(f"SELECT count(*) AS n FROM {table}.snapshots").first()["n"],
+        }
+
+    def needs_compaction(self, stats: dict, policy: dict) -> bool:
+        if stats["files"] < policy["min_files"]:
+            return False
+        return stats["small_files"] / stats["files"] >= policy["small_file_ratio"]
+
+    def call(self, procedure: str, arguments: str):
+        return self.spark.sql(f"CALL {self.catalog}.system.{procedure}({arguments})").collect()
+
+    def maintain(self, logger, table_name: str) -> dict:
+        policy = self.policy(table_name)
+        identifier = f"'{self.processor.silver_database}.{table_name}'"
+        properties = self.processor.get_table_properties(table_name)
+        target = self.target_file_size(properties, table_name)
+        small_file_bytes = int(target * policy["small_file_fraction"])
+        before = self.stats(table_name, small_file_bytes)
+        report = {"policy": policy, "sort_order": properties.get("sort-order"), "before": before, "actions": {}}
+
+        # Sorting uses the table's own sort order (Iceberg reports it as the "sort-order" property);
+        # tables without one, e.g. written with tableLayouts=false, are bin-packed
+        strategy = policy["strategy"] if properties.get("sort-order") else "binpack"
+        if self.needs_compaction(before, policy):
+            logger.info(f"{table_name}: compacting {before['files']} files ({before['small_files']} small) with {strategy}")
+            if not self.dry_run:
+                rows = self.call("rewrite_data_files", f"""
+                    table => {identifier},
+                    strategy => '{strategy}',
+                    options => map('target-file-size-bytes', '{target}', 'min-input-files', '2')
+                """)
+                report["actions"]["rewrite_data_files"] = rows[0].asDict() if rows else {}
+            else:
+                report["actions"]["rewrite_data_files"] = "dry run"
+        else:
+            logger.info(f"{table_name}: {before['files']} files ({before['small_files']} small), below compaction thresholds")
+
+        if not self.dry_run:
+            rows = self.call("rewrite_manifests", f"table => {identifier}")
+            report["actions"]["rewrite_manifests"] = rows[0].asDict() if rows else {}
+
+            expire_before = self.now - timedelta(days=policy["snapshot_retention_days"])
+            rows = self.call("expire_snapshots", f"""
+                table => {identifier},
+                older_than => TIMESTAMP '{expire_before:%Y-%m-%d %H:%M:%S}',
+                retain_last => {policy['retain_last']}
+            """)
+            report["actions"]["expire_snapshots"] = rows[0].asDict() if rows else {}
+
+        orphans_before = self.now - timedelta(days=policy["orphan_retention_days"])
+        rows = self.call("remove_orphan_files", f"""
+            table => {identifier},
+            older_than => TIMESTAMP '{orphans_before:%Y-%m-%d %H:%M:%S}',
+            dry_run => {str(self.dry_run).lower()}
+        """)
+        report["actions"]["remove_orphan_files"] = len(rows)
+
+        report["after"] = self.stats(table_name, small_file_bytes)
+        logger.info(
+            f"{table_name}: files {before['files']} -> {report['after']['files']}, "
+            f"bytes {before['bytes']} -> {report['after']['bytes']}, "
+            f"snapshots {before['snapshots']} -> {report['after']['snapshots']}"
+        )
+        return report
+
+    def run(self):
+        logging.basicConfig(level=logging.INFO, format="%(asctime)s [%(levelname)s] %(message)s")
+        logger = logging.getLogger(__name__)
+
+        try:
+            logger.info(f"Maintaining tables in {self.catalog}.{self.processor.silver_database}: {self.tables}")
+            reports = {}
+            for table_name in self.tables:
+                if not self.processor.table_exists(table_name):
+                    logger.info(f"{table_name}: table does not exist, skipping")
+                    continue
+                reports[table_name] = self.maintain(logger, table_name)
+
+            print("🔥 Maintenance report:")
+            print(json.dumps(reports, indent=2, default=str))
+            logger.info("✅ Maintenance completed successfully.")
+            return reports
+
+        except Exception as e:
+            logger.error("❌ An error occurred during maintenance.")
+            logger.error(str(e))
+            logger.debug(traceback.format_exc())
+            raise
+
+        finally:
+            logger.info("Stopping Spark session.")
+            self.spark.stop()
+
+
+if __name__ == "__main__":
+    maintenance = TableMaintenance(DataProcessor())
+    maintenance.run()
@@ -0,0 +1,189 @@
+"""Warm cluster leasing (scripts/dags/emr_lease.py) against moto's EMR mock.
+
+    pip install pytest moto boto3
+    python -m pytest tests/test_emr_lease.py
+"""
+import copy
+import os
+import sys
+import time
+
+import pytest
+
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts", "dags"))
+import emr_lease  # noqa: E402
+
+OVERRIDES = {
+    "Name": "airflow-emr-cluster",
+    "ReleaseLabel": "emr-7.6.0",
+    "Applications": [{"Name": "Spark"}],
+    "Instances": {
+        "InstanceGroups": [
+            {"InstanceRole": "MASTER", "InstanceType": "m5.xlarge", "InstanceCount": 1},
+            {"InstanceRole": "CORE", "InstanceType": "m5.xlarge", "InstanceCount": 1},
+        ],
+        "Ec2SubnetId": "subnet-0e85153f57935e0cd",
+        "EmrManagedMasterSecurityGroup": "sg-033e5772afa0c3d12",
+        "EmrManagedSlaveSecurityGroup": "sg-0decf60199244d66a",
+        "ServiceAccessSecurityGroup": "sg-07e6dd4da3823202b",
+        "KeepJobFlowAliveWhenNoSteps": True,
+    },
+    "JobFlowRole": "emr_ec2_instance_profile",
+    "ServiceRole": "EMR_DefaultRole",
+    "VisibleToAllUsers": True,
+}
+
+
+class FakeTaskInstance:
+    def __init__(self):
+        self.xcom = {}
+
+    def xcom_push(self, key, value):
+        self.xcom[key] = value
+
+    def xcom_pull(self, task_ids, key):
+        return self.xcom.get(key)
+
+
+class FakeDag:
+    dag_id = "dms_to_emr_pipeline"
+
+
+class FakeDagRun:
+    def __init__(self, conf):
+        self.conf = conf
+
+
+def context(run_id, conf, ti=None):
+    return {"dag": FakeDag(), "run_id": run_id, "dag_run": FakeDagRun(conf), "ti": ti or FakeTaskInstance()}
+
+
+def state(emr, cluster_id):
+    return emr.describe_cluster(ClusterId=cluster_id)["Cluster"]["Status"]["State"]
+
+
+@pytest.fixture
+def emr(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "ap-southeast-2")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        client = boto3.client("emr")
+        # moto does not implement PutAutoTerminationPolicy: record the policies per cluster instead
+        client.auto_termination_policies = {}
+
+        def put_auto_termination_policy(ClusterId, AutoTerminationPolicy):
+            client.auto_termination_policies[ClusterId] = AutoTerminationPolicy
+            return {}
+
+        monkeypatch.setattr(client, "put_auto_termination_policy", put_auto_termination_policy, raising=False)
+        yield client
+
+
+@pytest.mark.parametrize("path, value", [
+    (("ServiceRole",), "EMR_OtherRole"),
+    (("JobFlowRole",), "other_instance_profile"),
+    (("Instances", "EmrManagedMasterSecurityGroup"), "sg-0000000000000000a"),
+    (("Instances", "EmrManagedSlaveSecurityGroup"), "sg-0000000000000000b"),
+    (("Instances", "ServiceAccessSecurityGroup"), "sg-0000000000000000c"),
+    (("Instances", "AdditionalSlaveSecurityGroups"), ["sg-0000000000000000d"]),
+    (("Instances", "Ec2SubnetId"), "subnet-00000000000000000"),
+])
+def test_config_hash_covers_roles_and_network(path, value):
+    changed = copy.deepcopy(OVERRIDES)
+    target = changed
+    for key in path[:-1]:
+        target = target[key]
+    target[path[-1]] = value
+    assert emr_lease.config_hash(changed) != emr_lease.config_hash(OVERRIDES)
+
+
+def test_config_hash_ignores_names_and_group_order():
+    renamed = copy.deepcopy(OVERRIDES)
+    renamed["Name"] = "another-name"
+    renamed["Instances"]["InstanceGroups"].reverse()
+    assert emr_lease.config_hash(renamed) == emr_lease.config_hash(OVERRIDES)
+
+
+def test_lease_creates_then_reuses_after_release(emr):
+    first, reused = emr_lease.lease_cluster(emr, OVERRIDES, "dag/run-1", settle_seconds=0)
+    assert not reused
+    tags = emr_lease.cluster_tags(emr, first)
+    assert tags[emr_lease.CONFIG_TAG] == emr_lease.config_hash(OVERRIDES)
+    assert emr_lease.lease_owner(tags) == "dag/run-1"
+
+    # Held by run-1, so run-2 gets a cluster of its own
+    second, reused = emr_lease.lease_cluster(emr, OVERRIDES, "dag/run-2", settle_seconds=0)
+    assert not reused and second != first
+
+    assert emr_lease.release(emr, first, "dag/run-1")
+    assert state(emr, first) == "WAITING"
+    third, reused = emr_lease.lease_cluster(emr, OVERRIDES, "dag/run-3", settle_seconds=0)
+    assert reused and third == first
+    assert emr_lease.lease_owner(emr_lease.cluster_tags(emr, first)) == "dag/run-3"
+
+
+def test_reused_cluster_gets_the_idle_timeout_of_the_run(emr):
+    cluster_id, _ = emr_lease.lease_cluster(emr, OVERRIDES, "dag/run-1", idle_timeout=600, settle_seconds=0)
+    assert emr.auto_termination_policies == {}
+    emr_lease.release(emr, cluster_id, "dag/run-1")
+
+    leased, reused = emr_lease.lease_cluster(emr, OVERRIDES, "dag/run-2", idle_timeout=3600, settle_seconds=0)
+    assert reused and leased == cluster_id
+    assert emr.auto_termination_policies == {cluster_id: {"IdleTimeout": 3600}}
+
+
+def test_clusters_of_another_config_are_not_reused(emr):
+    cluster_id, _ = emr_lease.lease_cluster(emr, OVERRIDES, "dag/run-1", settle_seconds=0)
+    emr_lease.release(emr, cluster_id, "dag/run-1")
+
+    other = copy.deepcopy(OVERRIDES)
+    other["ServiceRole"] = "EMR_OtherRole"
+    other_id, reused = emr_lease.lease_cluster(emr, other, "dag/run-2", settle_seconds=0)
+    assert not reused and other_id != cluster_id
+
+
+def test_expired_lease_is_taken_over(emr):
+    cluster_id, _ = emr_lease.lease_cluster(emr, OVERRIDES, "dag/crashed", settle_seconds=0)
+    expired = int(time.time()) - 60
+    emr.add_tags(ResourceId=cluster_id, Tags=[{"Key": emr_lease.LEASE_TAG, "Value": f"dag/crashed|{expired}"}])
+
+    assert emr_lease.find_idle_clusters(emr, emr_lease.config_hash(OVERRIDES)) == [cluster_id]
+    leased, reused = emr_lease.lease_cluster(emr, OVERRIDES, "dag/run-2", settle_seconds=0)
+    assert reused and leased == cluster_id
+    # The crashed run no longer owns it and cannot release it
+    assert not emr_lease.release(emr, cluster_id, "dag/crashed")
+    assert emr_lease.lease_owner(emr_lease.cluster_tags(emr, cluster_id)) == "dag/run-2"
+
+
+def test_acquire_fails_when_another_run_holds_the_lease(emr):
+    cluster_id, _ = emr_lease.lease_cluster(emr, OVERRIDES, "dag/run-1", settle_seconds=0)
+    assert not emr_lease.acquire(emr, cluster_id, "dag/run-2", settle_seconds=0)
+    assert emr_lease.lease_owner(emr_lease.cluster_tags(emr, cluster_id)) == "dag/run-1"
+
+
+def test_callables_release_leased_clusters_and_terminate_ephemeral_ones(emr):
+    acquire = emr_lease.acquire_callable(OVERRIDES)
+    release = emr_lease.release_callable()
+
+    leased_ti = FakeTaskInstance()
+    leased_ctx = context("run-1", {"cluster_mode": "lease"}, leased_ti)
+    leased_ti.xcom["return_value"] = leased_id = acquire(**leased_ctx)
+    release(**leased_ctx)
+    assert state(emr, leased_id) == "WAITING"
+    assert emr_lease.lease_owner(emr_lease.cluster_tags(emr, leased_id)) is None
+
+    ephemeral_ti = FakeTaskInstance()
+    ephemeral_ctx = context("run-2", {}, ephemeral_ti)
+    ephemeral_ti.xcom["return_value"] = ephemeral_id = acquire(**ephemeral_ctx)
+    assert ephemeral_id != leased_id
+    release(**ephemeral_ctx)
+    assert state(emr, ephemeral_id) in ("TERMINATING", "TERMINATED")
+
+
+def test_unknown_cluster_mode_is_rejected(emr):
+    with pytest.raises(ValueError, match="cluster_mode"):
+        emr_lease.acquire_callable(OVERRIDES)(**context("run-1", {"cluster_mode": "shared"}))
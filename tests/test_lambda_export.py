@@ -0,0 +1,261 @@
+"""Local run of the Snowflake -> S3 export Lambda: fake Snowflake cursors and a moto S3 bucket.
+
+    pip install pytest moto boto3 pyarrow
+    python -m pytest tests/test_lambda_export.py
+"""
+import io
+import json
+import os
+import re
+import sys
+import threading
+import time
+import types
+
+import pytest
+
+pa = pytest.importorskip("pyarrow")
+pq = pytest.importorskip("pyarrow.parquet")
+boto3 = pytest.importorskip("boto3")
+moto = pytest.importorskip("moto")
+
+# The handler imports the connector at module level; the tests never connect
+if "snowflake.connector" not in sys.modules:
+    try:
+        import snowflake.connector  # noqa: F401
+    except ImportError:
+        snowflake = types.ModuleType("snowflake")
+        snowflake.connector = types.ModuleType("snowflake.connector")
+        sys.modules["snowflake"] = snowflake
+        sys.modules["snowflake.connector"] = snowflake.connector
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "modules", "lambda", "lambda_script"))
+import lambda_function  # noqa: E402
+
+BUCKET = "imba-test-bucket"
+DATE_PREFIX = "2024/01/02"
+STATS = re.compile(r"SELECT COUNT\(\*\), MIN\((\w+)\), MAX\(\w+\) FROM (\w+)")
+SELECT = re.compile(r"SELECT \* FROM (\w+)(?: WHERE (\w+) >= (-?\d+) AND \w+ < (-?\d+))?$")
+
+
+class FakeCursor:
+    """The DB-API calls the export makes, answered from in-memory Arrow tables"""
+
+    def __init__(self, tables, queries, fail_on=None):
+        self.tables = tables
+        self.queries = queries
+        self.fail_on = fail_on
+        self.result = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def execute(self, query):
+        self.queries.append(query)
+        stats, select = STATS.match(query), SELECT.match(query)
+        if stats:
+            key, table = stats.groups()
+            values = self.tables.get(table, pa.table({key: pa.array([], pa.int64())})).column(key).to_pylist()
+            self.result = (len(values), min(values, default=None), max(values, default=None))
+        elif select:
+            table, key, lower, upper = select.groups()
+            data = self.tables.get(table, pa.table({}))
+            if key is not None:
+                values = data.column(key).to_pylist()
+                data = data.filter(pa.array([int(lower) <= v < int(upper) for v in values]))
+            self.result = data
+        else:
+            raise AssertionError(f"Unexpected query: {query}")
+
+    def fetchone(self):
+        return self.result
+
+    def fetch_arrow_batches(self):
+        # Two-row batches with alternating integer widths, like the connector's NUMBER columns
+        for offset in range(0, self.result.num_rows, 2):
+            if self.fail_on and self.fail_on in self.queries[-1]:
+                raise RuntimeError("warehouse suspended")
+            batch = self.result.slice(offset, 2)
+            width = pa.int8() if offset % 4 == 0 else pa.int32()
+            yield batch.cast(pa.schema([
+                pa.field(f.name, width) if pa.types.is_integer(f.type) else f for f in batch.schema
+            ]))
+
+
+class FakeConnection:
+    def __init__(self, tables, fail_on=None):
+        self.tables = tables
+        self.fail_on = fail_on
+        self.queries = []
+
+    def cursor(self):
+        return FakeCursor(self.tables, self.queries, self.fail_on)
+
+
+def source_tables():
+    return {
+        "products": pa.table({"product_id": list(range(1, 8)), "product_name": [f"p{i}" for i in range(1, 8)]}),
+        "orders": pa.table({"order_id": list(range(10, 20)), "user_id": [i % 3 for i in range(10, 20)]}),
+    }
+
+
+def read_exported(s3, keys):
+    tables = [pq.read_table(io.BytesIO(s3.get_object(Bucket=BUCKET, Key=key)["Body"].read())) for key in keys]
+    return pa.concat_tables(tables) if tables else None
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    monkeypatch.setenv("AWS_DEFAULT_REGION", "us-east-1")
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    with moto.mock_aws():
+        client = boto3.client("s3")
+        client.create_bucket(Bucket=BUCKET)
+        yield client
+
+
+def test_plan_chunks_covers_every_key_once():
+    cur = FakeCursor(source_tables(), [])
+    chunks = lambda_function.plan_chunks(cur, {"orders": "order_id", "aisles": "aisle_id"}, chunk_rows=3)
+
+    orders = [c for c in chunks if c["table"] == "orders"]
+    assert [(c["lower"], c["upper"]) for c in orders] == [(10, 13), (13, 16), (16, 19), (19, 20)]
+    assert [c for c in chunks if c["table"] == "aisles"] == [{
+        "id": "aisles-0000", "table": "aisles", "key": "aisle_id", "lower": None, "upper": None,
+        "status": "pending", "keys": [], "rows": 0,
+    }]
+
+
+def test_run_export_writes_every_table_and_commits(s3):
+    conn = FakeConnection(source_tables())
+    assert lambda_function.run_export(conn, s3, BUCKET, DATE_PREFIX, max_workers=2) == 0
+
+    manifest = lambda_function.ExportManifest(s3, BUCKET, DATE_PREFIX)
+    assert manifest.load() and not manifest.pending()
+    for table, source in source_tables().items():
+        keys = [key for chunk in manifest.chunks if chunk["table"] == table for key in chunk["keys"]]
+        exported = read_exported(s3, keys)
+        assert exported.sort_by(lambda_function.TABLE_KEYS[table]).to_pylist() == source.to_pylist()
+        # Integer columns are widened to one type across batches
+        assert exported.schema.field(lambda_function.TABLE_KEYS[table]).type == pa.int64()
+
+    success = json.loads(s3.get_object(Bucket=BUCKET, Key=manifest.success_key)["Body"].read())
+    assert success["products"] == 7 and success["orders"] == 10 and success["aisles"] == 0
+
+
+def test_run_export_resumes_pending_chunks_and_replaces_their_stale_files(s3):
+    tables = source_tables()
+    chunks = lambda_function.plan_chunks(FakeCursor(tables, []), {"products": "product_id", "orders": "order_id"})
+    manifest = lambda_function.ExportManifest(s3, BUCKET, DATE_PREFIX)
+    manifest.chunks = chunks
+    done, pending = chunks
+    with FakeConnection(tables).cursor() as cur:
+        keys, rows = lambda_function.export_query(
+            cur, lambda_function.chunk_query(done), s3, BUCKET, f"{lambda_function.OUTPUT_PREFIX}/products/{DATE_PREFIX}",
+            "part_0000",
+        )
+    done.update(status="done", keys=keys, rows=rows)
+    manifest.save()
+    # A file from an attempt interrupted after its upload, which the manifest never recorded
+    stale = f"{lambda_function.OUTPUT_PREFIX}/orders/{DATE_PREFIX}/part_0000_00007.parquet"
+    s3.put_object(Bucket=BUCKET, Key=stale, Body=b"partial")
+
+    conn = FakeConnection(tables)
+    assert lambda_function.run_export(conn, s3, BUCKET, DATE_PREFIX) == 0
+
+    assert conn.queries == [lambda_function.chunk_query(pending)]
+    listed = s3.list_objects_v2(Bucket=BUCKET, Prefix=f"{lambda_function.OUTPUT_PREFIX}/orders/")
+    assert stale not in [obj["Key"] for obj in listed["Contents"]]
+    assert manifest.load() and not manifest.pending()
+
+
+def test_run_export_stops_before_the_timeout(s3):
+    conn = FakeConnection(source_tables())
+    remaining = lambda_function.run_export(conn, s3, BUCKET, DATE_PREFIX, remaining_ms=lambda: 0)
+
+    assert remaining == len(lambda_function.TABLE_KEYS)
+    assert not s3.list_objects_v2(Bucket=BUCKET, Prefix=f"{lambda_function.OUTPUT_PREFIX}/_manifests/{DATE_PREFIX}/_SUCCESS").get("Contents")
+
+
+def test_failed_chunk_keeps_the_others_checkpointed(s3):
+    conn = FakeConnection(source_tables(), fail_on="FROM orders")
+    with pytest.raises(RuntimeError, match="warehouse suspended"):
+        lambda_function.run_export(conn, s3, BUCKET, DATE_PREFIX, max_workers=1)
+
+    manifest = lambda_function.ExportManifest(s3, BUCKET, DATE_PREFIX)
+    assert manifest.load()
+    assert [c["table"] for c in manifest.pending()] == ["orders"]
+    assert not s3.list_multipart_uploads(Bucket=BUCKET).get("Uploads")
+
+
+def test_sink_abort_discards_the_open_upload(s3):
+    sink = lambda_function.ParquetS3Sink(s3, BUCKET, "out", row_group_rows=2)
+    sink.write(source_tables()["products"].slice(0, 2))
+    assert len(s3.list_multipart_uploads(Bucket=BUCKET)["Uploads"]) == 1
+
+    sink.abort()
+    assert not s3.list_multipart_uploads(Bucket=BUCKET).get("Uploads")
+    assert not s3.list_objects_v2(Bucket=BUCKET, Prefix="out/").get("Contents")
+
+
+def test_export_query_reports_the_query_error_when_the_abort_fails(s3, monkeypatch):
+    def failing_abort(self):
+        raise RuntimeError("abort denied")
+
+    monkeypatch.setattr(lambda_function.ParquetS3Sink, "abort", failing_abort)
+    conn = FakeConnection(source_tables(), fail_on="FROM orders")
+    with conn.cursor() as cur, pytest.raises(RuntimeError, match="warehouse suspended"):
+        lambda_function.export_query(cur, "SELECT * FROM orders", s3, BUCKET, "out")
+
+
+def test_delete_prefix_raises_on_per_key_errors():
+    class DeniedS3:
+        def get_paginator(self, name):
+            return self
+
+        def paginate(self, Bucket, Prefix):
+            return [{"Contents": [{"Key": f"{Prefix}00000.parquet"}]}]
+
+        def delete_objects(self, Bucket, Delete):
+            return {"Errors": [{"Key": Delete["Objects"][0]["Key"], "Code": "AccessDenied"}]}
+
+    with pytest.raises(RuntimeError, match="AccessDenied"):
+        lambda_function.delete_prefix(DeniedS3(), BUCKET, "snowflake-parquet/orders/2024/01/02/part_0000_")
+
+
+def test_run_export_submits_chunks_as_workers_free_up(s3):
+    class CountingConnection(FakeConnection):
+        def __init__(self, tables):
+            super().__init__(tables)
+            self.lock = threading.Lock()
+            self.active = self.peak = 0
+
+        def cursor(self):
+            connection = self
+            cursor = super().cursor()
+
+            class Counted:
+                def __enter__(self):
+                    with connection.lock:
+                        connection.active += 1
+                        connection.peak = max(connection.peak, connection.active)
+                    time.sleep(0.05)
+                    return cursor
+
+                def __exit__(self, *exc):
+                    with connection.lock:
+                        connection.active -= 1
+                    return False
+            return Counted()
+
+    conn = CountingConnection(source_tables())
+    # Planning uses one cursor, every chunk another; the time check allows three chunks to start
+    checks = iter([float("inf")] * 3 + [0] * 10)
+    remaining = lambda_function.run_export(conn, s3, BUCKET, DATE_PREFIX, remaining_ms=lambda: next(checks), max_workers=2)
+
+    assert remaining == len(lambda_function.TABLE_KEYS) - 3
+    assert conn.peak <= 2
@@ -0,0 +1,123 @@
+"""Source change detection (scripts/dags/source_fingerprint.py).
+
+The fingerprint tests run against a local PostgreSQL given by IMBA_TEST_PG_DSN, and are
+skipped without it. They create and drop their own imba_fp_test_* tables in public:
+
+    docker run -d -p 5432:5432 -e POSTGRES_PASSWORD=postgres postgres:16
+    pip install pytest psycopg2-binary boto3
+    IMBA_TEST_PG_DSN="host=localhost user=postgres password=postgres" python -m pytest tests/test_source_fingerprint.py
+"""
+import json
+import os
+import sys
+import time
+
+import pytest
+
+pytest.importorskip("boto3")
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts", "dags"))
+import source_fingerprint  # noqa: E402
+
+DSN = os.environ.get("IMBA_TEST_PG_DSN")
+ORDERS = "imba_fp_test_orders"
+LINES = "imba_fp_test_order_products"
+TABLES = (ORDERS, LINES)
+# The statistics collector reports committed writes asynchronously
+STATS_TIMEOUT_SECONDS = 10
+
+
+def test_changed_tables_without_previous_fingerprint_is_every_table():
+    current = {"orders": {"n_tup_ins": 3}, "aisles": {"n_tup_ins": 1}}
+    assert source_fingerprint.changed_tables(current, {}) == ["aisles", "orders"]
+
+
+def test_changed_tables_compares_every_field():
+    stats = {"n_tup_ins": 3, "n_tup_upd": 0, "n_tup_del": 0, "relation_bytes": 8192, "max_pk": 3}
+    previous = {"orders": dict(stats), "aisles": dict(stats)}
+    assert source_fingerprint.changed_tables(previous, previous) == []
+    for field in source_fingerprint.FINGERPRINT_FIELDS:
+        current = {"orders": dict(stats, **{field: 4}), "aisles": dict(stats)}
+        assert source_fingerprint.changed_tables(current, previous) == ["orders"]
+
+
+def test_table_mappings_select_the_given_tables_or_all():
+    assert source_fingerprint.table_mappings()["rules"][0]["object-locator"] == {"schema-name": "public", "table-name": "%"}
+    rules = source_fingerprint.table_mappings(["orders", "aisles"])["rules"]
+    assert [(r["rule-id"], r["object-locator"]["table-name"]) for r in rules] == [("1", "orders"), ("2", "aisles")]
+
+
+@pytest.fixture
+def conn():
+    if not DSN:
+        pytest.skip("IMBA_TEST_PG_DSN is not set")
+    psycopg2 = pytest.importorskip("psycopg2")
+    connection = psycopg2.connect(DSN)
+    connection.autocommit = True
+    with connection.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {ORDERS}, {LINES}")
+        cur.execute(f"CREATE TABLE {ORDERS} (order_id INTEGER PRIMARY KEY, user_id INTEGER NOT NULL)")
+        cur.execute(f"CREATE TABLE {LINES} (order_id INTEGER, product_id INTEGER, PRIMARY KEY (order_id, product_id))")
+        cur.execute(f"INSERT INTO {ORDERS} VALUES (1, 10), (2, 10), (3, 11)")
+        cur.execute(f"INSERT INTO {LINES} VALUES (1, 100), (1, 101), (2, 100)")
+    wait_for_stats(connection, {ORDERS: 3, LINES: 3})
+    yield connection
+    with connection.cursor() as cur:
+        cur.execute(f"DROP TABLE IF EXISTS {ORDERS}, {LINES}")
+    connection.close()
+
+
+def wait_for_stats(connection, inserted: dict) -> None:
+    """Block until pg_stat_user_tables shows the inserts (statistics are flushed asynchronously)"""
+    deadline = time.time() + STATS_TIMEOUT_SECONDS
+    while True:
+        current = source_fingerprint.fingerprint(connection, TABLES)
+        if all(current.get(table, {}).get("n_tup_ins", 0) >= rows for table, rows in inserted.items()):
+            return
+        if time.time() > deadline:
+            raise AssertionError(f"Statistics did not reach {inserted}: {current}")
+        time.sleep(0.2)
+
+
+def settled_fingerprint(connection, previous: dict) -> dict:
+    """The first fingerprint that differs from previous, or the last one after the timeout"""
+    deadline = time.time() + STATS_TIMEOUT_SECONDS
+    while True:
+        current = source_fingerprint.fingerprint(connection, TABLES)
+        if source_fingerprint.changed_tables(current, previous) or time.time() > deadline:
+            return current
+        time.sleep(0.2)
+
+
+def test_fingerprint_reads_statistics_and_primary_key(conn):
+    current = source_fingerprint.fingerprint(conn, TABLES)
+
+    assert set(current) == set(TABLES)
+    assert current[ORDERS]["n_tup_ins"] == 3 and current[ORDERS]["max_pk"] == 3
+    assert current[ORDERS]["relation_bytes"] > 0
+    # Composite keys have no single max
+    assert current[LINES]["max_pk"] is None
+    # JSON-safe, so it compares equal after a round trip through S3 or XCom
+    assert json.loads(json.dumps(current)) == current
+
+
+def test_fingerprint_is_stable_without_writes(conn):
+    first = source_fingerprint.fingerprint(conn, TABLES)
+    time.sleep(1)
+    assert source_fingerprint.changed_tables(source_fingerprint.fingerprint(conn, TABLES), first) == []
+
+
+@pytest.mark.parametrize("statement", [
+    f"INSERT INTO {ORDERS} VALUES (4, 12)",
+    f"UPDATE {ORDERS} SET user_id = 13 WHERE order_id = 1",
+    f"DELETE FROM {ORDERS} WHERE order_id = 2",
+])
+def test_writes_change_only_their_table(conn, statement):
+    previous = source_fingerprint.fingerprint(conn, TABLES)
+    with conn.cursor() as cur:
+        cur.execute(statement)
+    assert source_fingerprint.changed_tables(settled_fingerprint(conn, previous), previous) == [ORDERS]
+
+
+def test_missing_tables_are_left_out(conn):
+    assert set(source_fingerprint.fingerprint(conn, (ORDERS, "imba_fp_test_missing"))) == {ORDERS}